@@ -1,13 +1,26 @@
 #! /usr/bin/env python
 
 import os
+import sys
+import subprocess
+import multiprocessing
 from glob import glob
 
-examples = glob("examples/*.py")
-examples.remove("examples/generate.py")
-print "Generating html"
-for in_file in examples:
-    print "  processing: ", in_file
+def generate(in_file):
     out_file = os.path.splitext(in_file)[0] + ".html"
-    os.system("python %s > %s" % (in_file, out_file))
-print "Done."
+    out = open(out_file, "w")
+    try:
+        return in_file, subprocess.call([sys.executable, in_file], stdout=out)
+    finally:
+        out.close()
+
+if __name__ == "__main__":
+    examples = glob("examples/*.py")
+    examples.remove("examples/generate.py")
+    print "Generating html"
+    pool = multiprocessing.Pool()
+    for in_file, r in pool.imap_unordered(generate, examples):
+        print "  processed: ", in_file
+    pool.close()
+    pool.join()
+    print "Done."
@@ -91,6 +91,12 @@ py_builtins.__exceptions__ = [
     'StopIteration'
 ];
 
+// @provides py_builtins.NotImplementedError py_builtins.ZeroDivisionError
+// @provides py_builtins.AssertionError py_builtins.AttributeError
+// @provides py_builtins.RuntimeError py_builtins.ImportError
+// @provides py_builtins.TypeError py_builtins.ValueError py_builtins.NameError
+// @provides py_builtins.IndexError py_builtins.KeyError
+// @provides py_builtins.StopIteration
 for (var i in py_builtins.__exceptions__) {
     var name = py_builtins.__exceptions__[i];
 
@@ -365,6 +371,32 @@ function iter(obj) {
     }
 }
 
+/*
+   Returns the array (or string) that iter(obj) would walk, or null if 'obj'
+   has to be iterated using the iterator protocol. Compiled 'for' loops use
+   this to index into builtin sequences directly.
+*/
+// @optional __builtins__
+py_builtins.iter_items = function(obj) {
+    if (obj instanceof Array || typeof(obj) === "string") {
+        return obj;
+    } else if (obj == null) {
+        return null;
+    } else if (obj.__iter__ === _tuple.prototype.__iter__) {
+        return obj._items;
+    } else if (obj.__iter__ === _str.prototype.__iter__) {
+        return obj._obj;
+    } else if (obj.__iter__ === _dict.prototype.__iter__) {
+        return obj.keys();
+    } else if (typeof(__builtins__) != 'undefined' &&
+            (obj.__class__ === __builtins__.list ||
+             obj.__class__ === __builtins__.tuple)) {
+        return obj._list;
+    } else {
+        return null;
+    }
+};
+
 function _iter(seq) {
     this.__init__(seq);
 }
@@ -1079,8 +1111,8 @@ _str.prototype.count = function(str, start, end) {
     if (!defined(end))
         end = null;
     var count = 0;
-    s = this.__getitem__(slice(start, end));
-    idx = s.find(str);
+    var s = this.__getitem__(slice(start, end));
+    var idx = s.find(str);
     while (idx != -1) {
         count += 1;
         s = s.__getitem__(slice(idx+1, null));
@@ -1114,7 +1146,7 @@ _str.prototype.find = function(s) {
 };
 
 _str.prototype.rfind = function(s) {
-    rev = function(s) {
+    var rev = function(s) {
         var a = list(str(s));
         a.reverse();
         a = str("").join(a);
@@ -1663,7 +1695,7 @@ var extend = function(cls, base_list) {
     //properties not defined in the original definition
     cls.prototype.__inherited__ = {};
     for (var i = 1; i < _mro.length; i++){
-        base = _mro[i];
+        var base = _mro[i];
         for(var property in base.prototype){
             if(!(property in cls.prototype) && !(property in base.prototype.__inherited__)){
                 cls.prototype[property] = base.prototype[property];
@@ -1684,6 +1716,107 @@ var extend = function(cls, base_list) {
     }
 }
 
+/* Defines the class 'name' with the list of base classes 'bases'.
+   'members' maps the names of the methods and class attributes to their
+   values. The names listed in 'plain' (attributes and static methods) are
+   put on the class as they are; the other methods get an unbound version
+   there, which takes the instance as the first argument. */
+
+function $class(name, bases, members, plain) {
+    var cls = function() {
+        if (!(this instanceof cls)) {
+            var t = new cls();
+            t.__init__.apply(t, arguments);
+            return t;
+        }
+    };
+    var unbound = function(key) {
+        return function() {
+            cls.prototype[key].apply(arguments[0], Array.slice(arguments, 1));
+        };
+    };
+    var has = Object.prototype.hasOwnProperty;
+    var is_plain = {};
+    for (var i = 0; plain && i < plain.length; i++) {
+        is_plain[plain[i]] = true;
+    }
+    cls.__name__ = name;
+    cls.prototype.__class__ = cls;
+    cls.prototype.toString = _iter.prototype.toString;
+    for (var key in members) {
+        if (has.call(members, key)) {
+            cls.prototype[key] = members[key];
+            cls[key] = has.call(is_plain, key) ? members[key] : unbound(key);
+        }
+    }
+    extend(cls, bases);
+    return cls;
+}
+
+/* Modules of programs that are split into chunks (see --split in
+   py2js.py). $define() registers a module, which runs on its first
+   $import(). Modules that aren't there yet are looked up in $import.chunks,
+   and their chunk is loaded with $import.loader($import.base + file). The
+   loader can be replaced, e.g. to read local files. */
+
+var $modules = {};
+
+function $define(name, init) {
+    $modules[name] = {init: init, exports: {}, done: false};
+}
+
+/* Imports the module 'name' and the packages it is in, and returns the
+   module 'result' (by default 'name'). A module whose code raises an
+   exception runs again when it is imported the next time. */
+
+function $import(name, result) {
+    var parts = name.split('.');
+    var parent = null;
+    for (var i = 1; i <= parts.length; i++) {
+        var prefix = parts.slice(0, i).join('.');
+        if (!$modules.hasOwnProperty(prefix)) {
+            if (!$import.chunks.hasOwnProperty(prefix)) {
+                throw new py_builtins.ImportError("no module named " + prefix);
+            }
+            $import.loader($import.base + $import.chunks[prefix]);
+            if (!$modules.hasOwnProperty(prefix)) {
+                throw new py_builtins.ImportError("no module named " + prefix +
+                    " in " + $import.chunks[prefix]);
+            }
+        }
+        var m = $modules[prefix];
+        if (!m.done) {
+            m.done = true;
+            try {
+                m.init(m.exports);
+            } catch (e) {
+                // like Python, run it again on the next import:
+                m.done = false;
+                m.exports = {};
+                throw e;
+            }
+        }
+        if (parent !== null) {
+            parent[parts[i - 1]] = m.exports;
+        }
+        parent = m.exports;
+    }
+    return result ? $modules[result].exports : parent;
+}
+
+$import.chunks = {};
+$import.base = '';
+$import.loader = function(url) {
+    var request = new XMLHttpRequest();
+    // imports are synchronous in Python:
+    request.open('GET', url, false);
+    request.send(null);
+    if (request.status !== 200 && request.status !== 0) {
+        throw new py_builtins.ImportError("cannot load " + url);
+    }
+    (0, eval)(request.responseText);
+};
+
 var mro = function(cls, base_list) {
     var order = [];
     if (cls === object) {
@@ -1698,10 +1831,10 @@ var mro = function(cls, base_list) {
     }
     orderlists[orderlists.length] = [cls].concat(base_list);
     while (orderlists.length > 0) {
-        candidate_found = false;
+        var candidate_found = false;
         for (var i = 0; i < orderlists.length; i++){
-            candidatelist = orderlists[i]
-            candidate = candidatelist[0];
+            var candidatelist = orderlists[i]
+            var candidate = candidatelist[0];
             if(mro_not_blocking(candidate,orderlists)){
                 /**good candidate */
                 candidate_found = true;
@@ -1734,9 +1867,9 @@ var mro_not_blocking = function(candidate, orderlists) {
 }
 
 var _super = function(cls,instance){
-    super_instance = {};
-    _mro = instance.__mro__;
-    cls_name = cls.__name__;
+    var super_instance = {};
+    var _mro = instance.__mro__;
+    var cls_name = cls.__name__;
     function make_caller(base, property){
         var f = function(){
             base.prototype[property].apply(instance,arguments);
@@ -1753,7 +1886,7 @@ var _super = function(cls,instance){
         throw new py_builtins.AttributeError(instance, cls_name);}
     k = k + 1;
     for (var i = k; i < _mro.length; i++){
-        base = _mro[i];
+        var base = _mro[i];
         for(var property in base.prototype){
             if(!(property in super_instance)){
                 try{
@@ -2055,10 +2188,10 @@ if (!Array.prototype.indexOf)
 if (!Array.slice)
 {
     Array.slice= function(){
-        array_like = arguments[0];
-        start = arguments[1];
-        end = arguments[2];
-        arr=[];
+        var array_like = arguments[0];
+        var start = arguments[1];
+        var end = arguments[2];
+        var arr = [];
         if(end === undefined){
             for(var i = start; i < array_like.length; i++){
                 arr[i-start] = array_like[i];
@@ -2084,6 +2217,7 @@ var __not_implemented__ = function __not_implemented__(name) {
     };
 };
 
+// @provides __builtins__
 module('<builtin>/sys.py', function sys_module(_) {
     _.__doc__ = "The PJs module responsible for system stuff";
     _.modules = {'sys':_}; // sys and __builtin__ won't be listed
@@ -2095,6 +2229,7 @@ module('<builtin>/sys.py', function sys_module(_) {
     });
 });
 
+// @provides __builtins__
 module('<builtin>/os/path.py', function os_path_module(_) {
     _.__doc__ = "a module for dealing with paths";
     _.join = $m({}, true, function join(first, args) {
@@ -2153,6 +2288,7 @@ module('<builtin>/os/path.py', function os_path_module(_) {
     });
 });
 
+// @provides __builtins__
 module('<builtin>/__builtin__.py', function builting_module(_) {
 
     var sys = __module_cache['<builtin>/sys.py']._module;
@@ -3547,7 +3683,9 @@ module('<builtin>/__builtin__.py', function builting_module(_) {
     });
 });
 
+// @provides __builtins__
 __module_cache['<builtin>/sys.py'].load('sys'); // must be loaded for importing to work.
+// @provides __builtins__
 __module_cache['<builtin>/os/path.py'].load('os.path');
 var __builtins__ = __module_cache['<builtin>/__builtin__.py'].load('__builtin__');
 var __import__ = __builtins__.__import__; // should I make this global?
@@ -85,17 +85,575 @@ module Python version "$Revision: 62047 $"
 }
 """
 
+import os
+import re
+import sys
+import json
+import time
 import ast
+import copy
+import gzip
+import base64
+import shutil
+import string
+import pkgutil
+import hashlib
 import inspect
+import operator
+import tempfile
+import tokenize
+import itertools
+import traceback
+import threading
+import multiprocessing
+from Queue import Queue, Empty
+from StringIO import StringIO
+from collections import OrderedDict, deque
+from SocketServer import ThreadingMixIn
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+import __future__
 from optparse import OptionParser
 
+# The runtime library that the generated code depends on:
+BUILTINS = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    "py-builtins.js")
+
 def scope(func):
     func.scope = True
     return func
 
+def postorder(node, children):
+    """
+    Yields the nodes of the tree 'node' in post-order, without recursion.
+
+    children(node) returns the list of children of 'node' to enter.
+    """
+    stack = [(node, False)]
+
+    while stack:
+        node, expanded = stack.pop()
+
+        if expanded:
+            yield node
+        else:
+            stack.append((node, True))
+            stack.extend([ (child, False)
+                for child in reversed(children(node)) ])
+
+# the nodes without anything to look at, which child_nodes() leaves out:
+operator_nodes = frozenset([ cls
+    for base in (ast.expr_context, ast.boolop, ast.operator, ast.unaryop,
+        ast.cmpop)
+    for cls in base.__subclasses__() ])
+
+# expressions and statements that neither bind names nor open a scope:
+plain_nodes = frozenset([ast.Attribute, ast.Call, ast.Subscript, ast.Index,
+    ast.Slice, ast.BinOp, ast.BoolOp, ast.UnaryOp, ast.Compare, ast.Num,
+    ast.Str, ast.Tuple, ast.List, ast.Dict, ast.keyword, ast.Expr,
+    ast.Return, ast.If, ast.While, ast.Print])
+
+def child_nodes(node):
+    """
+    Returns the children of 'node' like ast.iter_child_nodes(), except for
+    contexts and operators.
+    """
+    children = []
+
+    for name in node._fields:
+        field = getattr(node, name, None)
+        if isinstance(field, ast.AST):
+            if field.__class__ not in operator_nodes:
+                children.append(field)
+        elif isinstance(field, list):
+            children.extend([ item for item in field
+                if isinstance(item, ast.AST) ])
+
+    return children
+
+def walk(node):
+    """
+    Yields the nodes of the tree 'node', like ast.walk() but in no
+    particular order and faster, as names and operators aren't entered.
+    """
+    stack = [node]
+
+    while stack:
+        node = stack.pop()
+        yield node
+        if node.__class__ is not ast.Name:
+            stack.extend(child_nodes(node))
+
 class JSError(Exception):
     pass
 
+class TypeInference(object):
+    """
+    Infers the types of local variables of a single scope.
+
+    The analysis is flow insensitive: a variable gets a type only if every
+    binding of it in the scope provably produces a value of that type, so
+    the result holds at any point of the scope. Anything that can't be
+    proven (parameters, globals, tuple unpacking, ...) is left out.
+    """
+
+    numeric = ('int', 'float')
+
+    def __init__(self, shadowed=()):
+        # names of builtins rebound by the program, we can't trust those:
+        self.shadowed = set(shadowed)
+
+    def bindings(self, body):
+        """Returns a list of (name, kind, node) for all bindings in 'body'. """
+        bindings = []
+        stack = list(reversed(body))
+
+        while stack:
+            node = stack.pop()
+
+            # names are most of the nodes, and have no children to enter:
+            if node.__class__ is ast.Name:
+                if not isinstance(node.ctx, ast.Load):
+                    bindings.append((node.id, None, node))
+                continue
+            elif node.__class__ in plain_nodes:
+                stack.extend(reversed(child_nodes(node)))
+                continue
+            elif isinstance(node, (ast.FunctionDef, ast.ClassDef)):
+                bindings.append((node.name, None, node))
+                continue
+            elif isinstance(node, ast.Lambda):
+                continue
+            elif isinstance(node, ast.Assign):
+                for target in node.targets:
+                    if isinstance(target, ast.Name):
+                        bindings.append((target.id, 'assign', node.value))
+                    else:
+                        for name in self.names(target):
+                            bindings.append((name, None, node))
+                stack.append(node.value)
+                continue
+            elif isinstance(node, ast.AugAssign):
+                if isinstance(node.target, ast.Name):
+                    bindings.append((node.target.id, 'aug', node))
+                    stack.append(node.value)
+                    continue
+            elif isinstance(node, ast.For):
+                if isinstance(node.target, ast.Name) and self.is_range(node.iter):
+                    bindings.append((node.target.id, 'int', node))
+                else:
+                    for name in self.names(node.target):
+                        bindings.append((name, None, node))
+                stack.extend(reversed(node.orelse))
+                stack.extend(reversed(node.body))
+                stack.append(node.iter)
+                continue
+            elif isinstance(node, ast.Global):
+                for name in node.names:
+                    bindings.append((name, None, node))
+            elif isinstance(node, (ast.Import, ast.ImportFrom)):
+                for alias in node.names:
+                    name = alias.asname or alias.name.split('.')[0]
+                    bindings.append((name, None, node))
+            elif isinstance(node, ast.comprehension):
+                for name in self.names(node.target):
+                    bindings.append((name, None, node))
+
+            stack.extend(reversed(child_nodes(node)))
+
+        return bindings
+
+    def names(self, target):
+        """Returns the names that get bound by assigning to 'target'. """
+        return [ node.id for node in ast.walk(target)
+            if isinstance(node, ast.Name) and
+                not isinstance(node.ctx, ast.Load) ]
+
+    def bound_names(self, tree):
+        """Returns all names that are bound anywhere in 'tree'. """
+        names = set()
+
+        for node in walk(tree):
+            if isinstance(node, (ast.FunctionDef, ast.ClassDef)):
+                names.add(node.name)
+            elif isinstance(node, ast.Name) and \
+                    not isinstance(node.ctx, ast.Load):
+                names.add(node.id)
+            elif isinstance(node, (ast.Import, ast.ImportFrom)):
+                for alias in node.names:
+                    names.add(alias.asname or alias.name.split('.')[0])
+            elif isinstance(node, ast.Global):
+                names.update(node.names)
+
+        return names
+
+    def is_builtin_call(self, node, *names):
+        return isinstance(node, ast.Call) and \
+            isinstance(node.func, ast.Name) and \
+            node.func.id in names and \
+            node.func.id not in self.shadowed and \
+            not node.keywords and \
+            node.starargs is None and node.kwargs is None
+
+    def is_range(self, node):
+        return self.is_builtin_call(node, 'range', 'xrange') and \
+            1 <= len(node.args) <= 3
+
+    def infer(self, body, params=()):
+        """Returns a dict mapping local names of 'body' to their types. """
+        bindings = OrderedDict()
+
+        for name, kind, node in self.bindings(body):
+            bindings.setdefault(name, []).append((kind, node))
+
+        candidates = OrderedDict()
+
+        for name, binds in bindings.iteritems():
+            if name in params:
+                continue
+            if None in [ kind for kind, node in binds ]:
+                continue
+            candidates[name] = binds
+
+        # the candidates whose type depends on the type of each name:
+        dependents = {}
+
+        for name, binds in candidates.iteritems():
+            for kind, node in binds:
+                if kind == 'aug':
+                    dependents.setdefault(name, set()).add(name)
+                    node = node.value
+                elif kind != 'assign':
+                    continue
+                for expr in postorder(node, self.operands):
+                    if isinstance(expr, ast.Name) and expr.id in candidates:
+                        dependents.setdefault(expr.id, set()).add(name)
+
+        # iterate to a fixed point, starting with no type at all and only
+        # looking at a name again when a type it depends on changed:
+        types = dict.fromkeys(candidates)
+        work = deque(candidates)
+        queued = set(candidates)
+
+        while work:
+            name = work.popleft()
+            queued.discard(name)
+            type = None
+
+            for kind, node in candidates[name]:
+                if kind == 'assign':
+                    t = self.type_of(node, types)
+                elif kind == 'aug':
+                    t = self.binop_type(node.op,
+                        types.get(name), self.type_of(node.value, types))
+                else:
+                    t = kind
+
+                type = self.join(type, t)
+
+            if type != types[name]:
+                types[name] = type
+                for dependent in dependents.get(name, ()):
+                    if dependent not in queued:
+                        queued.add(dependent)
+                        work.append(dependent)
+
+        for name, type in types.items():
+            if type in (None, 'object'):
+                del types[name]
+
+        return types
+
+    def join(self, a, b):
+        if a is None:
+            return b
+        if b is None:
+            return a
+        if a == b:
+            return a
+        if a in self.numeric and b in self.numeric:
+            return 'float'
+        return 'object'
+
+    def binop_type(self, op, left, right):
+        if left in self.numeric and right in self.numeric:
+            if isinstance(op, ast.Div):
+                # JS division never truncates
+                return 'float'
+            if isinstance(op, (ast.LShift, ast.RShift,
+                    ast.BitOr, ast.BitXor, ast.BitAnd)):
+                return 'int'
+            return self.join(left, right)
+        if left is None or right is None:
+            return None
+        return 'object'
+
+    def operands(self, node):
+        cls = node.__class__
+        if cls is ast.Name or cls is ast.Num:
+            return []
+        elif cls is ast.BinOp:
+            return [node.left, node.right]
+        elif cls is ast.UnaryOp:
+            return [node.operand]
+        elif cls is ast.BoolOp:
+            return node.values
+        elif cls is ast.Compare:
+            return [node.left] + node.comparators
+        elif cls is ast.IfExp:
+            return [node.body, node.orelse]
+        else:
+            return []
+
+    def type_of(self, node, types):
+        """Returns the type of the expression 'node' or 'object'. """
+        results = {}
+        stack = [(node, False)]
+
+        # operands first, iteratively, as expressions can be very deep
+        while stack:
+            expr, expanded = stack.pop()
+            if not expanded:
+                operands = self.operands(expr)
+                if operands:
+                    stack.append((expr, True))
+                    stack.extend([ (operand, False)
+                        for operand in reversed(operands) ])
+                    continue
+            results[expr] = self.expr_type(expr, types, results)
+
+        return results[node]
+
+    def expr_type(self, node, types, operands):
+        if isinstance(node, ast.Num):
+            if isinstance(node.n, (int, long)):
+                return 'int'
+            elif isinstance(node.n, float):
+                return 'float'
+        elif isinstance(node, ast.Name):
+            if node.id in ('True', 'False'):
+                return 'bool'
+            if node.id in types:
+                return types[node.id]
+        elif isinstance(node, ast.BinOp):
+            return self.binop_type(node.op,
+                operands[node.left], operands[node.right])
+        elif isinstance(node, ast.UnaryOp):
+            operand = operands[node.operand]
+            if isinstance(node.op, ast.Not):
+                return 'bool'
+            if operand in self.numeric:
+                if isinstance(node.op, ast.Invert):
+                    return 'int'
+                return operand
+            if operand is None:
+                return None
+        elif isinstance(node, ast.BoolOp):
+            type = None
+            for value in node.values:
+                type = self.join(type, operands[value])
+            return type
+        elif isinstance(node, ast.Compare):
+            native = self.is_native_compare(node, operands)
+            if native:
+                return 'bool'
+            if native is None:
+                return None
+        elif isinstance(node, ast.IfExp):
+            return self.join(operands[node.body], operands[node.orelse])
+        elif isinstance(node, ast.List):
+            return 'list'
+        elif isinstance(node, ast.Tuple):
+            return 'tuple'
+        elif isinstance(node, ast.Call):
+            if self.is_builtin_call(node, 'len'):
+                return 'int'
+            if self.is_builtin_call(node, 'float'):
+                return 'float'
+            if self.is_builtin_call(node, 'range', 'list'):
+                return 'list'
+
+        return 'object'
+
+    def is_native_compare(self, node, operands):
+        """
+        True if the comparison 'node' evaluates to a JS boolean, None if
+        that isn't known yet. 'operands' maps its operands to their types.
+        """
+        if len(node.ops) != 1:
+            return False
+        op = node.ops[0]
+        if isinstance(op, (ast.Lt, ast.LtE, ast.Gt, ast.GtE, ast.Is,
+                ast.NotEq, ast.NotIn)):
+            return True
+        if isinstance(op, ast.Eq):
+            return self.is_primitive_types(operands[node.left],
+                operands[node.comparators[0]])
+        return False
+
+    def is_primitive_pair(self, left, right, types):
+        return self.is_primitive_types(self.type_of(left, types),
+            self.type_of(right, types))
+
+    def is_primitive_types(self, left, right):
+        if left is None or right is None:
+            return None
+        if left in self.numeric and right in self.numeric:
+            return True
+        return left == right == 'bool'
+
+base64_digits = \
+    "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/"
+
+def vlq(value):
+    """Encodes the integer 'value' as a Base64 VLQ for source maps. """
+    if value < 0:
+        value = (-value << 1) | 1
+    else:
+        value <<= 1
+    digits = []
+    while True:
+        digit = value & 31
+        value >>= 5
+        if value:
+            digit |= 32
+        digits.append(base64_digits[digit])
+        if not value:
+            return "".join(digits)
+
+class SourceMap(object):
+    """
+    A Source Map (version 3) from generated JavaScript back to the Python
+    file 'source', whose code 'content' is included if given.
+
+    'mappings' lists (line, column, source_line, source_column), all
+    counted from 0 as in the format.
+    """
+
+    def __init__(self, source, content=None, file=None):
+        self.source = source
+        self.content = content
+        self.file = file
+        self.mappings = []
+
+    def add(self, line, column, source_line, source_column):
+        self.mappings.append((line, column, source_line, source_column))
+
+    def shift(self, lines):
+        """Moves the generated code down by 'lines', e.g. for a header. """
+        self.mappings = [ (line + lines, column, source_line, source_column)
+            for line, column, source_line, source_column in self.mappings ]
+
+    def encode(self):
+        """Returns the "mappings" field of the source map. """
+        lines = []
+        previous = [0, 0]
+        for line, column, source_line, source_column in \
+                sorted(self.mappings):
+            while len(lines) <= line:
+                lines.append([])
+                last_column = 0
+            lines[line].append(vlq(column - last_column) + vlq(0) +
+                vlq(source_line - previous[0]) +
+                vlq(source_column - previous[1]))
+            last_column = column
+            previous = [source_line, source_column]
+        return ";".join([ ",".join(segments) for segments in lines ])
+
+    def dumps(self):
+        sourcemap = OrderedDict([
+            ("version", 3),
+            ("file", self.file or ""),
+            ("sources", [self.source]),
+            ("names", []),
+            ("mappings", self.encode()),
+        ])
+        if self.content is not None:
+            sourcemap["sourcesContent"] = [self.content]
+        return json.dumps(sourcemap)
+
+    def comment(self, url=None):
+        """
+        Returns the comment that links the generated code to the map at
+        'url', or to the map itself inlined as a data URL.
+        """
+        if url is None:
+            url = "data:application/json;charset=utf-8;base64," + \
+                base64.b64encode(self.dumps())
+        return "//# sourceMappingURL=%s" % url
+
+class Emitter(object):
+    """
+    Collects the generated code line by line.
+
+    Every line is indented according to the current level when it is
+    written and is written exactly once, either to a list of chunks (see
+    getvalue()) or straight to the file object 'stream'. With 'minify', the
+    lines go through a Minifier instead of being indented.
+
+    If a SourceMap 'sourcemap' is given, every line is mapped to
+    'position', the (lineno, col_offset) of the Python statement it comes
+    from, see JS.visit().
+    """
+
+    indentation = "    "
+
+    def __init__(self, stream=None, minify=False, sourcemap=None):
+        self.stream = stream
+        self.minify = minify
+        self.sourcemap = sourcemap
+        self.position = None
+        self.chunks = []
+        self.level = 0
+        self._prefix = ""
+        self._separator = ""
+        self._minifier = Minifier()
+        # where the next write goes, for the source map:
+        self._line = 0
+        self._column = 0
+
+    def write(self, text):
+        if self.stream is not None:
+            self.stream.write(text)
+        else:
+            self.chunks.append(text)
+
+        if self.sourcemap is not None:
+            newlines = text.count("\n")
+            if newlines:
+                self._line += newlines
+                self._column = len(text) - text.rindex("\n") - 1
+            else:
+                self._column += len(text)
+
+    def line(self, code):
+        if self.minify:
+            text = self._minifier.feed(code + "\n")
+        else:
+            text = self._separator + self._prefix + code
+            self._separator = "\n"
+
+        if self.sourcemap is not None and self.position is not None:
+            start = len(text) - len(text.lstrip())
+            if start < len(text):
+                self.write(text[:start])
+                lineno, col_offset = self.position
+                self.sourcemap.add(self._line, self._column, lineno - 1,
+                    col_offset)
+                text = text[start:]
+
+        self.write(text)
+
+    def indent(self):
+        self.level += 1
+        self._prefix = self.indentation * self.level
+
+    def dedent(self):
+        self.level -= 1
+        self._prefix = self.indentation * self.level
+
+    def getvalue(self):
+        return "".join(self.chunks)
+
 class JS(object):
 
     name_map = {
@@ -170,23 +728,157 @@ class JS(object):
             'IsNot' : "is not", # Not implemented yet
         }
 
-    def __init__(self):
+    def __init__(self, out=None):
+        self._dispatch = self.dispatch_table()
+        self.reset(out)
+
+    def reset(self, out=None):
+        """
+        Forgets everything about the previous translation, so that the
+        instance can be used for another one.
+        """
+        if out is None:
+            out = Emitter()
+        # This is where the generated code goes:
+        self.out = out
+
         self.dummy = 0
         self.classes = ['dict', 'list', 'tuple']
         # This is the name of the class that we are currently in:
         self._class_name = None
+        # ... and what ends its next method in the member table of
+        # $class(), if it is defined that way:
+        self._members = None
 
-        # This lists all variables in the local scope:
-        self._scope = []
+        # The SymbolTable of the current scope:
+        self._symbols = SymbolTable()
         #All calls to names within _class_names will be preceded by 'new'
         self._class_names = set()
         self._classes = {}
 
+        # Already translated subexpressions and the number of expressions
+        # being translated, see visit():
+        self._visited = {}
+        self._depth = 0
+
+        # Types of the local variables that could be proven, see
+        # TypeInference:
+        self._inference = TypeInference()
+        self._types = {}
+        self._globals = set()
+
+        # The Bundle and the name of the module being translated, which
+        # resolve the imports:
+        self._bundle = None
+        self._module = None
+
+        # Short names of the local variables in minified output, see
+        # local_renames():
+        self._renames = {}
+        self._next_local = 0
+
     def new_dummy(self):
-        dummy = "__dummy%d__" % self.dummy
+        if self.out.minify:
+            dummy = "$%d" % self.dummy
+        else:
+            dummy = "__dummy%d__" % self.dummy
         self.dummy += 1
         return dummy
 
+    def declare(self, name):
+        """
+        Returns "var " if assigning to the variable 'name' has to declare
+        it: at its first assignment outside of functions, unless it is
+        global. Functions declare their locals when they start, see
+        hoist().
+        """
+        symbols = self._symbols
+        if name in symbols.declared or symbols.kind == "function" and \
+                symbols.lookup(name) != "local":
+            return ""
+        symbols.declared.add(name)
+        return "var "
+
+    def hoist(self, node, renames):
+        """
+        Declares the locals of the function 'node', except its arguments,
+        with one 'var' at its start.
+        """
+        symbols = self._symbols
+        args = set(filter(None, [node.args.vararg, node.args.kwarg]))
+        for arg in node.args.args:
+            args.update(self._inference.names(arg))
+        symbols.declared.update(args)
+
+        names = sorted([ name for name in symbols.locals - args
+            if name not in self.name_map and name not in self.builtin ])
+        symbols.declared.update(names)
+        if names:
+            self.out.indent()
+            self.emit("var %s;" % ", ".join([ renames.get(name, name)
+                for name in names ]))
+            self.out.dedent()
+
+    def symbols(self, node):
+        """Returns the SymbolTable of the function or class 'node'. """
+        if node not in self._symbols.children:
+            # translated on its own, e.g. statement by statement:
+            self._symbols.add([node])
+        return self._symbols.children[node]
+
+    def short_name(self, i):
+        """
+        Returns the i-th short name for local variables. It contains a '$',
+        so that it can't collide with a Python name.
+        """
+        letters = string.ascii_letters
+        name = "$"
+        while True:
+            name = letters[i % len(letters)] + name
+            i = i // len(letters) - 1
+            if i < 0:
+                return name
+
+    def local_renames(self, node, symbols, keep_args=False):
+        """
+        Returns the names of the variables to use in the function 'node'
+        with the SymbolTable 'symbols': in minified output, its locals
+        (except the arguments if 'keep_args') get short names, see
+        short_name(). Functions that contain classes are left alone, as
+        their locals may turn into properties.
+        """
+        renames = dict(self._renames)
+        if not self.out.minify:
+            return renames
+
+        for name in global_names(node):
+            renames.pop(name, None)
+        names = set(symbols.locals)
+        names.difference_update(filter(None, [node.args.vararg,
+            node.args.kwarg]))
+        if keep_args:
+            for arg in node.args.args:
+                for name in self._inference.names(arg):
+                    renames.pop(name, None)
+                    names.discard(name)
+
+        for child in ast.walk(node):
+            if isinstance(child, ast.ClassDef):
+                return renames
+
+        for name in sorted(names):
+            if name in self.name_map or name in self.builtin:
+                continue
+            short = self.short_name(self._next_local)
+            if len(short) < len(name):
+                renames[name] = short
+                self._next_local += 1
+            else:
+                # shadows a renamed variable of an enclosing function:
+                renames.pop(name, None)
+
+        return renames
+
     def name(self, node):
         return node.__class__.__name__
 
@@ -202,27 +894,135 @@ class JS(object):
     def get_comparison_op(self, node):
         return self.comparison_op[node.__class__.__name__]
 
-    def visit(self, node, scope=None):
+    @classmethod
+    def dispatch_table(cls):
+        """Returns a dict mapping AST classes to the visitors of 'cls'. """
+        if '_dispatch_table' not in cls.__dict__:
+            table = {}
+
+            for name in dir(cls):
+                if name.startswith('visit_'):
+                    node_class = getattr(ast, name[len('visit_'):], None)
+
+                    if isinstance(node_class, type) and \
+                            issubclass(node_class, ast.AST):
+                        table[node_class] = getattr(cls, name)
+
+            cls._dispatch_table = table
+
+        return cls._dispatch_table
+
+    def visitor(self, node):
         try:
-            visitor = getattr(self, 'visit_' + self.name(node))
-        except AttributeError:
+            return self._dispatch[node.__class__]
+        except KeyError:
             raise JSError("syntax not supported (%s)" % node)
 
-        if hasattr(visitor, 'statement'):
-            return visitor(node, scope)
-        else:
-            return visitor(node)
+    def subexpressions(self, node):
+        return [ child for child in ast.iter_child_nodes(node)
+            if isinstance(child, ast.keyword) or
+                isinstance(child, (ast.expr, ast.slice)) and
+                child.__class__ in self._dispatch ]
+
+    # how deep expressions are translated recursively, see visit():
+    max_depth = 100
+
+    def visit(self, node):
+        if self._visited and node in self._visited:
+            return self._visited.pop(node)
+
+        visitor = self.visitor(node)
+
+        if not isinstance(node, (ast.expr, ast.slice)):
+            if not hasattr(node, 'lineno'):
+                return visitor(self, node)
+            # the statement that the emitted lines come from:
+            position = self.out.position
+            self.out.position = node.lineno, node.col_offset
+            try:
+                return visitor(self, node)
+            finally:
+                self.out.position = position
+
+        if self._depth < self.max_depth:
+            self._depth += 1
+            try:
+                return visitor(self, node)
+            finally:
+                self._depth -= 1
+
+        # Deeper down, translate all subexpressions bottom up first, so
+        # that visitors find their operands in self._visited and
+        # arbitrarily deep expressions don't hit the recursion limit:
+        nested = []
+
+        try:
+            for child in postorder(node, self.subexpressions):
+                if child is not node and child.__class__ in self._dispatch:
+                    self._visited[child] = \
+                        self._dispatch[child.__class__](self, child)
+                    nested.append(child)
 
-    def indent(self, stmts):
-        return [ "    " + stmt for stmt in stmts ]
+            return visitor(self, node)
+        finally:
+            # drop what the visitors didn't ask for
+            for child in nested:
+                self._visited.pop(child, None)
+
+    def emit(self, line):
+        self.out.line(line)
+
+    def visit_body(self, stmts):
+        self.out.indent()
+
+        for stmt in stmts:
+            self.visit(stmt)
+
+        self.out.dedent()
+
+    def type_of(self, node):
+        return self._inference.type_of(node, self._types)
+
+    def is_primitive(self, node):
+        return self.type_of(node) in ('bool', 'int', 'float')
+
+    def infer_types(self, body, args=None):
+        params = set(self._globals)
+
+        if args is not None:
+            for arg in args.args:
+                params.update(self._inference.names(arg))
+            params.update(filter(None, [args.vararg, args.kwarg]))
+
+        return self._inference.infer(body, params)
+
+    def start_module(self, bound_names, global_names):
+        """
+        Prepares for translating a module, given all the names bound in
+        it and all names declared 'global' anywhere in it.
+        """
+        self._inference = TypeInference(bound_names)
+        # names declared 'global' may change behind our back:
+        self._globals = set(global_names)
+        self._types = {}
+        self._symbols = SymbolTable()
 
     def visit_Module(self, node):
-        module = []
+        self.start_module(self._inference.bound_names(node),
+            global_names(node))
+        self._symbols.add(node.body)
+        self._types = self.infer_types(node.body)
 
         for stmt in node.body:
-            module.extend(self.visit(stmt))
+            self.visit(stmt)
+
+    visit_Interactive = visit_Module
 
-        return module
+    def visit_Expression(self, node):
+        self.start_module(self._inference.bound_names(node),
+            global_names(node))
+        self._symbols.add([node.body])
+        self.out.line(self.visit(node.body))
 
     @scope
     def visit_FunctionDef(self, node):
@@ -241,6 +1041,14 @@ class JS(object):
             else:
                 raise JSError("decorators are not supported")
 
+        types = self._types
+        self._types = self.infer_types(node.body, node.args)
+
+        outer = self._renames, self._next_local, self._symbols
+        symbols = self.symbols(node)
+        renames = self.local_renames(node, symbols,
+                keep_args=not self._class_name)
+
         # XXX: disable $def for now, because it doesn't work in IE:
         if self._class_name:
         #if 1:
@@ -257,48 +1065,58 @@ class JS(object):
 
             js_args = []
             js_defaults = []
-            self._scope = [arg.id for arg in node.args.args]
 
             for arg, default in zip(node.args.args, defaults):
                 if not isinstance(arg, ast.Name):
                     raise JSError("tuples in argument list are not supported")
 
-                js_args.append(arg.id)
+                js_args.append(renames.get(arg.id, arg.id))
 
                 if default is not None:
-                    js_defaults.append("%(id)s = typeof(%(id)s) != 'undefined' ? %(id)s : %(def)s;\n" % { 'id': arg.id, 'def': self.visit(default) })
+                    js_defaults.append("%(id)s = typeof(%(id)s) != 'undefined' ? %(id)s : %(def)s;\n" % { 'id': js_args[-1], 'def': self.visit(default) })
 
+            members, self._members = self._members, None
             if self._class_name:
-                prep = "%s.prototype.%s = function(" % \
-                        (self._class_name, node.name)
+                if members is not None:
+                    prep = "%s: function(" % node.name
+                else:
+                    prep = "%s.prototype.%s = function(" % \
+                            (self._class_name, node.name)
                 if not is_static:
                     if not (js_args[0] == "self"):
                         raise NotImplementedError("The first argument must be 'self'.")
                     del js_args[0]
             else:
                 prep = "function %s(" % node.name
-            js = [prep + ", ".join(js_args) + ") {"]
-
-            js.extend(self.indent(js_defaults))
+            self.emit(prep + ", ".join(js_args) + ") {")
+            self._renames = renames
+            self._symbols = symbols
 
-            for stmt in node.body:
-                js.extend(self.indent(self.visit(stmt)))
+            self.out.indent()
+            for default in js_defaults:
+                self.emit(default)
+            self.out.dedent()
+            self.hoist(node, renames)
 
-            js.append('}')
+            self.visit_body(node.body)
 
+            if members is not None:
+                # $class() adds it to the class itself:
+                self.emit('}' + members)
             #If method is static, we also add it directly to the class
-            if is_static:
-                js.append("%s.%s = %s.prototype.%s;" % \
+            elif is_static:
+                self.emit('}')
+                self.emit("%s.%s = %s.prototype.%s;" % \
                         (self._class_name, node.name, self._class_name, node.name))
             #Otherwise, we wrap it to take 'self' into account
             else:
+                self.emit('}')
                 func_name = node.name
-                js.append("%s.%s = function() {" % (self._class_name, func_name))
-                js.append("    %s.prototype.%s.apply(arguments[0],Array.slice(arguments,1));"% (self._class_name, func_name))
-                js.append("}")
+                self.emit("%s.%s = function() {" % (self._class_name, func_name))
+                self.emit("    %s.prototype.%s.apply(arguments[0],Array.slice(arguments,1));"% (self._class_name, func_name))
+                self.emit("}")
 
-            self._scope = []
-            return js
+            self._types = types
         else:
             defaults = [None]*(len(node.args.args) - len(node.args.defaults)) + node.args.defaults
 
@@ -312,46 +1130,69 @@ class JS(object):
                 args.append(arg.id)
             defaults = "{" + ", ".join(defaults2) + "}"
             args = ", ".join(args)
-            js = ["var %s = $def(%s, function(%s) {" % (node.name,
-                defaults, args)]
-            self._scope = [arg.id for arg in node.args.args]
-            for stmt in node.body:
-                js.extend(self.indent(self.visit(stmt)))
-            return js + ["});"]
+            self.emit("%s%s = $def(%s, function(%s) {" % (
+                self.declare(node.name),
+                self._renames.get(node.name, node.name), defaults, args))
+            self._renames = renames
+            self._symbols = symbols
+            self.hoist(node, renames)
+            self.visit_body(node.body)
+            self._types = types
+            self.emit("});")
+
+        self._renames, self._next_local, self._symbols = outer
 
     @scope
     def visit_ClassDef(self, node):
-        js = []
         bases = [self.visit(n) for n in node.bases]
         assert len(bases) >= 1
         class_name = node.name
         #self._classes remembers all classes defined
         self._classes[class_name] = node
         self._class_names.add(class_name)
-        js.append("function %s() {" % class_name)
-        js.append("    if( this === _global_this){")
-        js.append("        t = new %s();" % class_name)
-        js.append("        t.__init__.apply(t,arguments);")
-        js.append("        return t;")
-        js.append("    }")
-        js.append("}")
-        js.append("%s.__name__ = '%s';" % (class_name, class_name))
-        js.append("%s.prototype.__class__ = %s;" % (class_name, class_name))
-        js.append("%s.prototype.toString = _iter.prototype.toString;" % \
+
+        members = [ stmt for stmt in node.body
+            if not isinstance(stmt, ast.Pass) and
+                not (isinstance(stmt, ast.Expr) and
+                    isinstance(stmt.value, ast.Str)) ]
+        for stmt in members:
+            if not isinstance(stmt, ast.FunctionDef) and \
+                    not (isinstance(stmt, ast.Assign) and
+                        len(stmt.targets) == 1 and
+                        isinstance(stmt.targets[0], ast.Name)):
+                break
+        else:
+            return self.visit_class_members(node, bases, members)
+
+        self._symbols.declared.add(class_name)
+        self.emit("function %s() {" % class_name)
+        self.emit("    if (!(this instanceof %s)) {" % class_name)
+        self.emit("        var t = new %s();" % class_name)
+        self.emit("        t.__init__.apply(t,arguments);")
+        self.emit("        return t;")
+        self.emit("    }")
+        self.emit("}")
+        self.emit("%s.__name__ = '%s';" % (class_name, class_name))
+        self.emit("%s.prototype.__class__ = %s;" % (class_name, class_name))
+        self.emit("%s.prototype.toString = _iter.prototype.toString;" % \
                 (class_name))
         from ast import dump
         #~ methods = []
         self._class_name = class_name
+        types, symbols = self._types, self._symbols
+        self._types = {}
+        self._symbols = self.symbols(node)
         for stmt in node.body:
             if isinstance(stmt, ast.Assign):
                 value = self.visit(stmt.value)
                 for t in stmt.targets:
                     var = self.visit(t)
-                    js.append("%s.%s = %s;" % (class_name, var, value))
-                    js.append("%s.prototype.%s = %s.%s;" % (class_name, var, class_name, var))
+                    self.emit("%s.%s = %s;" % (class_name, var, value))
+                    self.emit("%s.prototype.%s = %s.%s;" % (class_name, var, class_name, var))
             else:
-                js.extend(self.visit(stmt))
+                self.visit(stmt)
         self._class_name = None
+        self._types, self._symbols = types, symbols
 
         #The following is unnecessary: __init__ is inherited from
         #'object'
@@ -359,22 +1200,59 @@ class JS(object):
         #~ if not "__init__" in methods_names:
             #~ # if the user didn't define __init__(), we have to add it ourselves
             #~ # because we call it from the constructor above
-            #~ js.append("_%s.prototype.__init__ = function() {" % class_name)
-            #~ js.append("}")
+            #~ self.emit("_%s.prototype.__init__ = function() {" % class_name)
+            #~ self.emit("}")
 
-        js.append('extend(%s,[%s]);'%(class_name,
+        self.emit('extend(%s,[%s]);'%(class_name,
             ', '.join(['%s'%cls for cls in bases])))
 
-        return js
+    def visit_class_members(self, node, bases, members):
+        """
+        Translates a class whose body only defines methods and attributes
+        into a call of $class() with a table of them. Names that are bound
+        to attributes or static methods are listed after the table, as
+        they are put on the class as they are.
+        """
+        class_name = node.name
+        outer = self._class_name, self._types, self._symbols
+        self.emit("%s%s = $class('%s', [%s], {" % (self.declare(class_name),
+            class_name, class_name, ", ".join(bases)))
+        self._class_name = class_name
+        self._types = {}
+        self._symbols = self.symbols(node)
+
+        plain = OrderedDict()
+        self.out.indent()
+        for i, stmt in enumerate(members):
+            end = i < len(members) - 1 and "," or ""
+            if isinstance(stmt, ast.Assign):
+                name = stmt.targets[0].id
+                self.emit("%s: %s%s" % (name, self.visit(stmt.value), end))
+                plain[name] = True
+            else:
+                self._members = end
+                self.visit(stmt)
+                plain[stmt.name] = [ decorator for decorator in
+                    stmt.decorator_list if isinstance(decorator, ast.Name)
+                        and decorator.id == "staticmethod" ] != []
+        self.out.dedent()
+
+        plain = [ "'%s'" % name for name in plain if plain[name] ]
+        if plain:
+            self.emit("}, [%s]);" % ", ".join(plain))
+        else:
+            self.emit("});")
+
+        self._class_name, self._types, self._symbols = outer
 
     def visit_Return(self, node):
         if node.value is not None:
-            return ["return %s;" % self.visit(node.value)]
+            self.emit("return %s;" % self.visit(node.value))
         else:
-            return ["return;"]
+            self.emit("return;")
 
     def visit_Delete(self, node):
-        return node
+        raise JSError("'del' is not supported")
 
     @scope
     def visit_Assign(self, node):
@@ -384,37 +1262,31 @@ class JS(object):
             #~ target = self._class_name + '.' + target
         value = self.visit(node.value)
         if isinstance(target, (ast.Tuple, ast.List)):
-            js = ["var __dummy%d__ = %s;" % (self.dummy, value)]
+            dummy = self.new_dummy()
+            self.emit("var %s = %s;" % (dummy, value))
 
             for i, target in enumerate(target.elts):
                 var = self.visit(target)
                 declare = ""
                 if isinstance(target, ast.Name):
-                    if not (var in self._scope):
-                        self._scope.append(var)
-                        declare = "var "
-                js.append("%s%s = __dummy%d__.__getitem__(%d);" % (declare,
-                    var, self.dummy, i))
-
-            self.dummy += 1
+                    declare = self.declare(target.id)
+                self.emit("%s%s = %s.__getitem__(%d);" % (declare,
+                    var, dummy, i))
         elif isinstance(target, ast.Subscript) and isinstance(target.slice, ast.Index):
             # found index assignment
-            js = ["%s.__setitem__(%s, %s);" % (self.visit(target.value),
-                self.visit(target.slice), value)]
+            self.emit("%s.__setitem__(%s, %s);" % (self.visit(target.value),
+                self.visit(target.slice), value))
         elif isinstance(target, ast.Subscript) and isinstance(target.slice, ast.Slice):
             # found slice assignmnet
-            js = ["%s.__setslice__(%s, %s, %s);" % (self.visit(target.value),
+            self.emit("%s.__setslice__(%s, %s, %s);" % (self.visit(target.value),
                 self.visit(target.slice.lower), self.visit(target.slice.upper),
-                value)]
+                value))
         else:
             var = self.visit(target)
             declare = ""
             if isinstance(target, ast.Name):
-                if not (var in self._scope):
-                    self._scope.append(var)
-                    declare = "var "
-            js = ["%s%s = %s;" % (declare, var, value)]
-        return js
+                declare = self.declare(target.id)
+            self.emit("%s%s = %s;" % (declare, var, value))
 
     def visit_AugAssign(self, node):
         # TODO: Make sure that all the logic in Assign also works in AugAssign
@@ -422,101 +1294,215 @@ class JS(object):
         value = self.visit(node.value)
 
         if isinstance(node.op, ast.Pow):
-            return ["%s = Math.pow(%s, %s);" % (target, target, value)]
-        if isinstance(node.op, ast.FloorDiv):
-            return ["%s = Math.floor((%s)/(%s));" % (target, target, value)]
-
-        return ["%s %s= %s;" % (target, self.get_binary_op(node), value)]
+            self.emit("%s = Math.pow(%s, %s);" % (target, target, value))
+        elif isinstance(node.op, ast.FloorDiv):
+            self.emit("%s = Math.floor((%s)/(%s));" % (target, target, value))
+        else:
+            self.emit("%s %s= %s;" % (target, self.get_binary_op(node), value))
 
     @scope
     def visit_For(self, node):
-        if not isinstance(node.target, ast.Name):
-            raise JSError("argument decomposition in 'for' loop is not supported")
+        if isinstance(node.target, ast.Name) and self.is_counted_loop(node):
+            return self.visit_counted_loop(node)
 
-        js = []
+        if isinstance(node.target, ast.Name):
+            for_target = self.visit(node.target)
+            declare = self.declare(node.target.id)
+            unpack = []
+        else:
+            for_target = self.new_dummy()
+            declare = "var "
+            unpack = self.unpack_for_target(node.target, for_target)
 
-        for_target = self.visit(node.target)
         for_iter = self.visit(node.iter)
 
+        seq_dummy = self.new_dummy()
+        items_dummy = self.new_dummy()
         iter_dummy = self.new_dummy()
+        index_dummy = self.new_dummy()
         orelse_dummy = self.new_dummy()
         exc_dummy = self.new_dummy()
 
-        js.append("var %s = iter(%s);" % (iter_dummy, for_iter))
-        js.append("var %s = false;" % orelse_dummy)
-        js.append("while (1) {")
-        js.append("    var %s;" % for_target)
-        js.append("    try {")
-        js.append("        %s = %s.next();" % (for_target, iter_dummy))
-        js.append("    } catch (%s) {" % exc_dummy)
-        js.append("        if (isinstance(%s, py_builtins.StopIteration)) {" % exc_dummy)
-        js.append("            %s = true;" % orelse_dummy)
-        js.append("            break;")
-        js.append("        } else {")
-        js.append("            throw %s;" % exc_dummy)
-        js.append("        }")
-        js.append("    }")
+        # builtin sequences are walked by index, anything else goes
+        # through iter() and next():
+        self.emit("var %s = %s;" % (seq_dummy, for_iter))
+        self.emit("var %s = py_builtins.iter_items(%s);" % (items_dummy, seq_dummy))
+        self.emit("var %s = %s === null ? iter(%s) : null;" % (iter_dummy,
+            items_dummy, seq_dummy))
+        self.emit("var %s = 0;" % index_dummy)
+        self.emit("var %s = false;" % orelse_dummy)
+        if declare:
+            self.emit("var %s;" % for_target)
+        self.emit("while (1) {")
+        self.emit("    if (%s === null) {" % iter_dummy)
+        self.emit("        if (%s >= %s.length) {" % (index_dummy, items_dummy))
+        self.emit("            %s = true;" % orelse_dummy)
+        self.emit("            break;")
+        self.emit("        }")
+        self.emit("        %s = %s[%s++];" % (for_target, items_dummy, index_dummy))
+        self.emit("    } else {")
+        self.emit("        try {")
+        self.emit("            %s = %s.next();" % (for_target, iter_dummy))
+        self.emit("        } catch (%s) {" % exc_dummy)
+        self.emit("            if (isinstance(%s, py_builtins.StopIteration)) {" % exc_dummy)
+        self.emit("                %s = true;" % orelse_dummy)
+        self.emit("                break;")
+        self.emit("            } else {")
+        self.emit("                throw %s;" % exc_dummy)
+        self.emit("            }")
+        self.emit("        }")
+        self.emit("    }")
+
+        self.out.indent()
+        for line in unpack:
+            self.emit(line)
+        self.out.dedent()
+
+        self.visit_body(node.body)
+
+        self.emit("}")
 
-        for stmt in node.body:
-            js.extend(self.indent(self.visit(stmt)))
+        if node.orelse:
+            self.emit("if (%s) {" % orelse_dummy)
 
-        js.append("}")
+            self.visit_body(node.orelse)
 
-        if node.orelse:
-            js.append("if (%s) {" % orelse_dummy)
+            self.emit("}")
 
-            for stmt in node.orelse:
-                js.extend(self.indent(self.visit(stmt)))
+    def unpack_for_target(self, target, value):
+        """Returns statements assigning the items of 'value' to 'target'. """
+        if isinstance(target, ast.Name):
+            return ["%s%s = %s;" % (self.declare(target.id), self.visit(target),
+                value)]
+        elif isinstance(target, (ast.Tuple, ast.List)):
+            js = []
+            for i, elt in enumerate(target.elts):
+                item = "%s.__getitem__(%d)" % (value, i)
+                if isinstance(elt, ast.Name):
+                    js.extend(self.unpack_for_target(elt, item))
+                else:
+                    dummy = self.new_dummy()
+                    js.append("var %s = %s;" % (dummy, item))
+                    js.extend(self.unpack_for_target(elt, dummy))
+            return js
+        else:
+            raise JSError("unsupported target in 'for' loop")
+
+    def is_counted_loop(self, node):
+        if not self._inference.is_range(node.iter):
+            return False
+        args = node.iter.args
+        if len(args) == 3 and isinstance(args[2], ast.Num):
+            # let the runtime deal with range(a, b, 0)
+            return args[2].n != 0
+        return True
+
+    def visit_counted_loop(self, node):
+        """
+        Translates 'for x in range(...)' (or xrange) into a counted JS loop.
+
+        The bounds are evaluated once, as in Python, and the loop runs on
+        its own counter, so assigning to the target in the body doesn't
+        change the iteration and the target keeps the last value after the
+        loop.
+        """
+        args = node.iter.args
+        if len(args) == 1:
+            args = [ast.Num(0)] + args
+        start, end = args[:2]
+        step = len(args) == 3 and args[2] or ast.Num(1)
 
-            js.append("}")
+        for_target = self.visit(node.target)
+        counter = self.new_dummy()
 
-        return js
+        init = "var %s = %s" % (counter, self.visit(start))
+        if not isinstance(start, ast.Num) and \
+                not (isinstance(end, ast.Num) and isinstance(step, ast.Num)):
+            self.emit(init + ";")
+            init = ""
+
+        if isinstance(end, ast.Num):
+            end = self.visit(end)
+        else:
+            end_dummy = self.new_dummy()
+            self.emit("var %s = %s;" % (end_dummy, self.visit(end)))
+            end = end_dummy
+
+        if isinstance(step, ast.Num):
+            if step.n > 0:
+                test = "%s < %s" % (counter, end)
+            else:
+                test = "%s > %s" % (counter, end)
+            if step.n == 1:
+                update = "%s++" % counter
+            else:
+                update = "%s += %s" % (counter, self.visit(step))
+        else:
+            step_dummy = self.new_dummy()
+            self.emit("var %s = %s;" % (step_dummy, self.visit(step)))
+            self.emit("if (%s === 0) {" % step_dummy)
+            self.emit("    throw new py_builtins.ValueError(\"range() step argument must not be zero\");")
+            self.emit("}")
+            test = "%s > 0 ? %s < %s : %s > %s" % (step_dummy,
+                    counter, end, counter, end)
+            update = "%s += %s" % (counter, step_dummy)
+
+        self.emit("for (%s; %s; %s) {" % (init, test, update))
+        self.emit("    %s%s = %s;" % (self.declare(node.target.id), for_target,
+            counter))
+
+        self.visit_body(node.body)
+
+        self.emit("}")
+
+        if node.orelse:
+            # the counter only passes the end if the loop wasn't broken
+            self.emit("if (!(%s)) {" % test)
+
+            self.visit_body(node.orelse)
+
+            self.emit("}")
 
     @scope
     def visit_While(self, node):
-        js = []
-
         if not node.orelse:
-            js.append("while (%s) {" % self.visit(node.test))
+            self.emit("while (%s) {" % self.visit(node.test))
         else:
             orelse_dummy = self.new_dummy()
 
-            js.append("var %s = false;" % orelse_dummy)
-            js.append("while (1) {");
-            js.append("    if (!(%s)) {" % self.visit(node.test))
-            js.append("        %s = true;" % orelse_dummy)
-            js.append("        break;")
-            js.append("    }")
+            self.emit("var %s = false;" % orelse_dummy)
+            self.emit("while (1) {");
+            self.emit("    if (!(%s)) {" % self.visit(node.test))
+            self.emit("        %s = true;" % orelse_dummy)
+            self.emit("        break;")
+            self.emit("    }")
 
-        for stmt in node.body:
-            js.extend(self.indent(self.visit(stmt)))
+        self.visit_body(node.body)
 
-        js.append("}")
+        self.emit("}")
 
         if node.orelse:
-            js.append("if (%s) {" % orelse_dummy)
-
-            for stmt in node.orelse:
-                js.extend(self.indent(self.visit(stmt)))
+            self.emit("if (%s) {" % orelse_dummy)
 
-            js.append("}")
+            self.visit_body(node.orelse)
 
-        return js
+            self.emit("}")
 
     @scope
     def visit_If(self, node):
-        js = ["if (py_builtins.bool(%s)) {" % self.visit(node.test)]
+        if self.is_primitive(node.test):
+            self.emit("if (%s) {" % self.visit(node.test))
+        else:
+            self.emit("if (py_builtins.bool(%s)) {" % self.visit(node.test))
 
-        for stmt in node.body:
-            js.extend(self.indent(self.visit(stmt)))
+        self.visit_body(node.body)
 
         if node.orelse:
-            js.append("} else {")
+            self.emit("} else {")
 
-            for stmt in node.orelse:
-                js.extend(self.indent(self.visit(stmt)))
+            self.visit_body(node.orelse)
 
-        return js + ["}"]
+        self.emit("}")
 
     @scope
     def _visit_With(self, node):
@@ -538,34 +1524,39 @@ class JS(object):
         test = self.visit(node.test)
 
         if node.msg is not None:
-            return ["assert(%s, %s);" % (test, self.visit(node.msg))]
+            self.emit("assert(%s, %s);" % (test, self.visit(node.msg)))
         else:
-            return ["assert(%s);" % test]
+            self.emit("assert(%s);" % test)
 
-    def _visit_Import(self, node):
-        pass
+    def visit_Import(self, node):
+        if self._bundle is None:
+            raise JSError("imports are only supported in bundles")
 
-    def _visit_ImportFrom(self, node):
-        pass
+        modules, bindings = self._bundle.resolve(node, self._module)
+        for name, value in bindings:
+            self.emit("%s%s = %s;" % (self.declare(name),
+                self._renames.get(name, name), value))
+
+    visit_ImportFrom = visit_Import
 
     def _visit_Exec(self, node):
         pass
 
     def visit_Global(self, node):
-        self._scope.extend(node.names)
-        return []
+        # the SymbolTable knows them
+        pass
 
     def visit_Expr(self, node):
-        return [self.visit(node.value) + ";"]
+        self.emit(self.visit(node.value) + ";")
 
     def visit_Pass(self, node):
-        return ["/* pass */"]
+        self.emit("/* pass */")
 
     def visit_Break(self, node):
-        return ["break;"]
+        self.emit("break;")
 
     def visit_Continue(self, node):
-        return ["continue;"]
+        self.emit("continue;")
 
     def visit_BoolOp(self, node):
         return self.get_bool_op(node).join([ "(%s)" % self.visit(val) for val in node.values ])
@@ -607,6 +1598,12 @@ class JS(object):
                     self.visit(comp),
                     self.visit(node.left),
                     )
+        elif isinstance(op, (ast.Eq, ast.NotEq)) and \
+                self._inference.is_primitive_pair(node.left, comp, self._types):
+            return "%s %s %s" % (self.visit(node.left),
+                    isinstance(op, ast.Eq) and "===" or "!==",
+                    self.visit(comp),
+                    )
         elif isinstance(op, ast.Eq):
             return "py_builtins.eq(%s, %s)" % (
                     self.visit(node.left),
@@ -625,6 +1622,9 @@ class JS(object):
                     )
 
     def visit_Name(self, node):
+        if node.id in self._renames:
+            return self._renames[node.id]
+
         id = node.id
         try:
             id = self.name_map[id]
@@ -646,6 +1646,15 @@ class JS(object):
         return 'str(%s)' % repr(node.s).lstrip("urb") ## ist ther any more string prefixes?
 
     def visit_Call(self, node):
+        if len(node.args) == 1:
+            arg = node.args[0]
+            if self._inference.is_builtin_call(node, 'len') and \
+                    self.type_of(arg) in ('list', 'tuple'):
+                return "%s._items.length" % self.visit(arg)
+            if self._inference.is_builtin_call(node, 'float') and \
+                    self.type_of(arg) in TypeInference.numeric:
+                return "(%s)" % self.visit(arg)
+
         func = self.visit(node.func)
         #~ if func in self._class_names:
             #~ func = 'new '+func
@@ -671,14 +1680,14 @@ class JS(object):
     def visit_Raise(self, node):
         assert node.inst is None
         assert node.tback is None
-        return ["throw %s;" % self.visit(node.type)]
+        self.emit("throw %s;" % self.visit(node.type))
 
     def visit_Print(self, node):
         assert node.dest is None
         assert node.nl
         values = [self.visit(v) for v in node.values]
         values = ", ".join(values)
-        return ["py_builtins.print(%s);" % values]
+        self.emit("py_builtins.print(%s);" % values)
 
     def visit_Attribute(self, node):
         return "%s.%s" % (self.visit(node.value), node.attr)
@@ -717,9 +1726,932 @@ class JS(object):
     def visit_Index(self, node):
         return self.visit(node.value)
 
-def convert_py2js(s):
+def global_names(tree):
+    """Returns all names declared 'global' in 'tree'. """
+    names = set()
+    # only statements contain statements:
+    stack = [tree]
+
+    while stack:
+        node = stack.pop()
+        if isinstance(node, ast.Global):
+            names.update(node.names)
+        stack.extend([ child for child in ast.iter_child_nodes(node)
+            if isinstance(child, (ast.stmt, ast.excepthandler)) ])
+
+    return names
+
+class SymbolTable(object):
+    """
+    The names of a module, class or function scope and the tables of the
+    scopes nested in it, see add().
+
+    Every name a scope uses is one of its 'locals' (bound in it, including
+    its arguments), 'globals' (declared 'global', or bound in no enclosing
+    function) or 'free' (bound in an enclosing function, which has it in
+    its 'cells'). Like in Python, functions don't see the names of the
+    classes they are in.
+
+    'declared' are the names that the translation declared with 'var'
+    already, see JS.declare().
+    """
+
+    def __init__(self, kind="module", parent=None):
+        self.kind = kind
+        self.parent = parent
+        self.locals = set()
+        self.globals = set()
+        self.free = set()
+        self.cells = set()
+        self.uses = set()
+        self.declared = set()
+        # the nodes of the nested scopes and their tables:
+        self.children = {}
+
+    def lookup(self, name):
+        """Returns whether 'name' is "local", "free" or "global" here. """
+        if name in self.free:
+            return "free"
+        if name in self.locals:
+            return "local"
+        return "global"
+
+    def add(self, nodes):
+        """
+        Adds the names of the statements (or expressions) 'nodes' of this
+        scope, and creates the tables of the scopes nested in them.
+        """
+        tables = []
+        stack = [ (node, self) for node in reversed(nodes) ]
+
+        while stack:
+            node, table = stack.pop()
+
+            # names are most of the nodes, and have no children to enter:
+            if node.__class__ is ast.Name:
+                if isinstance(node.ctx, ast.Load):
+                    table.uses.add(node.id)
+                else:
+                    table.locals.add(node.id)
+                continue
+            elif node.__class__ in plain_nodes:
+                stack.extend([ (child, table)
+                    for child in reversed(child_nodes(node)) ])
+                continue
+
+            # the children in the enclosing and in the new scope:
+            outer = inner = None
+
+            if isinstance(node, ast.FunctionDef):
+                table.locals.add(node.name)
+                outer = node.decorator_list + node.args.defaults
+                inner = node.args.args + node.body
+            elif isinstance(node, ast.ClassDef):
+                table.locals.add(node.name)
+                outer = node.decorator_list + node.bases
+                inner = node.body
+            elif isinstance(node, ast.Lambda):
+                outer = node.args.defaults
+                inner = node.args.args + [node.body]
+            elif isinstance(node, (ast.GeneratorExp, ast.SetComp,
+                    ast.DictComp)):
+                # the first iterable is evaluated outside:
+                first = node.generators[0]
+                outer = [first.iter]
+                inner = [ child for child in ast.iter_child_nodes(node)
+                    if child is not first ] + [first.target] + first.ifs
+
+            if inner is not None:
+                kind = isinstance(node, ast.ClassDef) and "class" or \
+                        "function"
+                child = SymbolTable(kind, table)
+                if isinstance(node, (ast.FunctionDef, ast.Lambda)):
+                    child.locals.update(filter(None, [node.args.vararg,
+                        node.args.kwarg]))
+                table.children[node] = child
+                tables.append(child)
+                stack.extend([ (n, child) for n in reversed(inner) ])
+                stack.extend([ (n, table) for n in reversed(outer) ])
+                continue
+
+            if isinstance(node, ast.Global):
+                table.globals.update(node.names)
+            elif isinstance(node, (ast.Import, ast.ImportFrom)):
+                for alias in node.names:
+                    if alias.name != "*":
+                        table.locals.add(alias.asname or
+                            alias.name.split(".")[0])
+            elif isinstance(node, ast.Name):
+                if isinstance(node.ctx, ast.Load):
+                    table.uses.add(node.id)
+                else:
+                    table.locals.add(node.id)
+
+            stack.extend([ (child, table)
+                for child in reversed(child_nodes(node)) ])
+
+        for table in tables:
+            table.locals -= table.globals
+        for table in tables:
+            for name in table.uses - table.locals - table.globals:
+                path = [table]
+                scope = table.parent
+                while scope is not None and scope.kind != "module":
+                    if scope.kind == "function" and name in scope.locals:
+                        for t in path:
+                            t.free.add(name)
+                        scope.cells.add(name)
+                        break
+                    path.append(scope)
+                    scope = scope.parent
+
+def symbol_table(tree):
+    """Returns the SymbolTable of the module 'tree'. """
+    table = SymbolTable()
+    table.add(tree.body)
+    return table
+
+class Optimizer(object):
+    """
+    Simplifies a module before it is translated:
+
+    * operations on number and string literals are computed, as long as
+      Python and the JavaScript that the operation translates to agree on
+      the result (7 / 2 is 3 in Python, but 3.5 in JavaScript),
+    * names bound only once in the module, at its top level, to a number,
+      True, False or None are replaced by it in the statements after that,
+      unless 'from ... import *' may bind them as well,
+    * 'if' and 'while' statements with a constant test lose the branches
+      that can't run (also the 'else' of an endless loop), and the
+      statements after return, raise, break and continue are dropped,
+    * expression statements without effect, such as docstrings, are
+      dropped.
+
+    A module is given to scan() and then to optimize(), either whole or
+    statement by statement.
+    """
+
+    # the largest integers that JavaScript numbers hold exactly:
+    max_int = 2 ** 53
+    # the longest string that a multiplication is computed into:
+    max_repeat = 100
+    # JavaScript computes bitwise operations on 32 bit integers:
+    min_int32 = -2 ** 31
+    max_int32 = 2 ** 31 - 1
+
+    bitwise = (ast.LShift, ast.RShift, ast.BitOr, ast.BitXor, ast.BitAnd,
+        ast.Invert)
+
+    operators = {
+        ast.Add: operator.add,
+        ast.Sub: operator.sub,
+        ast.Mult: operator.mul,
+        ast.Div: operator.div,
+        ast.FloorDiv: operator.floordiv,
+        ast.Mod: operator.mod,
+        ast.Pow: operator.pow,
+        ast.LShift: operator.lshift,
+        ast.RShift: operator.rshift,
+        ast.BitOr: operator.or_,
+        ast.BitXor: operator.xor,
+        ast.BitAnd: operator.and_,
+        ast.Invert: operator.invert,
+        ast.UAdd: operator.pos,
+        ast.USub: operator.neg,
+        ast.Eq: operator.eq,
+        ast.NotEq: operator.ne,
+        ast.Lt: operator.lt,
+        ast.LtE: operator.le,
+        ast.Gt: operator.gt,
+        ast.GtE: operator.ge,
+    }
+
+    names = {'True': True, 'False': False, 'None': None}
+
+    # marks what isn't a constant:
+    unknown = object()
+
+    def __init__(self):
+        # how often each name is bound in the module:
+        self.bindings = {}
+        # name -> (index of the statement, value) of the candidates for
+        # constants:
+        self.candidates = {}
+        self.division = False
+        # whether 'from ... import *' may rebind any name:
+        self.star = False
+        self.scanned = 0
+        self.optimized = 0
+        # the constants known in the statement being optimized:
+        self.constants = {}
+
+    def scan(self, tree):
+        """Collects the bindings of the module, or the statements, 'tree'. """
+        for node in ast.walk(tree):
+            names = []
+            if isinstance(node, ast.Name) and \
+                    not isinstance(node.ctx, ast.Load):
+                names = [node.id]
+            elif isinstance(node, (ast.FunctionDef, ast.ClassDef)):
+                names = [node.name]
+            elif isinstance(node, ast.arguments):
+                names = filter(None, [node.vararg, node.kwarg])
+            elif isinstance(node, (ast.Import, ast.ImportFrom)):
+                names = [ alias.asname or alias.name.split(".")[0]
+                    for alias in node.names ]
+                if "*" in names:
+                    self.star = True
+                if isinstance(node, ast.ImportFrom) and \
+                        node.module == "__future__" and "division" in names:
+                    self.division = True
+            elif isinstance(node, ast.Global):
+                # may be bound anywhere:
+                names = node.names * 2
+            for name in names:
+                self.bindings[name] = self.bindings.get(name, 0) + 1
+
+        for stmt in tree.body:
+            if isinstance(stmt, ast.Assign) and len(stmt.targets) == 1 and \
+                    isinstance(stmt.targets[0], ast.Name):
+                stmt.value = self.transform(stmt.value)
+                value = self.value(stmt.value)
+                if value is None or isinstance(value, (bool, int, long,
+                        float)):
+                    self.candidates[stmt.targets[0].id] = \
+                            self.scanned, value
+            self.scanned += 1
+
+    def optimize(self, tree):
+        """Optimizes the module, or the statements, 'tree' in place. """
+        constants = dict([ (name, candidate)
+            for name, candidate in self.candidates.iteritems()
+            if self.bindings.get(name) == 1 and not self.star ])
+        body = []
+        for stmt in tree.body:
+            self.constants = dict([ (name, value)
+                for name, (index, value) in constants.iteritems()
+                if index < self.optimized ])
+            stmt = self.transform(stmt)
+            if isinstance(stmt, list):
+                body.extend(stmt)
+            else:
+                body.append(stmt)
+            self.optimized += 1
+        tree.body = self.block(body, tree, "body")
+        return tree
+
+    def transform(self, root):
+        """
+        Optimizes the tree 'root' bottom up. Returns what replaces it: a
+        node, or a list of statements.
+        """
+        replaced = {}
+        for node in postorder(root, lambda node:
+                list(ast.iter_child_nodes(node))):
+            for field, value in ast.iter_fields(node):
+                if isinstance(value, list):
+                    items = []
+                    for item in value:
+                        item = replaced.get(item, item)
+                        if isinstance(item, list):
+                            items.extend(item)
+                        else:
+                            items.append(item)
+                    if value and isinstance(value[0], ast.stmt):
+                        items = self.block(items, node, field)
+                    setattr(node, field, items)
+                elif isinstance(value, ast.AST) and value in replaced:
+                    setattr(node, field, replaced[value])
+            new = self.fold(node)
+            if new is not node:
+                replaced[node] = new
+        return replaced.get(root, root)
+
+    def value(self, node):
+        """Returns the value of the literal 'node', or 'unknown'. """
+        if isinstance(node, ast.Num) and not isinstance(node.n, complex):
+            return node.n
+        if isinstance(node, ast.Str):
+            return node.s
+        if isinstance(node, ast.Name) and node.id in self.names and \
+                node.id not in self.bindings:
+            return self.names[node.id]
+        return self.unknown
+
+    def literal(self, value, node):
+        """Returns a literal of 'value' at the position of 'node'. """
+        if value is None or isinstance(value, bool):
+            literal = ast.Name(id=repr(value), ctx=ast.Load())
+        elif isinstance(value, basestring):
+            literal = ast.Str(s=value)
+        else:
+            literal = ast.Num(n=value)
+        return ast.copy_location(literal, node)
+
+    def fits(self, value):
+        """Tells whether the computed 'value' can be put in the output. """
+        if isinstance(value, bool):
+            return True
+        if isinstance(value, (int, long)):
+            return -self.max_int <= value <= self.max_int
+        if isinstance(value, float):
+            # no infinities and NaNs, nothing the output would round:
+            return value == value and abs(value) != float("inf") and \
+                float(str(value)) == value
+        return isinstance(value, basestring)
+
+    def compute(self, op, *operands):
+        """Returns the result of 'op' on 'operands', or 'unknown'. """
+        numbers = [ x for x in operands if isinstance(x, (int, long, float)) ]
+        strings = [ x for x in operands if isinstance(x, basestring) ]
+        if len(numbers) == len(operands):
+            integers = [ x for x in operands if isinstance(x, (int, long)) ]
+            if isinstance(op, ast.Div) and self.division:
+                function = operator.truediv
+            elif isinstance(op, ast.Div) and len(integers) == 2 and \
+                    operands[1] and operands[0] % operands[1]:
+                # JavaScript doesn't round:
+                return self.unknown
+            elif isinstance(op, ast.Mod) and min(operands) < 0:
+                # JavaScript takes the sign of the dividend:
+                return self.unknown
+            elif isinstance(op, ast.Pow) and abs(operands[1]) > 64:
+                return self.unknown
+            elif isinstance(op, self.bitwise) and \
+                    (len(integers) < len(operands) or
+                    min(operands) < self.min_int32 or
+                    max(operands) > self.max_int32 or
+                    isinstance(op, (ast.LShift, ast.RShift)) and
+                    not 0 <= operands[1] < 32):
+                return self.unknown
+            else:
+                function = self.operators.get(op.__class__)
+        elif len(strings) == len(operands) and \
+                isinstance(op, (ast.Add, ast.Eq, ast.NotEq)):
+            function = self.operators[op.__class__]
+        elif len(strings) == len(operands) and \
+                isinstance(op, (ast.Lt, ast.LtE, ast.Gt, ast.GtE)) and \
+                all([ max(x + " ") < "\x80" for x in strings ]):
+            # other characters may sort differently in JavaScript:
+            function = self.operators[op.__class__]
+        elif len(strings) == 1 and len(numbers) == 1 and \
+                isinstance(op, ast.Mult) and \
+                isinstance(numbers[0], (int, long)) and \
+                len(strings[0]) * numbers[0] <= self.max_repeat:
+            function = operator.mul
+        else:
+            return self.unknown
+        if function is None:
+            return self.unknown
+        try:
+            value = function(*operands)
+        except (ArithmeticError, ValueError, TypeError):
+            return self.unknown
+        if not self.fits(value) or isinstance(op, self.bitwise) and \
+                not self.min_int32 <= value <= self.max_int32:
+            return self.unknown
+        return value
+
+    def directives(self, stmts):
+        """Returns the 'global' statements in the scope of 'stmts'. """
+        found = []
+        nodes = list(stmts)
+        while nodes:
+            node = nodes.pop()
+            if isinstance(node, ast.Global):
+                found.append(node)
+            elif not isinstance(node, (ast.FunctionDef, ast.ClassDef,
+                    ast.Lambda)):
+                nodes.extend(ast.iter_child_nodes(node))
+        return found
+
+    def block(self, stmts, parent, field):
+        """
+        Drops what can't run or has no effect from the statements 'stmts',
+        the 'field' of 'parent'.
+        """
+        result = []
+        for i, stmt in enumerate(stmts):
+            if isinstance(stmt, ast.Pass):
+                continue
+            result.append(stmt)
+            if isinstance(stmt, (ast.Return, ast.Raise, ast.Break,
+                    ast.Continue)):
+                result.extend(self.directives(stmts[i + 1:]))
+                break
+        if not result and field != "orelse" and \
+                not isinstance(parent, ast.Module):
+            result = [ast.copy_location(ast.Pass(), parent)]
+        return result
+
+    def fold(self, node):
+        """Returns what replaces 'node', whose children are optimized. """
+        if isinstance(node, ast.Name):
+            if isinstance(node.ctx, ast.Load) and node.id in self.constants:
+                return self.literal(self.constants[node.id], node)
+        elif isinstance(node, ast.UnaryOp):
+            operand = self.value(node.operand)
+            if operand is not self.unknown:
+                if isinstance(node.op, ast.Not):
+                    return self.literal(not operand, node)
+                value = self.compute(node.op, operand)
+                if value is not self.unknown:
+                    return self.literal(value, node)
+        elif isinstance(node, ast.BinOp):
+            left = self.value(node.left)
+            right = self.value(node.right)
+            if left is not self.unknown and right is not self.unknown:
+                value = self.compute(node.op, left, right)
+                if value is not self.unknown:
+                    return self.literal(value, node)
+        elif isinstance(node, ast.Compare):
+            left = self.value(node.left)
+            result = True
+            for op, comparator in zip(node.ops, node.comparators):
+                right = self.value(comparator)
+                if left is self.unknown or right is self.unknown:
+                    return node
+                value = self.compute(op, left, right)
+                if value is self.unknown:
+                    return node
+                result = result and value
+                left = right
+            return self.literal(result, node)
+        elif isinstance(node, ast.BoolOp):
+            values = node.values
+            while len(values) > 1:
+                value = self.value(values[0])
+                if value is self.unknown:
+                    break
+                if bool(value) == isinstance(node.op, ast.Or):
+                    return values[0]
+                values = values[1:]
+            if len(values) == 1:
+                return values[0]
+            node.values = values
+        elif isinstance(node, ast.IfExp):
+            test = self.value(node.test)
+            if test is not self.unknown:
+                return test and node.body or node.orelse
+        elif isinstance(node, ast.If):
+            test = self.value(node.test)
+            if test is not self.unknown:
+                if test:
+                    return node.body + self.directives(node.orelse)
+                return node.orelse + self.directives(node.body)
+        elif isinstance(node, ast.While):
+            test = self.value(node.test)
+            if test is not self.unknown and not test:
+                return node.orelse + self.directives(node.body)
+            if test is not self.unknown and node.orelse:
+                # only a break leaves the loop, which skips the else:
+                node.orelse = self.directives(node.orelse)
+        elif isinstance(node, ast.Expr):
+            if self.value(node.value) is not self.unknown:
+                return []
+        return node
+
+def optimize_module(tree):
+    """Returns the module 'tree' simplified by an Optimizer. """
+    optimizer = Optimizer()
+    optimizer.scan(tree)
+    return optimizer.optimize(tree)
+
+def iter_statements(readline):
+    """
+    Splits the Python code read with 'readline' into top-level statements.
+
+    Yields (source, lineno) for every statement, where 'lineno' is the
+    line the statement starts on. Compound statements come with all their
+    clauses (else, except, ...) and decorated definitions with their
+    decorators. Only the current statement is held in memory.
+    """
+    clauses = ('else', 'elif', 'except', 'finally')
+    lines = []
+    first = 1
+
+    def read():
+        line = readline()
+        lines.append(line)
+        return line
+
+    depth = 0
+    new_line = True
+    decorated = False
+    started = False
+
+    for type, string, (row, col), end, line in tokenize.generate_tokens(read):
+        if type == tokenize.INDENT:
+            depth += 1
+        elif type == tokenize.DEDENT:
+            depth -= 1
+        elif type == tokenize.NEWLINE:
+            new_line = True
+        elif type == tokenize.ENDMARKER:
+            break
+        elif type not in (tokenize.NL, tokenize.COMMENT):
+            if new_line and depth == 0:
+                if started and not decorated and string not in clauses:
+                    yield "".join(lines[:row - first]), first
+                    del lines[:row - first]
+                    first = row
+
+                decorated = string == '@'
+                started = True
+
+            new_line = False
+
+    if started:
+        yield "".join(lines), first
+
+def parse_statements(readline):
+    """
+    Parses the statements of iter_statements() one by one.
+
+    Yields a Module node for every top-level statement, with line numbers
+    relative to the whole source. 'from __future__' imports apply to the
+    statements that follow them.
+    """
+    flags = 0
+
+    for source, lineno in iter_statements(readline):
+        tree = compile(source, "<unknown>", "exec",
+            ast.PyCF_ONLY_AST | flags, True)
+        ast.increment_lineno(tree, lineno - 1)
+
+        for stmt in tree.body:
+            if isinstance(stmt, ast.ImportFrom) and \
+                    stmt.module == '__future__':
+                for alias in stmt.names:
+                    feature = getattr(__future__, alias.name, None)
+                    if feature is not None:
+                        flags |= feature.compiler_flag
+
+        yield tree
+
+def convert_py2js_stream(filename, stream, minify=False, sourcemap=None,
+        optimize=False):
+    """
+    Converts the Python file 'filename' to JavaScript written to 'stream',
+    minified if 'minify' is true, simplified by an Optimizer if 'optimize'
+    is true and mapped in 'sourcemap' if given.
+
+    The output of each top-level statement is written and flushed as soon
+    as it is translated, so that memory use doesn't grow with the size of
+    the file. The file is read twice: first to collect the names bound in
+    it, then to translate it. Unlike convert_py2js(), module level
+    variables are not type inferred, as that needs the whole module at
+    once.
+    """
+    inference = TypeInference()
+    optimizer = Optimizer()
+    bound = set()
+    globals = set()
+
+    f = open(filename)
+    try:
+        for tree in parse_statements(f.readline):
+            bound.update(inference.bound_names(tree))
+            globals.update(global_names(tree))
+            if optimize:
+                optimizer.scan(tree)
+    finally:
+        f.close()
+
+    v = JS(Emitter(stream, minify, sourcemap))
+    v.start_module(bound, globals)
+
+    f = open(filename)
+    try:
+        for tree in parse_statements(f.readline):
+            if optimize:
+                optimizer.optimize(tree)
+            v._symbols.add(tree.body)
+            for stmt in tree.body:
+                v.visit(stmt)
+            # the tables of the scopes translated already aren't needed:
+            v._symbols.children.clear()
+            stream.flush()
+    finally:
+        f.close()
+
+def read_file(filename):
+    """Returns the content of the file 'filename'. """
+    with open(filename) as f:
+        return f.read()
+
+_compiler_version = None
+
+def compiler_version():
+    """
+    Returns a hash of the compiler's own source code and of the runtime,
+    which goes into the output as well.
+    """
+    global _compiler_version
+
+    if _compiler_version is None:
+        hasher = hashlib.sha1()
+        for filename in [os.path.splitext(os.path.abspath(__file__))[0] +
+                ".py", BUILTINS]:
+            f = open(filename, "rb")
+            try:
+                hasher.update(f.read())
+            finally:
+                f.close()
+        _compiler_version = hasher.hexdigest()
+
+    return _compiler_version
+
+class Tee(object):
+    """A file-like object that writes to several streams. """
+
+    def __init__(self, *streams):
+        self.streams = streams
+
+    def write(self, text):
+        for stream in self.streams:
+            stream.write(text)
+
+    def flush(self):
+        for stream in self.streams:
+            stream.flush()
+
+class Cache(object):
     """
-    Takes Python code as a string 's' and converts this to JavaScript.
+    On-disk cache of generated JavaScript.
+
+    Entries are keyed by a hash of the Python source, the compiler version
+    and the options that affect the output, so they never go stale. When
+    the cache grows beyond 'max_size' bytes, the least recently used
+    entries are removed until it is down to 90% of that.
+
+    The size of the cache is only looked up in the directory on the first
+    write, and then every 'rescan_interval' writes to see what other
+    processes added. In between, the writes are added up, and the
+    directory is looked at again only when that sum is over the limit.
+    """
+
+    max_size = 100*1024*1024
+    rescan_interval = 100
+
+    def __init__(self, directory=None, max_size=None):
+        if directory is None:
+            directory = os.environ.get("PY2JS_CACHE_DIR") or \
+                os.path.join(os.path.expanduser("~"), ".cache", "py2js")
+        self.directory = directory
+        if max_size is not None:
+            self.max_size = max_size
+        # the size of the cache as far as it is known, see evict():
+        self.size = None
+        self.writes = 0
+
+    def hasher(self, options):
+        hasher = hashlib.sha1(compiler_version())
+        hasher.update(repr(sorted(options.items())))
+        hasher.update("\0")
+        return hasher
+
+    def key(self, source, **options):
+        hasher = self.hasher(options)
+        hasher.update(source)
+        return hasher.hexdigest()
+
+    def file_key(self, filename, **options):
+        hasher = self.hasher(options)
+        f = open(filename, "rb")
+        try:
+            for chunk in iter(lambda: f.read(64*1024), ""):
+                hasher.update(chunk)
+        finally:
+            f.close()
+        return hasher.hexdigest()
+
+    def filename(self, key):
+        return os.path.join(self.directory, key + ".js")
+
+    def open(self, key):
+        """Returns the entry 'key' as an open file or None on a miss. """
+        filename = self.filename(key)
+        try:
+            f = open(filename, "rb")
+        except IOError:
+            return None
+        try:
+            # the modification time is the time of the last use:
+            os.utime(filename, None)
+        except OSError:
+            pass
+        return f
+
+    def get(self, key):
+        f = self.open(key)
+        if f is None:
+            return None
+        try:
+            return f.read()
+        finally:
+            f.close()
+
+    def create(self):
+        """Returns a new temporary file to be stored with commit(). """
+        if not os.path.isdir(self.directory):
+            try:
+                os.makedirs(self.directory)
+            except OSError:
+                if not os.path.isdir(self.directory):
+                    raise
+        return tempfile.NamedTemporaryFile(suffix=".tmp",
+                dir=self.directory, delete=False)
+
+    def commit(self, key, f):
+        f.close()
+        size = os.path.getsize(f.name)
+        try:
+            os.rename(f.name, self.filename(key))
+        except OSError:
+            # e.g. on Windows if another process got there first
+            os.remove(f.name)
+        self.evict(size)
+
+    def put(self, key, js):
+        f = self.create()
+        try:
+            f.write(js)
+        except:
+            f.close()
+            os.remove(f.name)
+            raise
+        self.commit(key, f)
+
+    def evict(self, added=0):
+        """
+        Removes the least recently used entries, down to 90% of 'max_size',
+        once the cache got bigger than that after 'added' bytes were
+        written to it.
+        """
+        self.writes += 1
+        if self.size is not None and self.writes < self.rescan_interval:
+            # replaced entries are counted twice, which is on the safe side:
+            self.size += added
+            if self.size <= self.max_size:
+                return
+        self.writes = 0
+
+        entries = []
+        size = 0
+
+        for name in os.listdir(self.directory):
+            if not name.endswith(".js"):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+            size += stat.st_size
+
+        if size > self.max_size:
+            # make room for a few more writes before the next scan:
+            limit = self.max_size * 9 // 10
+            entries.sort()
+            for mtime, entry_size, name in entries:
+                if size <= limit:
+                    break
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+                size -= entry_size
+
+        self.size = size
+
+class LRU(object):
+    """
+    A thread-safe mapping that keeps at most 'size' entries, dropping the
+    least recently used ones. 'hits' and 'misses' count the lookups.
+    """
+
+    def __init__(self, size=1000):
+        self.size = size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key, default=None):
+        with self.lock:
+            try:
+                value = self.entries.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            self.entries[key] = value
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = value
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+class Compiler(object):
+    """
+    Translates Python code to JavaScript in this process and remembers the
+    last 'cache_size' results.
+
+    JS instances are pooled: each one is reset before a translation and
+    put back afterwards, which also makes compile() safe to call from
+    several threads. 'hits' and 'misses' count the lookups of the results.
+    """
+
+    modes = {
+        ast.Module: 'exec',
+        ast.Expression: 'eval',
+        ast.Interactive: 'single',
+    }
+
+    def __init__(self, cache_size=1000):
+        self.results = LRU(cache_size)
+        self.instances = []
+        self.lock = threading.Lock()
+
+    @property
+    def hits(self):
+        return self.results.hits
+
+    @property
+    def misses(self):
+        return self.results.misses
+
+    def compile(self, source, mode="exec", minify=False, optimize=False):
+        """
+        Returns the JavaScript for 'source', which is either Python code as
+        a string, parsed in 'mode' ("exec", "eval" or "single" as for the
+        builtin compile()), or an ast.Module, ast.Expression or
+        ast.Interactive. With 'minify', the JavaScript is minified, with
+        'optimize', modules are simplified by an Optimizer first.
+
+        An expression translates to a JavaScript expression:
+
+        >>> Compiler().compile("x[3:]", "eval")
+        'x.__getitem__(slice(3, null))'
+
+        """
+        if isinstance(source, ast.AST):
+            if source.__class__ not in self.modes:
+                raise TypeError("expected Module, Expression or "
+                    "Interactive, got %s" % source.__class__.__name__)
+            key = ('ast', self.modes[source.__class__], minify, optimize,
+                    ast.dump(source))
+            tree = source
+        else:
+            key = ('source', mode, minify, optimize, source)
+            tree = None
+
+        js = self.results.get(key)
+        if js is not None:
+            return js
+
+        if tree is None:
+            tree = ast.parse(source, mode=mode)
+        elif optimize:
+            # the caller's tree stays as it is:
+            tree = copy.deepcopy(tree)
+        if optimize and isinstance(tree, ast.Module):
+            tree = optimize_module(tree)
+
+        with self.lock:
+            if self.instances:
+                v = self.instances.pop()
+            else:
+                v = JS()
+        try:
+            v.reset(Emitter(minify=minify))
+            v.visit(tree)
+            js = v.out.getvalue()
+        finally:
+            with self.lock:
+                self.instances.append(v)
+
+        self.results.put(key, js)
+        return js
+
+def convert_py2js(s, cache=None, minify=False, sourcemap=None,
+        optimize=False):
+    """
+    Takes Python code as a string 's' and converts this to JavaScript,
+    minified if 'minify' is true and simplified by an Optimizer first if
+    'optimize' is true.
+
+    Nothing is kept between calls, use a Compiler to memoize results in
+    memory. If 'cache' (a Cache instance) is given, the result is looked up
+    there first and stored there afterwards. If a SourceMap 'sourcemap' is
+    given, the code is always translated, filling in the source map.
 
     Example:
 
@@ -727,9 +2659,27 @@ def convert_py2js(s):
     'x.__getitem__(slice(3, null));'
 
     """
-    v = JS()
-    t = ast.parse(s)
-    return "\n".join(v.visit(t))
+    if cache is not None and sourcemap is None:
+        # options only enter the key when set, so older entries stay valid:
+        options = dict([ (name, True)
+            for name, value in [("minify", minify), ("optimize", optimize)]
+            if value ])
+        key = cache.key(s, **options)
+        js = cache.get(key)
+        if js is not None:
+            return js
+
+    v = JS(Emitter(minify=minify, sourcemap=sourcemap))
+    tree = ast.parse(s)
+    if optimize:
+        tree = optimize_module(tree)
+    v.visit(tree)
+    js = v.out.getvalue()
+
+    if cache is not None and sourcemap is None:
+        cache.put(key, js)
+
+    return js
 
 class JavaScript(object):
     """
@@ -797,36 +2747,2287 @@ class JavaScript(object):
         test_class = js() # Python instance of TestClass() will be created
         js_class = str(js) # A string with the JS code
 
+    The translation happens the first time str() is called and is
+    remembered for the function's code object (or the class). To keep it
+    across processes as well, set JavaScript.cache to a Cache; the entries
+    are keyed by the file name, its mtime and the line of the definition,
+    so the source isn't even extracted on a hit.
+
     """
 
+    cache = None
+
+    # translations by code object (or class), see __str__():
+    _translations = {}
+
     def __init__(self, obj):
         self._obj = obj
-        obj_source = inspect.getsource(obj)
-        self._js = convert_py2js(obj_source)
+        self._js = None
 
     def __str__(self):
+        if self._js is None:
+            code = getattr(self._obj, "func_code", self._obj)
+            js = self._translations.get(code)
+            if js is None:
+                js = self._translate()
+                self._translations[code] = js
+            self._js = js
         return self._js
 
+    def _translate(self):
+        if self.cache is not None:
+            # the key doesn't need the source, which is only searched for
+            # on a miss:
+            code = getattr(self._obj, "func_code", None)
+            if code is not None:
+                filename, line = code.co_filename, code.co_firstlineno
+            else:
+                # a class has no line of its own, but its methods do:
+                filename = inspect.getsourcefile(self._obj)
+                line = min([ value.func_code.co_firstlineno
+                    for value in vars(self._obj).values()
+                    if hasattr(value, "func_code") ] or [None])
+            filename = os.path.abspath(filename)
+            key = self.cache.key("", filename=filename,
+                    mtime=os.path.getmtime(filename), line=line,
+                    name=self._obj.__name__)
+            js = self.cache.get(key)
+            if js is not None:
+                return js
+
+        lines, lnum = inspect.findsource(self._obj)
+        js = convert_py2js("".join(inspect.getblock(lines[lnum:])))
+
+        if self.cache is not None:
+            self.cache.put(key, js)
+
+        return js
+
     def __call__(self, *args, **kwargs):
         return self._obj(*args, **kwargs)
 
+ASSETS = "py2js-assets.json"
+
+def collect(name):
+    """
+    Imports the module or package 'name' with all its submodules and
+    returns the JavaScript objects defined in them, i.e. their module
+    attributes that are decorated with @JavaScript, in the order of the
+    modules and the definitions.
+    """
+    module = __import__(name, fromlist=["*"])
+    modules = [module]
+    if hasattr(module, "__path__"):
+        for importer, module_name, is_package in \
+                pkgutil.walk_packages(module.__path__, name + "."):
+            modules.append(__import__(module_name, fromlist=["*"]))
+
+    objects = []
+    for module in modules:
+        # imported objects are collected with the module they come from:
+        defined = [ (inspect.findsource(value._obj)[1], value)
+            for value in set([ value for value in vars(module).values()
+                if isinstance(value, JavaScript) ])
+            if value._obj.__module__ == module.__name__ ]
+        defined.sort(key=lambda (line, js): line)
+        objects.extend([ js for line, js in defined ])
+    return objects
+
+def resolve(name):
+    """Returns the object with the dotted 'name', like 'module.Class'. """
+    module_name, attr = name.rsplit(".", 1)
+    return getattr(__import__(module_name, fromlist=[attr]), attr)
+
+def write_asset(output_dir, name, chunks):
+    """
+    Writes the JavaScript 'chunks' to a file named after 'name' and the
+    hash of its content and returns the file name.
+    """
+    content = "\n".join(chunks) + "\n"
+    filename = "%s-%s.js" % (name, hashlib.sha1(content).hexdigest()[:12])
+    path = os.path.join(output_dir, filename)
+    # the name changes with the content, so an existing file is current:
+    if not os.path.exists(path):
+        f = open(path + ".tmp", "w")
+        try:
+            f.write(content)
+        finally:
+            f.close()
+        os.rename(path + ".tmp", path)
+    return filename
+
+def build_assets(output_dir, objects=(), pages=None):
+    """
+    Precompiles JavaScript objects into static files in 'output_dir'.
+
+    Without 'pages', the translations of 'objects' are written to a
+    single bundle. Otherwise 'pages' maps page names to lists of objects,
+    each page gets its own chunk, and the translations needed by several
+    pages go into one shared chunk, together with the translations they
+    use. Identical translations are only written once, after those they
+    use (like the base classes of a class). File names contain the hash
+    of their content, so they can be cached forever.
+
+    Returns a dict mapping page names ("bundle" for the bundle) to the
+    files the page has to load, in order, which is also written to
+    ASSETS in 'output_dir' (see load_assets()).
+    """
+    # the name that each translation defines, in the order they were seen:
+    names = OrderedDict()
+
+    def translations(objects):
+        result = []
+        for obj in objects:
+            if not isinstance(obj, JavaScript):
+                obj = JavaScript(obj)
+            js = str(obj)
+            names.setdefault(js, obj._obj.__name__)
+            if js not in result:
+                result.append(js)
+        return result
+
+    def ordered(chunk):
+        """Puts the translations of 'chunk' after those they use. """
+        members = set(chunk)
+        result = []
+        entered = set()
+        for first in chunk:
+            stack = [(first, False)]
+            while stack:
+                js, expanded = stack.pop()
+                if expanded:
+                    result.append(js)
+                    continue
+                if js in entered:
+                    continue
+                entered.add(js)
+                stack.append((js, True))
+                stack.extend([ (other, False)
+                    for other in reversed(uses[js])
+                    if other in members and other not in entered ])
+        return result
+
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+
+    if pages is None:
+        chunks = {"bundle": translations(objects)}
+    else:
+        chunks = dict([ (page, translations(objects))
+            for page, objects in pages.iteritems() ])
+
+    # the translations whose names each translation refers to:
+    uses = {}
+    for js in names:
+        referenced = js_references(js_tokens(js))
+        uses[js] = [ other for other, name in names.iteritems()
+            if other != js and name in referenced ]
+
+    if pages is None:
+        assets = {"bundle": [write_asset(output_dir, "bundle",
+            ordered(chunks["bundle"]))]}
+    else:
+        users = {}
+        shared = []
+        for page in sorted(chunks):
+            for js in chunks[page]:
+                users[js] = users.get(js, 0) + 1
+                if users[js] == 2:
+                    shared.append(js)
+
+        # the common chunk loads first, so it can't use what only a page
+        # has:
+        stack = list(shared)
+        while stack:
+            for other in uses[stack.pop()]:
+                if other not in shared:
+                    shared.append(other)
+                    stack.append(other)
+
+        common = []
+        if shared:
+            common = [write_asset(output_dir, "common", ordered(shared))]
+        assets = {}
+        for page, page_chunks in chunks.iteritems():
+            own = [ js for js in page_chunks if js not in shared ]
+            assets[page] = list(common)
+            if own:
+                assets[page].append(write_asset(output_dir, page,
+                    ordered(own)))
+
+    f = open(os.path.join(output_dir, ASSETS), "w")
+    try:
+        json.dump(assets, f, indent=1, sort_keys=True)
+    finally:
+        f.close()
+
+    return assets
+
+def load_assets(output_dir):
+    """Returns what build_assets() built into 'output_dir'. """
+    f = open(os.path.join(output_dir, ASSETS))
+    try:
+        return json.load(f)
+    finally:
+        f.close()
+
+def script_tags(assets, page="bundle", prefix=""):
+    """
+    Returns the HTML <script> tags that load the files of 'page', with
+    their URLs starting with 'prefix'.
+    """
+    return "\n".join([ '<script type="text/javascript" src="%s%s"></script>' %
+        (prefix, filename) for filename in assets[page] ])
+
+js_token = re.compile(r"""
+      (?P<newline>\n)
+    | (?P<space>[ \t\r\f\v]+)
+    | (?P<comment>//[^\n]*|/\*.*?\*/)
+    | (?P<string>"(?:\\.|[^"\\\n])*"|'(?:\\.|[^'\\\n])*')
+    | (?P<name>[A-Za-z_$][\w$]*)
+    | (?P<number>0[xX][0-9a-fA-F]+|(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)
+    | (?P<regex>/(?:\\.|\[(?:\\.|[^\]\\\n])*\]|[^/\\\n\[])+/[a-z]*)
+    | (?P<punct>>>>=?|===|!==|<<=|>>=|[-+*/%&|^!=<>]=|&&|\|\||\+\+|--|<<|>>|.)
+    """, re.VERBOSE | re.DOTALL)
+
+js_division = re.compile(r"/=?")
+
+# after these, a slash starts a regular expression rather than a division:
+regex_prefixes = set("(,=:[!&|?{};+-*%<>~^") | set(['return', 'typeof',
+    'case', 'do', 'else', 'in', 'instanceof', 'new', 'delete', 'void',
+    'throw', '&&', '||', '==', '===', '!=', '!=='])
+
+def js_tokens(code):
+    """
+    Yields the tokens of the JavaScript 'code' as pairs (kind, text), where
+    kind is one of the group names of js_token.
+    """
+    pos = 0
+    previous = None
+    while pos < len(code):
+        match = js_token.match(code, pos)
+        kind = match.lastgroup
+        if kind == 'regex' and previous is not None and \
+                previous[1] not in regex_prefixes:
+            # a division after all:
+            kind = 'punct'
+            match = js_division.match(code, pos)
+        yield kind, match.group()
+        if kind not in ('space', 'newline', 'comment'):
+            previous = kind, match.group()
+        pos = match.end()
+
+def js_references(tokens):
+    """
+    Returns the names that 'tokens' use: all names except properties, and
+    the properties of py_builtins as 'py_builtins.name'.
+    """
+    names = set()
+    previous = None
+    for kind, text in tokens:
+        if kind == 'name':
+            if previous == '.':
+                if before == 'py_builtins':
+                    names.add('py_builtins.' + text)
+            else:
+                names.add(text)
+        if kind not in ('space', 'newline', 'comment'):
+            before = previous
+            previous = text
+    return names
+
+class Minifier(object):
+    """
+    Removes the whitespace and the comments that JavaScript doesn't need
+    from code fed to it piece by piece, see feed().
+
+    A newline is only kept where it could end a statement by an
+    automatically inserted semicolon. Comments with a copyright notice are
+    kept, each on a line of its own.
+    """
+
+    # a newline after these may end a statement:
+    ends = set([')', ']', '}', '++', '--'])
+    # and before these:
+    starts = set(['{', '!', '~', '++', '--'])
+    # ... but never between a block and these:
+    continuations = set(['else', 'catch', 'finally'])
+    # a newline after these always ends the statement:
+    restricted = set(['return', 'break', 'continue', 'throw'])
+
+    word = re.compile(r"[\w$]")
+
+    def __init__(self):
+        # the last token written:
+        self.last = None
+        # whether there was a line break since:
+        self.newline = False
+
+    def feed(self, code):
+        """Returns 'code' minified, to be appended to what came before. """
+        chunks = []
+        for kind, text in js_tokens(code):
+            if kind == 'space':
+                continue
+            if kind == 'newline' or kind == 'comment' and \
+                    'Copyright' not in text:
+                self.newline = self.newline or "\n" in text or \
+                    text.startswith("//")
+                continue
+            if kind == 'comment':
+                chunks.append(self.last and "\n" + text or text)
+            else:
+                chunks.append(self.separator(kind, text) + text)
+            self.last = kind, text
+            self.newline = False
+        return "".join(chunks)
+
+    def separator(self, kind, text):
+        if self.last is None:
+            return ""
+        last_kind, last = self.last
+        if last_kind == 'comment':
+            return "\n"
+        if self.newline:
+            if last in self.restricted and text not in (';', '}'):
+                return "\n"
+            if (last_kind in ('name', 'number', 'string', 'regex') or
+                    last in self.ends) and \
+                    (kind in ('name', 'number', 'string', 'regex') or
+                    text in self.starts) and \
+                    not (last == '}' and text in self.continuations):
+                return "\n"
+        if self.word.match(last[-1]) and self.word.match(text[0]):
+            return " "
+        if last[-1] in "+-/" and text[0] == last[-1]:
+            # e.g. a + +b, a - --b, a / /b/
+            return " "
+        if last_kind == 'number' and text[0] == '.':
+            return " "
+        return ""
+
+def minify_js(code):
+    """Returns the JavaScript 'code' minified, see Minifier. """
+    return Minifier().feed(code)
+
+class Runtime(object):
+    """
+    The runtime library (py-builtins.js) split into its top-level
+    statements, so that a program can be given only the parts it uses.
+
+    What a statement defines and which definitions it uses is read off its
+    code: function and var declarations and assignments to (properties
+    of) a name define that name, or 'py_builtins.name' for the properties
+    of py_builtins, and every name the statement mentions is a dependency.
+    What can't be seen that way is declared in comments right before the
+    statement:
+
+        // @provides NAME ...   defines names dynamically
+        // @requires NAME ...   uses names dynamically
+        // @optional NAME ...   only uses names if they are defined
+
+    Statements that don't define anything are always kept.
+    """
+
+    continuations = set(['else', 'catch', 'finally', 'while', 'in',
+        'instanceof'])
+
+    def __init__(self, filename=BUILTINS):
+        f = open(filename)
+        try:
+            code = f.read()
+        finally:
+            f.close()
+        # list of (code, license, provides, requires):
+        self.statements = []
+        self.split(code)
+        self.providers = {}
+        for i, (code, license, provides, requires) in \
+                enumerate(self.statements):
+            for name in provides:
+                self.providers.setdefault(name, []).append(i)
+
+    def split(self, code):
+        tokens = list(js_tokens(code))
+        license = None
+        annotations = []
+        statement = []
+        depth = 0
+
+        for i, (kind, text) in enumerate(tokens):
+            if not statement:
+                if kind == 'comment':
+                    if 'Copyright' in text:
+                        license = text
+                    elif text.startswith('// @'):
+                        annotations.append(text[4:].split())
+                    continue
+                if kind in ('space', 'newline'):
+                    continue
+
+            statement.append((kind, text))
+
+            if kind == 'punct' and text in '([{':
+                depth += 1
+            elif kind == 'punct' and text in ')]}':
+                depth -= 1
+
+            if depth == 0 and (kind == 'punct' and text == ';' or
+                    kind == 'newline' and self.ends(statement, tokens, i)):
+                self.add(statement, license, annotations)
+                statement = []
+                annotations = []
+
+        if [ token for token in statement
+                if token[0] not in ('space', 'newline', 'comment') ]:
+            self.add(statement, license, annotations)
+
+    def ends(self, statement, tokens, i):
+        """
+        Decides whether a newline at tokens[i] ends 'statement' like an
+        automatically inserted semicolon.
+        """
+        code = [ token for token in statement
+                if token[0] not in ('space', 'newline', 'comment') ]
+        if not code or code[-1][0] == 'punct' and \
+                code[-1][1] not in (')', ']', '}'):
+            return False
+        for kind, text in tokens[i + 1:]:
+            if kind not in ('space', 'newline', 'comment'):
+                return kind == 'name' and text not in self.continuations
+        return True
+
+    def add(self, statement, license, annotations):
+        code = [ text for kind, text in statement
+                if kind not in ('space', 'newline', 'comment') ]
+        provides = set()
+        if code[0] in ('function', 'var') and len(code) > 1:
+            provides.add(code[1])
+        elif re.match(r'[A-Za-z_$]', code[0]) and \
+                code[0] not in ('if', 'for', 'while'):
+            # an assignment to a property of code[0]:
+            depth = 0
+            for text in code:
+                if text in ('(', '[', '{'):
+                    depth += 1
+                elif text in (')', ']', '}'):
+                    depth -= 1
+                elif text == '=' and depth == 0:
+                    if code[0] == 'py_builtins' and code[1] == '.':
+                        provides.add('py_builtins.' + code[2])
+                    else:
+                        provides.add(code[0])
+                    break
+
+        requires = js_references(statement)
+        for annotation in annotations:
+            if annotation[0] == 'provides':
+                provides.update(annotation[1:])
+            elif annotation[0] == 'requires':
+                requires.update(annotation[1:])
+            elif annotation[0] == 'optional':
+                requires.difference_update(annotation[1:])
+        requires.difference_update(provides)
+
+        text = "".join([ text for kind, text in statement ]).rstrip()
+        self.statements.append((text, license, provides, requires))
+
+    def select(self, names):
+        """
+        Returns the indices of the statements needed to define 'names', in
+        the order of the runtime.
+        """
+        selected = set([ i for i, (code, license, provides, requires) in
+            enumerate(self.statements) if not provides ])
+        stack = list(selected)
+        for name in names:
+            for i in self.providers.get(name, ()):
+                if i not in selected:
+                    selected.add(i)
+                    stack.append(i)
+        while stack:
+            code, license, provides, requires = self.statements[stack.pop()]
+            for name in requires:
+                for i in self.providers.get(name, ()):
+                    if i not in selected:
+                        selected.add(i)
+                        stack.append(i)
+        return sorted(selected)
+
+    def code(self, js, minify=False):
+        """
+        Returns the parts of the runtime that the program 'js' needs,
+        including their license headers, minified if 'minify' is true.
+        """
+        chunks = []
+        license = None
+        for i in self.select(js_references(js_tokens(js))):
+            code, statement_license, provides, requires = self.statements[i]
+            if statement_license is not license:
+                license = statement_license
+                if license is not None:
+                    chunks.append(license)
+            chunks.append(code)
+        if minify:
+            return minify_js("\n".join(chunks)) + "\n"
+        return "\n".join(chunks) + "\n"
+
+_runtime = None
+
+def load_runtime():
+    """Returns the Runtime of py-builtins.js, which is loaded only once. """
+    global _runtime
+
+    if _runtime is None:
+        _runtime = Runtime()
+    return _runtime
+
+def runtime(js=None, minify=False):
+    """
+    Returns the runtime library, or only the parts of it that the program
+    'js' needs, minified if 'minify' is true.
+    """
+    if js is None:
+        f = open(BUILTINS)
+        try:
+            code = f.read()
+        finally:
+            f.close()
+        if minify:
+            return minify_js(code) + "\n"
+        return code
+
+    return load_runtime().code(js, minify)
+
+def write_runtime(out, minify=False):
+    """
+    Writes the whole runtime library and an empty line to 'out', without
+    reading it into memory unless it is to be minified. Returns the number
+    of lines written.
+    """
+    if minify:
+        code = runtime(minify=True) + "\n"
+        out.write(code)
+        return code.count("\n")
+    lines = 1
+    f = open(BUILTINS)
+    try:
+        for chunk in iter(lambda: f.read(64*1024), ""):
+            out.write(chunk)
+            lines += chunk.count("\n")
+    finally:
+        f.close()
+    out.write("\n")
+    return lines
+
+def write_js(filename, out, stream=False, cache=None, minify=False,
+        sourcemap=None, optimize=False):
+    """
+    Compiles the Python file 'filename' and writes the JavaScript to 'out'.
+    The cache is bypassed if a SourceMap 'sourcemap' is to be filled in.
+    """
+    if not stream:
+        out.write(convert_py2js(read_file(filename), cache, minify,
+            sourcemap, optimize))
+    elif cache is None or sourcemap is not None:
+        convert_py2js_stream(filename, out, minify, sourcemap, optimize)
+    else:
+        options = dict([ (name, True)
+            for name, value in [("minify", minify), ("optimize", optimize)]
+            if value ])
+        key = cache.file_key(filename, stream=True, **options)
+        cached = cache.open(key)
+        if cached is not None:
+            shutil.copyfileobj(cached, out)
+            cached.close()
+        else:
+            f = cache.create()
+            try:
+                convert_py2js_stream(filename, Tee(out, f), minify,
+                        optimize=optimize)
+            except:
+                f.close()
+                os.remove(f.name)
+                raise
+            cache.commit(key, f)
+    out.write("\n")
+
+# the output formats and the file extensions of their modules:
+module_formats = OrderedDict([("script", ".js"), ("commonjs", ".js"),
+    ("esm", ".mjs")])
+
+RUNTIME_MODULE = "py-builtins"
+
+def runtime_names():
+    """Returns the top-level names that the runtime defines. """
+    return sorted([ name for name in load_runtime().providers
+        if "." not in name ])
+
+def runtime_module(format, minify=False):
+    """
+    Returns the runtime as a module of 'format' ("commonjs" or "esm") that
+    exports all its top-level names, see module_wrapper().
+    """
+    names = runtime_names()
+    code = runtime(minify=minify)
+    if format == "commonjs":
+        wrapper = "".join([ "exports.%s = %s;\n" % (name, name)
+            for name in names ])
+    else:
+        # functions may be declared twice in a function, but not at the
+        # top level of a module:
+        code = "var $runtime = (function() {\n" + code
+        wrapper = "return {%s};\n})();\nexport var %s;\n" % (
+                ", ".join([ "%s: %s" % (name, name) for name in names ]),
+                ", ".join([ "%s = $runtime.%s" % (name, name)
+                    for name in names ]))
+    if minify:
+        wrapper = minify_js(wrapper) + "\n"
+    return code + wrapper
+
+def module_wrapper(js, tree, format, url, minify=False):
+    """
+    Returns the code (header, footer) that makes the translation 'js' of
+    the module 'tree' a module of 'format' ("commonjs" or "esm"). The
+    header imports the names of the runtime that 'js' uses from the
+    runtime module at 'url', and the footer exports the public names of
+    the module.
+
+    Modules are strict, so the header also declares the top-level names
+    of the module, except for functions, which may not be declared twice.
+    """
+    names = module_names(tree)
+    imports = sorted(set([ name.split(".")[0]
+        for name in js_references(js_tokens(js)) ]) &
+        set(runtime_names()) - names)
+    exports = [ name for name in public_names(tree, names)
+        if name not in JS.name_map and name not in JS.builtin ]
+    functions = set()
+    depth = 0
+    previous = None
+    for kind, text in js_tokens(js):
+        if kind in ('space', 'newline', 'comment'):
+            continue
+        if kind == 'punct' and text in '([{':
+            depth += 1
+        elif kind == 'punct' and text in ')]}':
+            depth -= 1
+        elif kind == 'name' and previous == 'function' and depth == 0:
+            functions.add(text)
+        previous = text
+    variables = sorted([ name for name in names - functions
+        if name not in JS.name_map and name not in JS.builtin ])
+    if format == "commonjs":
+        header = "var $runtime = require('%s');\n" % url
+        if imports:
+            header += "var %s;\n" % ", ".join([ "%s = $runtime.%s" %
+                (name, name) for name in imports ])
+        footer = "".join([ "exports.%s = %s;\n" % (name, name)
+            for name in exports ])
+    else:
+        header = "import { %s } from '%s';\n" % (", ".join(imports), url)
+        footer = ""
+        if exports:
+            footer = "export { %s };\n" % ", ".join(exports)
+    if variables:
+        header += "var %s;\n" % ", ".join(variables)
+    if minify:
+        header = minify_js(header) + "\n"
+        footer = footer and minify_js(footer) + "\n"
+    return header, footer
+
+def scope_module(js, tree, minify=False):
+    """
+    Puts the translation 'js' of the module 'tree' into a function of its
+    own, so that its names are local variables instead of properties of
+    the global object. The properties of py_builtins that it uses are read
+    into local variables once, when the module starts, and the public
+    names of the module are put on the global object when it ends. Those
+    that are declared 'global' somewhere are put there as accessors of the
+    local variables, so that later assignments are seen on both sides.
+
+    Returns (header, js, footer), where the columns of 'js' didn't change.
+    """
+    tokens = list(js_tokens(js))
+    builtins = set()
+    previous = None
+    for i, (kind, text) in enumerate(tokens):
+        if kind == 'name' and text == 'py_builtins' and previous != '.' and \
+                tokens[i + 1:i + 2] == [('punct', '.')] and \
+                tokens[i + 2:i + 3] and tokens[i + 2][0] == 'name':
+            # py_builtins.max -> py_builtins$max
+            tokens[i + 1] = ('punct', '$')
+            builtins.add(tokens[i + 2][1])
+        if kind not in ('space', 'newline', 'comment'):
+            previous = text
+    exports = [ name for name in public_names(tree)
+        if name not in JS.name_map and name not in JS.builtin ]
+
+    header = "(function($exports) {\n"
+    if builtins:
+        header += "var %s;\n" % ", ".join([ "py_builtins$%s = py_builtins.%s" %
+            (name, name) for name in sorted(builtins) ])
+    # names that functions rebind later stay live through accessors:
+    rebound = global_names(tree)
+    footer = ""
+    for name in exports:
+        if name in rebound:
+            footer += "Object.defineProperty($exports, \"%s\", " \
+                "{get: function() { return %s; }, set: function($value) " \
+                "{ %s = $value; }, enumerable: true, configurable: true});\n" \
+                % (name, name, name)
+        else:
+            footer += "$exports.%s = %s;\n" % (name, name)
+    footer += "})(this);\n"
+    if minify:
+        header = minify_js(header) + "\n"
+        footer = minify_js(footer) + "\n"
+    return header, "".join([ text for kind, text in tokens ]), footer
+
+def runtime_url(options, out_filename=None):
+    """
+    Returns the URL that the module written to 'out_filename' imports the
+    runtime module from: --runtime-url, or the runtime module in the
+    output directory relative to 'out_filename'.
+    """
+    if options.runtime_url:
+        return options.runtime_url
+    name = RUNTIME_MODULE + module_formats[options.format]
+    if out_filename is None or options.output_dir is None:
+        return "./" + name
+    url = os.path.relpath(os.path.join(options.output_dir, name),
+            os.path.dirname(out_filename)).replace(os.sep, "/")
+    if not url.startswith("."):
+        url = "./" + url
+    return url
+
+MANIFEST = ".py2js-manifest.json"
+
+def package_root(filename):
+    """
+    Returns the directory that has to be on the search path to import the
+    module 'filename', i.e. the parent of its top-level package.
+    """
+    directory = os.path.dirname(os.path.abspath(filename))
+    while os.path.isfile(os.path.join(directory, "__init__.py")):
+        directory = os.path.dirname(directory)
+    return directory
+
+def module_files(name, path):
+    """
+    Returns the files that importing the dotted module 'name' executes
+    (the __init__.py of each package and the module itself), looked up in
+    the directories 'path'. Returns an empty list if it isn't found.
+    """
+    parts = name.split(".")
+    for directory in path:
+        files = []
+        for i, part in enumerate(parts):
+            directory = os.path.join(directory, part)
+            if os.path.isfile(os.path.join(directory, "__init__.py")):
+                files.append(os.path.join(directory, "__init__.py"))
+            elif i == len(parts) - 1 and os.path.isfile(directory + ".py"):
+                files.append(directory + ".py")
+            else:
+                break
+        else:
+            return files
+    return []
+
+def find_imports(tree, filename):
+    """
+    Returns the sorted absolute filenames of the modules that the module
+    'tree' (parsed from 'filename') imports and that can be found.
+    """
+    filename = os.path.abspath(filename)
+    path = [os.path.dirname(filename), package_root(filename)]
+    imports = set()
+
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            for alias in node.names:
+                imports.update(module_files(alias.name, path))
+        elif isinstance(node, ast.ImportFrom):
+            if node.level:
+                base = os.path.dirname(filename)
+                for i in range(node.level - 1):
+                    base = os.path.dirname(base)
+                search = [base]
+            else:
+                search = path
+            if node.module:
+                imports.update(module_files(node.module, search))
+                prefix = node.module + "."
+            else:
+                prefix = ""
+            for alias in node.names:
+                if alias.name != "*":
+                    # 'from package import module' imports a submodule:
+                    imports.update(module_files(prefix + alias.name, search))
+
+    imports.discard(filename)
+    return sorted(imports)
+
+def module_names(tree):
+    """
+    Returns the names bound at the top level of the module 'tree',
+    including those declared 'global' in its functions, but not those of
+    'from ... import *'.
+    """
+    names = set(global_names(tree))
+    nodes = list(tree.body)
+
+    while nodes:
+        node = nodes.pop()
+        if isinstance(node, (ast.FunctionDef, ast.ClassDef)):
+            names.add(node.name)
+            continue
+        if isinstance(node, ast.Lambda):
+            continue
+        if isinstance(node, (ast.Import, ast.ImportFrom)):
+            for alias in node.names:
+                if alias.name != "*":
+                    names.add(alias.asname or alias.name.split(".")[0])
+        elif isinstance(node, ast.Name) and \
+                not isinstance(node.ctx, ast.Load):
+            names.add(node.id)
+        nodes.extend(ast.iter_child_nodes(node))
+
+    return names
+
+def module_variable(name):
+    """Returns the JavaScript variable of the module 'name' in a bundle. """
+    return "$mod$" + name.replace(".", "$")
+
+class Bundle(object):
+    """
+    The program made of the Python file 'filename' and all the modules
+    that it imports, directly or not, resolved at compile time. Modules
+    are looked up as Python 2 would: relative to the importing package
+    first, then in the directory of 'filename' and in 'path'.
+
+    'modules' maps the names of the modules ("__main__" for 'filename') to
+    their files, in the order they have to run in. See js().
+
+    If 'lazy' is true, modules only run when they are first imported, like
+    in Python, and can be split into chunks that are loaded on demand. See
+    split(). If 'optimize' is true, modules are simplified by an Optimizer,
+    so the imports in code that can't run don't add modules.
+
+    If a dict 'records' is given, the size, mtime and hash of every file
+    that is read are put in it, like in a module_record(), also when a
+    module fails to compile.
+    """
+
+    def __init__(self, filename, path=(), lazy=False, optimize=False,
+            records=None):
+        filename = os.path.abspath(filename)
+        self.path = [os.path.dirname(filename)] + \
+            [ os.path.abspath(directory) for directory in path ]
+        self.lazy = lazy
+        self.optimize = optimize
+        if records is None:
+            records = {}
+        self.records = records
+        self.files = {}
+        self.trees = {}
+        self.modules = OrderedDict()
+        self.add("__main__", filename)
+
+    def filename(self, name):
+        """Returns the file of the module 'name', or None. """
+        files = module_files(name, self.path)
+        if files:
+            return files[-1]
+        return None
+
+    def tree(self, name):
+        if name not in self.trees:
+            filename = self.files.get(name) or self.filename(name)
+            # stat() first, so a concurrent edit makes the record stale:
+            stat = os.stat(filename)
+            f = open(filename)
+            try:
+                source = f.read()
+            finally:
+                f.close()
+            self.records[filename] = {
+                    "stat": [stat.st_mtime, stat.st_size],
+                    "hash": hashlib.sha1(source).hexdigest(),
+                    }
+            self.trees[name] = ast.parse(source, filename)
+            if self.optimize:
+                optimize_module(self.trees[name])
+        return self.trees[name]
+
+    def add(self, name, filename):
+        self.files[name] = filename
+        for node in sorted([ node for node in ast.walk(self.tree(name))
+                if isinstance(node, (ast.Import, ast.ImportFrom)) ],
+                key=lambda node: (node.lineno, node.col_offset)):
+            for module in self.resolve(node, name)[0]:
+                # a module that is already there may still be running
+                # (circular imports), like in Python:
+                if module not in self.files:
+                    self.add(module, self.filename(module))
+        self.modules[name] = filename
+
+    def package(self, name):
+        """Returns the package that the module 'name' is or is in. """
+        if name == "__main__":
+            return ""
+        if os.path.basename(self.files[name]) == "__init__.py":
+            return name
+        return name.rpartition(".")[0]
+
+    def find(self, name, importer, level=0):
+        """
+        Returns the full name of the module 'name' imported 'level' levels
+        up from the module 'importer', or None if it doesn't exist.
+        """
+        package = self.package(importer)
+        if level:
+            parts = package and package.split(".") or []
+            if level - 1 > len(parts):
+                return None
+            candidates = [".".join(parts[:len(parts) - level + 1] +
+                filter(None, [name]))]
+        elif package:
+            candidates = [package + "." + name, name]
+        else:
+            candidates = [name]
+        for candidate in candidates:
+            if candidate and self.filename(candidate) is not None:
+                return candidate
+        return None
+
+    def names(self, name, seen=()):
+        """Returns the names bound at the top level of the module 'name'. """
+        tree = self.tree(name)
+        names = module_names(tree)
+        for node in tree.body:
+            if isinstance(node, ast.ImportFrom) and \
+                    node.names[0].name == "*":
+                module = self.find(node.module or "", name, node.level)
+                if module is not None and module not in seen:
+                    names.update(self.public_names(module,
+                        tuple(seen) + (name,)))
+        return names
+
+    def public_names(self, name, seen=()):
+        """Returns the names that 'from name import *' imports. """
+        return public_names(self.tree(name), self.names(name, seen))
+
+    def reference(self, module, result=None):
+        """
+        Returns the JavaScript expression of the module 'result' (by
+        default 'module') that importing 'module' gives.
+        """
+        if not self.lazy:
+            return module_variable(result or module)
+        if result is None or result == module:
+            return "$import('%s')" % module
+        return "$import('%s', '%s')" % (module, result)
+
+    def resolve(self, node, importer):
+        """
+        Resolves the import statement 'node' in the module 'importer'.
+
+        Returns a pair (modules, bindings): the full names of the modules
+        that it runs, in order, and pairs (name, JavaScript expression) of
+        the names that it binds. Raises JSError if a module isn't found.
+        """
+        modules = []
+        bindings = []
+
+        if isinstance(node, ast.Import):
+            for alias in node.names:
+                module = self.find(alias.name, importer)
+                if module is None:
+                    raise JSError("no module named %s" % alias.name)
+                modules.extend(parent_modules(module))
+                if alias.asname:
+                    bindings.append((alias.asname, self.reference(module)))
+                else:
+                    # 'import a.b' binds 'a', maybe in the current package:
+                    first = alias.name.split(".")[0]
+                    top = module[:len(module) - len(alias.name)] + first
+                    bindings.append((first, self.reference(module, top)))
+            return modules, bindings
+
+        module = self.find(node.module or "", importer, node.level)
+        if module is None:
+            raise JSError("no module named %s" % ("." * node.level +
+                (node.module or "")))
+        modules.extend(parent_modules(module))
+        for alias in node.names:
+            if alias.name == "*":
+                for name in self.public_names(module):
+                    bindings.append((name, "%s.%s" % (self.reference(module),
+                        name)))
+                continue
+            submodule = module + "." + alias.name
+            if alias.name not in self.names(module) and \
+                    self.filename(submodule) is not None:
+                modules.append(submodule)
+                value = self.reference(submodule)
+            else:
+                value = "%s.%s" % (self.reference(module), alias.name)
+            bindings.append((alias.asname or alias.name, value))
+        return modules, bindings
+
+    def js(self, minify=False):
+        """
+        Returns the JavaScript of the bundle.
+
+        Every module gets an object, see module_variable(), that its
+        package refers to. The code of each module runs once in a function
+        of its own, in the order of 'modules', and then puts its top-level
+        names on its object. Imports become references to these objects.
+
+        If the bundle is lazy, the modules are $define()d instead, and
+        imports become $import() calls, which run the module the first
+        time (see py-builtins.js).
+        """
+        out = Emitter(minify=minify)
+        if self.lazy:
+            for name in self.modules:
+                self.module_js(out, name)
+            out.line("$import('__main__');")
+            return out.getvalue()
+
+        for name in self.modules:
+            out.line("var %s = {};" % module_variable(name))
+        for name in self.modules:
+            package, dot, child = name.rpartition(".")
+            if package in self.modules:
+                out.line("%s.%s = %s;" % (module_variable(package), child,
+                    module_variable(name)))
+        for name in self.modules:
+            self.module_js(out, name)
+        return out.getvalue()
+
+    def module_js(self, out, name):
+        """Writes the JavaScript of the module 'name' to the Emitter 'out'. """
+        v = JS(out)
+        v._bundle = self
+        v._module = name
+        names = sorted([ n for n in self.names(name)
+            if n not in JS.name_map and n not in JS.builtin ])
+        if self.lazy:
+            out.line("$define('%s', function($module) {" % name)
+            target = "$module"
+        else:
+            out.line("(function() {")
+            target = module_variable(name)
+        out.indent()
+        out.line("var __name__ = str('%s');" % name)
+        if names:
+            out.line("var %s;" % ", ".join(names))
+        v.visit(self.tree(name))
+        for n in names:
+            out.line("%s.%s = %s;" % (target, n, n))
+        out.dedent()
+        if self.lazy:
+            out.line("});")
+        else:
+            out.line("})();")
+
+    def split(self, groups=(), minify=False):
+        """
+        Splits a lazy bundle into chunks that are loaded on demand.
+
+        'groups' is a list of (chunk name, module names) of the modules
+        that go into one chunk; a package stands for the modules in it.
+        Every other imported module gets a chunk of its own, named after
+        it. Returns a pair (main, chunks): the JavaScript that runs the
+        program, without the chunks, and a list of (chunk name, modules,
+        JavaScript) in the order of 'modules'. Before 'main' runs, the
+        file of every chunk has to be put in $import.chunks for each of
+        its modules.
+        """
+        assert self.lazy
+        chunk_of = {}
+        for name in self.modules:
+            if name == "__main__":
+                continue
+            chunk_of[name] = name
+            for chunk, members in groups:
+                if [ m for m in members
+                        if name == m or name.startswith(m + ".") ]:
+                    chunk_of[name] = chunk
+                    break
+
+        main = Emitter(minify=minify)
+        outs = OrderedDict()
+        modules = {}
+        for name in self.modules:
+            if name == "__main__":
+                out = main
+            else:
+                chunk = chunk_of[name]
+                if chunk not in outs:
+                    outs[chunk] = Emitter(minify=minify)
+                    modules[chunk] = []
+                out = outs[chunk]
+                modules[chunk].append(name)
+            self.module_js(out, name)
+        main.line("$import('__main__');")
+        return main.getvalue(), [ (chunk, modules[chunk], out.getvalue())
+            for chunk, out in outs.iteritems() ]
+
+def public_names(tree, names=None):
+    """
+    Returns the names that 'from module import *' imports from the module
+    'tree': its __all__, or those of its top-level 'names' (by default
+    module_names()) that don't start with an underscore.
+    """
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and \
+                len(node.targets) == 1 and \
+                isinstance(node.targets[0], ast.Name) and \
+                node.targets[0].id == "__all__" and \
+                isinstance(node.value, (ast.List, ast.Tuple)):
+            return [ elt.s for elt in node.value.elts
+                if isinstance(elt, ast.Str) ]
+    if names is None:
+        names = module_names(tree)
+    return sorted([ n for n in names if not n.startswith("_") ])
+
+def parent_modules(name):
+    """Returns 'name' and the packages it is in, outermost first. """
+    parts = name.split(".")
+    return [ ".".join(parts[:i + 1]) for i in range(len(parts)) ]
+
+def file_hash(filename):
+    f = open(filename, "rb")
+    try:
+        return hashlib.sha1(f.read()).hexdigest()
+    finally:
+        f.close()
+
+def module_record(filename):
+    """
+    Returns the manifest record of the module 'filename': the size and
+    mtime, the hash and the imports of its source. The source is read
+    after the stat(), so a concurrent edit makes the record stale rather
+    than being missed.
+    """
+    stat = os.stat(filename)
+    f = open(filename, "rb")
+    try:
+        source = f.read()
+    finally:
+        f.close()
+    try:
+        imports = find_imports(ast.parse(source), filename)
+    except SyntaxError:
+        imports = []
+    return {
+            "stat": [stat.st_mtime, stat.st_size],
+            "hash": hashlib.sha1(source).hexdigest(),
+            "imports": imports,
+            }
+
+class Manifest(object):
+    """
+    The build manifest of an incremental build.
+
+    For every compiled module it records the output file, the size, mtime
+    and hash of the source and the modules it imports. A module needs to
+    be rebuilt if it changed or if any module it imports (directly or
+    indirectly) needs to be rebuilt. The record of a bundle also has the
+    size, mtime and hash of the other files in it ("files"), and the
+    bundle is rebuilt when any of them changed. The manifest is discarded
+    when the compiler or the options change.
+
+    Modules that failed to compile are recompiled every time, unless
+    'retry_failed' is False, in which case they wait for the next change.
+    """
+
+    retry_failed = True
+
+    def __init__(self, filename, options):
+        self.filename = filename
+        self.options = options
+        self.modules = {}
+        try:
+            f = open(filename)
+            try:
+                data = json.load(f)
+            finally:
+                f.close()
+        except (IOError, ValueError):
+            return
+        if data.get("compiler") == compiler_version() and \
+                data.get("options") == options:
+            self.modules = data["modules"]
+
+    def changed(self, filename):
+        entry = self.modules.get(filename)
+        if entry is None:
+            return True
+        if entry["output"] is None:
+            if self.retry_failed:
+                return True
+        elif not os.path.exists(entry["output"]):
+            return True
+        for name, record in entry.get("files", {}).iteritems():
+            if self.stale(name, record):
+                return True
+        return self.stale(filename, entry)
+
+    def stale(self, filename, record):
+        """Tells whether 'filename' differs from its 'record'. """
+        try:
+            stat = os.stat(filename)
+        except OSError:
+            return True
+        if [stat.st_mtime, stat.st_size] == record["stat"]:
+            return False
+        return file_hash(filename) != record["hash"]
+
+    def dirty(self, filenames):
+        """
+        Returns the set of modules among 'filenames' (absolute filenames)
+        that need to be recompiled.
+        """
+        filenames = set(filenames)
+        dirty = set([ filename for filename in filenames
+            if self.changed(filename) ])
+
+        dependents = {}
+        for filename, entry in self.modules.iteritems():
+            for imported in entry["imports"]:
+                dependents.setdefault(imported, []).append(filename)
+
+        # a module that disappeared changes its importers as well:
+        stack = list(dirty) + [ filename for filename in self.modules
+                if not os.path.exists(filename) ]
+        while stack:
+            for dependent in dependents.get(stack.pop(), ()):
+                if dependent in filenames and dependent not in dirty:
+                    dirty.add(dependent)
+                    stack.append(dependent)
+
+        return dirty
+
+    def update(self, filename, output, record):
+        """
+        Records that 'filename' was compiled into 'output' (None if the
+        compilation failed). 'record' is the module_record() taken before.
+        """
+        entry = dict(record)
+        entry["output"] = output
+        self.modules[filename] = entry
+
+    def remove(self, filename):
+        self.modules.pop(filename, None)
+
+    def save(self):
+        data = {
+                "compiler": compiler_version(),
+                "options": self.options,
+                "modules": self.modules,
+                }
+        tmp = self.filename + ".tmp"
+        f = open(tmp, "w")
+        try:
+            json.dump(data, f, indent=1, sort_keys=True)
+        finally:
+            f.close()
+        if os.path.exists(self.filename):
+            os.remove(self.filename)
+        os.rename(tmp, self.filename)
+
+def manifest_options(options):
+    """
+    Returns the command line 'options' that the output depends on, as the
+    options of a Manifest.
+    """
+    return repr((options.include_builtins, options.full_runtime,
+        options.stream, options.minify, options.source_map,
+        options.inline_source_map, options.format, options.runtime_url,
+        options.scoped, options.optimize, options.bundle, options.split,
+        options.chunks, options.chunk_url))
+
+def compile_job(job):
+    """
+    Compiles one file in a worker process.
+
+    'job' is a tuple (filename, out_filename, options, cache). If
+    'out_filename' is None, the JavaScript is returned, otherwise it is
+    written to that file. Returns a tuple (filename, js, record, sizes,
+    error), where 'record' is the module_record() of the file (only in
+    incremental builds), 'sizes' the module_sizes() of the output (only
+    with --size-report or --size-budget) and 'error' is the formatted
+    traceback if the compilation failed.
+    """
+    filename, out_filename, options, cache = job
+    record = None
+    sourcemap = None
+    sizes = None
+    measure = options.size_report or options.size_budget is not None
+    write_map = out_filename is not None and \
+            (options.source_map or options.inline_source_map)
+    # the files read by a bundle:
+    files = OrderedDict()
+    try:
+        if options.incremental or options.watch:
+            record = module_record(filename)
+        if write_map:
+            sourcemap = SourceMap(os.path.relpath(filename,
+                    os.path.dirname(os.path.abspath(out_filename))),
+                read_file(filename), os.path.basename(out_filename))
+        elif measure:
+            sourcemap = SourceMap(filename)
+        if out_filename is None:
+            out = StringIO()
+        else:
+            out = open(out_filename, "w")
+        try:
+            # the lines before the module, for the source map:
+            lines = 0
+            header = ""
+            # the bytes of the runtime at the start, for the sizes:
+            runtime_size = 0
+            if options.bundle:
+                write_bundle(filename, out, out_filename, options, files)
+            elif options.format != "script" or options.scoped:
+                js = StringIO()
+                write_js(filename, js, False, cache, options.minify,
+                        sourcemap, options.optimize)
+                js = js.getvalue()
+                tree = ast.parse(read_file(filename), filename)
+                if options.optimize:
+                    tree = optimize_module(tree)
+                if options.scoped:
+                    header, js, footer = scope_module(js, tree,
+                            options.minify)
+                else:
+                    header, footer = module_wrapper(js, tree,
+                            options.format, runtime_url(options, out_filename),
+                            options.minify)
+                if options.include_builtins and out_filename is not None:
+                    if options.full_runtime:
+                        lines = write_runtime(out, options.minify)
+                        runtime_size = out.tell()
+                    else:
+                        code = runtime(header + js + footer, options.minify)
+                        runtime_size = len(code) + 1
+                        header = code + "\n" + header
+                out.write(header)
+                out.write(js)
+                out.write(footer)
+            elif not options.include_builtins or out_filename is None:
+                write_js(filename, out, options.stream, cache,
+                        options.minify, sourcemap, options.optimize)
+            elif options.stream or options.full_runtime:
+                lines = write_runtime(out, options.minify)
+                runtime_size = out.tell()
+                write_js(filename, out, options.stream, cache,
+                        options.minify, sourcemap, options.optimize)
+            else:
+                js = StringIO()
+                write_js(filename, js, False, cache, options.minify,
+                        sourcemap, options.optimize)
+                header = runtime(js.getvalue(), options.minify) + "\n"
+                runtime_size = len(header)
+                out.write(header)
+                out.write(js.getvalue())
+            if sourcemap is not None:
+                sourcemap.shift(lines + header.count("\n"))
+            if write_map:
+                if options.inline_source_map:
+                    out.write(sourcemap.comment() + "\n")
+                else:
+                    f = open(out_filename + ".map", "w")
+                    try:
+                        f.write(sourcemap.dumps())
+                    finally:
+                        f.close()
+                    out.write(sourcemap.comment(
+                        os.path.basename(out_filename) + ".map") + "\n")
+            if record is not None and options.bundle:
+                record = bundle_record(filename, record, files)
+            if out_filename is None:
+                js = out.getvalue()
+            else:
+                js = None
+        finally:
+            out.close()
+        if measure:
+            # what was written, with the runtime and the wrapper:
+            if js is None:
+                output = read_file(out_filename)
+            else:
+                output = js
+            sizes = module_sizes(filename, output, sourcemap.mappings,
+                    runtime_size)
+        return filename, js, record, sizes, None
+    except Exception:
+        if out_filename is not None and os.path.exists(out_filename):
+            os.remove(out_filename)
+        if record is not None and options.bundle:
+            # a fix in any of the files read so far may help:
+            record = bundle_record(filename, record, files)
+        return filename, None, record, None, traceback.format_exc()
+
+def bundle_record(filename, record, files):
+    """
+    Returns the manifest 'record' of the program 'filename' with the
+    records of the other 'files' of its bundle.
+    """
+    filename = os.path.abspath(filename)
+    record = dict(record)
+    record["files"] = dict([ (name, file)
+        for name, file in files.iteritems() if name != filename ])
+    return record
+
+def write_bundle(filename, out, out_filename, options, records=None):
+    """
+    Writes the bundle of the program 'filename' to 'out' and, with
+    --split, its chunks next to 'out_filename'. The files read are put in
+    'records', see Bundle.
+    """
+    if options.split:
+        groups = [ (chunk.split("=", 1)[0],
+            chunk.split("=", 1)[1].split(",")) for chunk in options.chunks ]
+        js, chunks = Bundle(filename, lazy=True, optimize=options.optimize,
+                records=records).split(groups, options.minify)
+    else:
+        js = Bundle(filename, optimize=options.optimize,
+                records=records).js(options.minify)
+        chunks = []
+    if options.include_builtins and out_filename is not None:
+        if options.full_runtime:
+            write_runtime(out, options.minify)
+        else:
+            # the chunks get the runtime of the program:
+            out.write(runtime("\n".join([js] + [ chunk_js
+                for chunk, modules, chunk_js in chunks ]), options.minify))
+            out.write("\n")
+    if options.split:
+        out.write("$import.base = '%s';\n" % options.chunk_url)
+    for chunk, modules, chunk_js in chunks:
+        asset = write_asset(os.path.dirname(out_filename), chunk, [chunk_js])
+        for module in modules:
+            out.write("$import.chunks['%s'] = '%s';\n" % (module, asset))
+    out.write(js)
+    out.write("\n")
+
+def find_sources(args, output_dir=None, extension=".js"):
+    """
+    Expands the files and directories in 'args' into a list of pairs
+    (filename, out_filename). Directories are searched recursively for .py
+    files, which keep their relative paths below 'output_dir', with the
+    file extension 'extension'. Raises ValueError if two different files
+    would be written to the same output file.
+    """
+    sources = []
+    # the source of every output file:
+    outputs = {}
+
+    for arg in args:
+        if os.path.isdir(arg):
+            filenames = []
+            for dirpath, dirnames, names in os.walk(arg):
+                dirnames.sort()
+                for name in sorted(names):
+                    if name.endswith(".py"):
+                        filenames.append(os.path.join(dirpath, name))
+            root = arg
+        else:
+            filenames = [arg]
+            root = os.path.dirname(arg)
+
+        for filename in filenames:
+            if output_dir is None:
+                out_filename = None
+            else:
+                relative = os.path.relpath(filename, root)
+                out_filename = os.path.join(output_dir,
+                        os.path.splitext(relative)[0] + extension)
+                key = os.path.normcase(os.path.abspath(out_filename))
+                if key in outputs:
+                    if os.path.normcase(os.path.abspath(outputs[key])) == \
+                            os.path.normcase(os.path.abspath(filename)):
+                        # the same file, given twice
+                        continue
+                    raise ValueError("%s and %s would both be written to %s"
+                            % (outputs[key], filename, out_filename))
+                outputs[key] = filename
+            sources.append((filename, out_filename))
+
+    return sources
+
+def build(sources, options, cache=None, manifest=None, pool=None,
+        report=None):
+    """
+    Compiles 'sources' (pairs as returned by find_sources()). If a
+    'manifest' is given, only the files that need it are recompiled. Files
+    are compiled in 'pool' if there is more than one, otherwise in this
+    process. The sizes of the output are put in the size_report()
+    'report' if one is given. Returns a pair (compiled, failed) of the
+    number of files.
+    """
+    for filename, out_filename in sources:
+        if out_filename is not None:
+            directory = os.path.dirname(out_filename)
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory)
+
+    if manifest is not None:
+        dirty = manifest.dirty([ os.path.abspath(filename)
+            for filename, out_filename in sources ])
+        sources = [ (filename, out_filename)
+                for filename, out_filename in sources
+                if os.path.abspath(filename) in dirty ]
+        for filename in manifest.modules.keys():
+            if not os.path.exists(filename):
+                output = manifest.modules[filename]["output"]
+                if output is not None and os.path.exists(output):
+                    os.remove(output)
+                manifest.remove(filename)
+        if not sources:
+            return 0, 0
+
+    # without the whole program, the runtime can't be reduced:
+    full_runtime = options.full_runtime or options.stream
+    bundle = None
+    if options.include_builtins and options.output_dir is None:
+        if full_runtime:
+            write_runtime(sys.stdout, options.minify)
+            if report is not None:
+                report["runtime"] = runtime_sizes(None, options.minify)
+        else:
+            bundle = []
+
+    failed = 0
+
+    if options.stream and options.output_dir is None and report is None:
+        # the bundle is written in order, so there's nothing to gain from
+        # workers that would have to keep their output in memory:
+        for filename, out_filename in sources:
+            try:
+                write_js(filename, sys.stdout, True, cache, options.minify,
+                        optimize=options.optimize)
+            except Exception:
+                sys.stderr.write("%s: compilation failed\n%s" % \
+                        (filename, traceback.format_exc()))
+                failed += 1
+    else:
+        work = [ (filename, out_filename, options, cache)
+                for filename, out_filename in sources ]
+        if pool is None or len(work) == 1:
+            results = itertools.imap(compile_job, work)
+        else:
+            results = pool.imap(compile_job, work)
+        outputs = dict(sources)
+        for filename, js, record, sizes, error in results:
+            if error is not None:
+                sys.stderr.write("%s: compilation failed\n%s" % \
+                        (filename, error))
+                failed += 1
+                if manifest is not None and record is not None:
+                    manifest.update(os.path.abspath(filename), None, record)
+                elif manifest is not None:
+                    manifest.remove(os.path.abspath(filename))
+                continue
+            if sizes is not None:
+                report["modules"].append(sizes)
+            if bundle is not None:
+                bundle.append(js)
+            elif js is not None:
+                sys.stdout.write(js)
+            elif manifest is not None:
+                manifest.update(os.path.abspath(filename),
+                        os.path.abspath(outputs[filename]), record)
+
+        if bundle is not None:
+            js = "".join(bundle)
+            sys.stdout.write(runtime(js, options.minify))
+            sys.stdout.write("\n")
+            sys.stdout.write(js)
+            if report is not None:
+                report["runtime"] = runtime_sizes(js, options.minify)
+
+    if report is not None:
+        entries = report["modules"] + filter(None, [report["runtime"]])
+        report["total"] = OrderedDict([("name", "total"),
+            ("raw", sum([ entry["raw"] for entry in entries ])),
+            ("gzip", sum([ entry["gzip"] for entry in entries ]))])
+
+    return len(sources), failed
+
+def gzip_size(text):
+    """Returns the size of 'text' compressed with gzip. """
+    out = StringIO()
+    f = gzip.GzipFile(fileobj=out, mode="wb", compresslevel=9, mtime=0)
+    try:
+        f.write(text)
+    finally:
+        f.close()
+    return len(out.getvalue())
+
+def size_entry(name, texts, **fields):
+    text = "".join(texts)
+    entry = OrderedDict([("name", name), ("raw", len(text)),
+        ("gzip", gzip_size(text))])
+    entry.update(sorted(fields.items()))
+    return entry
+
+def definitions(tree):
+    """
+    Returns (first line, last line, name, kind) for the classes and
+    functions in 'tree', with names qualified by the enclosing ones.
+    """
+    nodes = []
+    children = {}
+    names = {}
+    stack = [(tree, "")]
+    while stack:
+        node, prefix = stack.pop()
+        nodes.append(node)
+        children[node] = child_nodes(node)
+        if isinstance(node, (ast.FunctionDef, ast.ClassDef)):
+            names[node] = prefix = prefix + node.name
+            prefix += "."
+        stack.extend([ (child, prefix) for child in children[node] ])
+
+    # the first and the last line of every subtree, children first:
+    lines = {}
+    for node in reversed(nodes):
+        spans = [ lines[child] for child in children[node]
+            if child in lines ]
+        if hasattr(node, 'lineno'):
+            spans.append((node.lineno, node.lineno))
+        if spans:
+            lines[node] = (min([ first for first, last in spans ]),
+                max([ last for first, last in spans ]))
+
+    result = []
+    for node in nodes:
+        if node in names:
+            if isinstance(node, ast.ClassDef):
+                kind = "class"
+            else:
+                kind = "function"
+            result.append(lines[node] + (names[node], kind))
+    return result
+
+def module_sizes(filename, js, mappings, runtime_size=0):
+    """
+    Attributes the output 'js' of the Python file 'filename' to its
+    classes and functions, using the source map 'mappings'. Every byte
+    counts for the innermost definition it comes from, the first
+    'runtime_size' bytes for "<runtime>" and the rest for "<module>".
+    Returns the size entry of the module.
+    """
+    defs = definitions(ast.parse(read_file(filename), filename))
+
+    starts = [0]
+    for line in js.split("\n"):
+        starts.append(starts[-1] + len(line) + 1)
+    offsets = sorted(set([ (starts[line] + column, source_line + 1)
+        for line, column, source_line, source_column in mappings ]))
+    offsets.insert(0, (runtime_size, None))
+    offsets.append((len(js), None))
+
+    # the innermost definition of each source line, going down the lines
+    # with the definitions that enclose the current one:
+    owners = {None: ("<module>", "module")}
+    defs.sort(key=lambda (start, last, name, kind): (start, -last))
+    enclosing = []
+    i = 0
+    for lineno in sorted(set([ lineno for offset, lineno in offsets
+            if lineno is not None ])):
+        while i < len(defs) and defs[i][0] <= lineno:
+            while enclosing and enclosing[-1][1] < defs[i][0]:
+                enclosing.pop()
+            enclosing.append(defs[i])
+            i += 1
+        while enclosing and enclosing[-1][1] < lineno:
+            enclosing.pop()
+        if enclosing:
+            owners[lineno] = enclosing[-1][2:]
+        else:
+            owners[lineno] = owners[None]
+
+    parts = OrderedDict([(("<module>", "module"), [])])
+    if runtime_size:
+        parts[("<runtime>", "runtime")] = [js[:runtime_size]]
+    for (offset, lineno), (end, next_lineno) in zip(offsets, offsets[1:]):
+        parts.setdefault(owners[lineno], []).append(js[offset:end])
+
+    entries = [ size_entry(name, texts, kind=kind)
+        for (name, kind), texts in parts.items() ]
+    entries.sort(key=lambda entry: -entry["raw"])
+    return size_entry(filename, [js], definitions=entries)
+
+def runtime_sizes(js, minify=False):
+    """
+    Returns the size entry of the runtime() of the JavaScript 'js', or of
+    the whole runtime if 'js' is None, per component.
+    """
+    r = load_runtime()
+    if js is None:
+        selected = range(len(r.statements))
+    else:
+        selected = r.select(js_references(js_tokens(js)))
+    parts = OrderedDict()
+    last_license = None
+    for i in selected:
+        code, license, provides, requires = r.statements[i]
+        if license is not last_license:
+            last_license = license
+            if license is not None:
+                parts.setdefault("(licenses)", []).append(license + "\n")
+        if minify:
+            code = minify_js(code)
+        name = provides and ", ".join(sorted(provides)) or \
+            "(always included)"
+        parts.setdefault(name, []).append(code + "\n")
+    entries = [ size_entry(name, texts)
+        for name, texts in parts.items() ]
+    entries.sort(key=lambda entry: -entry["raw"])
+    return size_entry("runtime", sum(parts.values(), []), components=entries)
+
+def size_report():
+    """
+    Returns an empty report of the size of the output, which build()
+    fills in: per module and its classes and functions, per runtime
+    component of the runtime that is written on its own (with
+    --include-builtins and without -o) and the total. Sizes are in bytes,
+    raw and compressed with gzip (each entry on its own, so the
+    compressed sizes don't add up, and the total is the sum of them).
+    """
+    return OrderedDict([("modules", []), ("runtime", None), ("total", None)])
+
+def format_size_report(report, limit=20):
+    """
+    Formats 'report' as a table, showing at most 'limit' of the biggest
+    definitions of each module and runtime components.
+    """
+    lines = ["%8s %8s  %s" % ("raw", "gzip", "name")]
+
+    def add(entry, indent=""):
+        lines.append("%8d %8d  %s%s" % (entry["raw"], entry["gzip"], indent,
+            entry["name"]))
+
+    for module in report["modules"]:
+        add(module)
+        for entry in module["definitions"][:limit]:
+            add(entry, "  ")
+    if report["runtime"] is not None:
+        add(report["runtime"])
+        for entry in report["runtime"]["components"][:limit]:
+            add(entry, "  ")
+    add(report["total"])
+    return "\n".join(lines) + "\n"
+
+def watch(args, options, cache=None, pool=None):
+    """
+    Polls the files and directories in 'args' every 'options.interval'
+    seconds and recompiles whatever changed, until interrupted.
+    """
+    manifest = Manifest(os.path.join(options.output_dir, MANIFEST),
+            manifest_options(options))
+    manifest.retry_failed = False
+    error = None
+    while True:
+        start = time.time()
+        modules = len(manifest.modules)
+        try:
+            sources = find_sources(args, options.output_dir,
+                    module_formats[options.format])
+        except ValueError, e:
+            # wait for the files to be renamed:
+            if str(e) != error:
+                error = str(e)
+                sys.stderr.write("[%s] %s\n" % (time.strftime("%H:%M:%S"),
+                    error))
+            time.sleep(options.interval)
+            continue
+        error = None
+        compiled, failed = build(sources, options, cache, manifest, pool)
+        if compiled or len(manifest.modules) != modules:
+            manifest.save()
+        if compiled:
+            sys.stderr.write("[%s] compiled %d file(s) in %.0f ms%s\n" % \
+                    (time.strftime("%H:%M:%S"), compiled,
+                        (time.time() - start)*1000,
+                        failed and ", %d failed" % failed or ""))
+        time.sleep(options.interval)
+
+class CompileTimeout(Exception):
+    pass
+
+def compile_sources(v, sources):
+    """
+    Translates each of 'sources' with the JS instance 'v', which is reset
+    before every one. Returns a list of dicts holding either the
+    JavaScript ("js") or the error message ("error").
+    """
+    results = []
+    for source in sources:
+        v.reset()
+        try:
+            v.visit(ast.parse(source))
+        except Exception, e:
+            results.append({"error": "%s: %s" % (e.__class__.__name__, e)})
+        else:
+            results.append({"js": v.out.getvalue()})
+    return results
+
+def worker_loop(conn):
+    v = JS()
+    while True:
+        try:
+            sources = conn.recv()
+        except EOFError:
+            break
+        if sources is None:
+            break
+        conn.send(compile_sources(v, sources))
+
+class Worker(object):
+    """
+    A compiler in a separate process that is kept warm between jobs. A job
+    that takes too long kills the process, which is replaced by a fresh
+    one.
+    """
+
+    def __init__(self):
+        self.start()
+
+    def start(self):
+        self.conn, conn = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=worker_loop,
+                args=(conn,))
+        self.process.daemon = True
+        self.process.start()
+        conn.close()
+
+    def compile(self, sources, timeout=None):
+        """
+        Returns the compile_sources() results of 'sources'. Raises
+        CompileTimeout if they aren't ready within 'timeout' seconds.
+        """
+        self.conn.send(sources)
+        if not self.conn.poll(timeout):
+            self.process.terminate()
+            self.process.join()
+            self.conn.close()
+            self.start()
+            raise CompileTimeout("compilation timed out")
+        return self.conn.recv()
+
+    def close(self):
+        # other workers may hold a copy of the pipe, so it's not enough to
+        # close it:
+        self.conn.send(None)
+        self.conn.close()
+        self.process.join()
+
+class CompileServer(ThreadingMixIn, HTTPServer):
+    """
+    An HTTP server that translates Python snippets to JavaScript.
+
+    POST /compile takes a JSON object with either a "source" or a list of
+    "sources" and an optional positive "timeout" in seconds. It answers
+    with the result ({"js": ...} or {"error": ...}) or {"results": [...]}
+    in the same order, or with the status 504 after a timeout. GET /stats
+    reports the hits and misses of the result cache.
+
+    The sources of a request that aren't cached are split into one batch
+    per worker process. Only bind it to trusted interfaces.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address=("127.0.0.1", 0), workers=None,
+            cache_size=1000, timeout=10):
+        HTTPServer.__init__(self, address, CompileRequestHandler)
+        self.timeout = timeout
+        self.results = LRU(cache_size)
+        self.workers = Queue()
+        self.worker_count = workers or multiprocessing.cpu_count()
+        for i in range(self.worker_count):
+            self.workers.put(Worker())
+
+    def compile_batch(self, sources, deadline):
+        try:
+            worker = self.workers.get(timeout=max(0, deadline - time.time()))
+        except Empty:
+            raise CompileTimeout("no worker available")
+        try:
+            timeout = deadline - time.time()
+            if timeout <= 0:
+                # don't kill a worker for a job that it never got:
+                raise CompileTimeout("no worker available in time")
+            results = worker.compile(sources, timeout)
+        finally:
+            self.workers.put(worker)
+        for source, result in zip(sources, results):
+            self.results.put(source, result)
+        return dict(zip(sources, results))
+
+    def compile(self, sources, timeout=None):
+        """
+        Returns the results of 'sources' like compile_sources(). Raises
+        CompileTimeout if they aren't ready within 'timeout' seconds
+        (default: the timeout of the server).
+        """
+        if timeout is None:
+            timeout = self.timeout
+        deadline = time.time() + timeout
+        results = [ self.results.get(source) for source in sources ]
+        missing = sorted(set([ source
+            for source, result in zip(sources, results) if result is None ]))
+
+        if missing:
+            batches = [ missing[i::self.worker_count]
+                    for i in range(min(self.worker_count, len(missing))) ]
+            compiled = {}
+            errors = []
+
+            def compile_batch(batch):
+                try:
+                    compiled.update(self.compile_batch(batch, deadline))
+                except CompileTimeout, e:
+                    errors.append(e)
+
+            threads = [ threading.Thread(target=compile_batch, args=(batch,))
+                    for batch in batches[1:] ]
+            for thread in threads:
+                thread.start()
+            compile_batch(batches[0])
+            for thread in threads:
+                thread.join()
+            if errors:
+                raise errors[0]
+
+            results = [ result or compiled[source]
+                    for source, result in zip(sources, results) ]
+
+        return results
+
+    def server_close(self):
+        HTTPServer.server_close(self)
+        while not self.workers.empty():
+            self.workers.get().close()
+
+class CompileRequestHandler(BaseHTTPRequestHandler):
+
+    def reply(self, status, data):
+        body = json.dumps(data)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path != "/stats":
+            self.reply(404, {"error": "not found"})
+            return
+        results = self.server.results
+        self.reply(200, {
+            "hits": results.hits,
+            "misses": results.misses,
+            "entries": len(results),
+            "workers": self.server.worker_count,
+            })
+
+    def do_POST(self):
+        if self.path != "/compile":
+            self.reply(404, {"error": "not found"})
+            return
+        try:
+            length = int(self.headers.getheader("Content-Length", 0))
+            request = json.loads(self.rfile.read(length))
+            if "source" in request:
+                sources = [request["source"]]
+            else:
+                sources = list(request["sources"])
+            if not all([ isinstance(source, basestring)
+                    for source in sources ]):
+                raise ValueError("sources must be strings")
+            timeout = request.get("timeout")
+            if timeout is not None and (isinstance(timeout, bool) or
+                    not isinstance(timeout, (int, long, float)) or
+                    not 0 < timeout < float("inf")):
+                raise ValueError("timeout must be a positive number of "
+                        "seconds")
+        except (ValueError, KeyError, TypeError, AttributeError), e:
+            self.reply(400, {"error": "bad request: %s" % e})
+            return
+
+        try:
+            results = self.server.compile(sources, timeout)
+        except CompileTimeout, e:
+            self.reply(504, {"error": str(e)})
+            return
+
+        if "source" in request:
+            self.reply(200, results[0])
+        else:
+            self.reply(200, {"results": results})
+
+    def log_message(self, format, *args):
+        pass
+
 def main():
-    parser = OptionParser(usage="%prog [options] filename",
-        description="Python to JavaScript compiler.")
+    parser = OptionParser(usage="%prog [options] file_or_dir ...",
+        description="Python to JavaScript compiler. Without -o, the "
+            "translations of all files are written to the standard output "
+            "as one bundle.")
     parser.add_option("--include-builtins",
             action="store_true", dest="include_builtins",
-            default=False, help="include py-builtins.js library in the output")
+            default=False, help="include the parts of the py-builtins.js "
+                "library that the output uses")
+    parser.add_option("--full-runtime",
+            action="store_true", dest="full_runtime",
+            default=False, help="with --include-builtins, include all of "
+                "py-builtins.js (always the case with --stream)")
+    parser.add_option("--stream",
+            action="store_true", dest="stream",
+            default=False, help="write the output statement by statement, "
+                "without keeping the whole program in memory")
+    parser.add_option("--minify",
+            action="store_true", dest="minify",
+            default=False, help="leave out whitespace and comments and "
+                "shorten local names, also in the runtime")
+    parser.add_option("-O", "--optimize",
+            action="store_true", dest="optimize",
+            default=False, help="compute constant expressions, replace "
+                "module constants by their values and leave out code that "
+                "can't run and docstrings")
+    parser.add_option("--source-map",
+            action="store_true", dest="source_map",
+            default=False, help="write a source map next to every output "
+                "file (needs -o)")
+    parser.add_option("--inline-source-map",
+            action="store_true", dest="inline_source_map",
+            default=False, help="append the source map to every output "
+                "file as a comment (needs -o)")
+    parser.add_option("--size-report",
+            dest="size_report", metavar="FILE",
+            help="write the sizes of the output per module, class, function "
+                "and runtime component to FILE as JSON, and as a table to "
+                "stderr")
+    parser.add_option("--size-budget",
+            type="int", dest="size_budget", metavar="BYTES",
+            help="fail if the output of a module, as written with its "
+                "runtime and wrapper, is bigger than BYTES")
+    parser.add_option("--format",
+            type="choice", choices=module_formats.keys(), dest="format",
+            default="script", help="the output: scripts that run after "
+                "py-builtins.js (the default), or CommonJS (commonjs) or ES "
+                "(esm) modules that import the runtime module that is written "
+                "to the output directory")
+    parser.add_option("--scoped",
+            action="store_true", dest="scoped",
+            default=False, help="run each file in a function of its own, "
+                "with the builtins it uses in local variables, and only "
+                "make its public names global")
+    parser.add_option("--runtime-url",
+            dest="runtime_url", metavar="URL",
+            default=None, help="with --format, where modules import the "
+                "runtime module from (default: the output directory)")
+    parser.add_option("--bundle",
+            action="store_true", dest="bundle",
+            default=False, help="compile each file with all the modules it "
+                "imports into a single program")
+    parser.add_option("--split",
+            action="store_true", dest="split",
+            default=False, help="with --bundle, write the imported modules "
+                "to content-hashed chunk files next to the program, which "
+                "are loaded when they are first imported (requires -o)")
+    parser.add_option("--chunk",
+            action="append", dest="chunks", metavar="NAME=MODULE,...",
+            default=[], help="with --split, put the given modules and "
+                "packages into one chunk NAME; can be repeated")
+    parser.add_option("--chunk-url",
+            dest="chunk_url", metavar="URL",
+            default="", help="with --split, the URL that the chunk files "
+                "are loaded from (default: relative to the page)")
+    parser.add_option("--no-cache",
+            action="store_false", dest="cache",
+            default=True, help="don't use the compilation cache")
+    parser.add_option("--cache-dir",
+            dest="cache_dir", metavar="DIR",
+            default=None, help="directory of the compilation cache "
+                "(default: $PY2JS_CACHE_DIR or ~/.cache/py2js)")
+    parser.add_option("-o", "--output-dir",
+            dest="output_dir", metavar="DIR",
+            default=None, help="write one .js file per input into DIR")
+    parser.add_option("-j", "--jobs",
+            type="int", dest="jobs", metavar="N",
+            default=None, help="number of worker processes "
+                "(default: the number of CPUs)")
+    parser.add_option("--incremental",
+            action="store_true", dest="incremental",
+            default=False, help="only recompile the files that changed since "
+                "the last build into the output directory and the files "
+                "that import them (requires -o)")
+    parser.add_option("--watch",
+            action="store_true", dest="watch",
+            default=False, help="keep running and recompile files into the "
+                "output directory as they change (requires -o)")
+    parser.add_option("--serve",
+            type="int", dest="serve", metavar="PORT",
+            default=None, help="run a compile server on localhost:PORT "
+                "with -j worker processes (see CompileServer)")
+    parser.add_option("--assets",
+            action="store_true", dest="assets",
+            default=False, help="the arguments are modules or packages: "
+                "precompile their @JavaScript objects into content-hashed "
+                "files in the output directory (requires -o)")
+    parser.add_option("--page",
+            action="append", dest="pages", metavar="NAME=OBJECT,...",
+            default=[], help="with --assets, build a chunk for the page NAME "
+                "holding the given objects (like module.Class) instead of "
+                "one bundle; can be repeated")
+    parser.add_option("--interval",
+            type="float", dest="interval", metavar="SECONDS",
+            default=0.5, help="how often --watch polls for changes "
+                "(default: %default)")
     options, args = parser.parse_args()
-    if len(args) == 1:
-        filename = args[0]
-        s = open(filename).read()
-        builtins = open("py-builtins.js").read()
-        js = convert_py2js(s)
-        if options.include_builtins:
-            print builtins
-        print js
-    else:
+    if options.serve is not None:
+        server = CompileServer(("127.0.0.1", options.serve), options.jobs)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        server.server_close()
+        return
+    if options.assets:
+        if options.output_dir is None:
+            parser.error("--assets requires -o")
+        sys.path.insert(0, os.getcwd())
+        # the decorated objects are instances of the JavaScript class of
+        # the py2js module they import, which isn't this __main__ module:
+        import py2js
+        objects = []
+        for name in args:
+            objects.extend(py2js.collect(name))
+        pages = None
+        if options.pages:
+            pages = {}
+            for page in options.pages:
+                name, names = page.split("=", 1)
+                pages[name] = [ py2js.resolve(obj)
+                        for obj in names.split(",") ]
+        if options.cache:
+            py2js.JavaScript.cache = py2js.Cache(options.cache_dir)
+        py2js.build_assets(options.output_dir, objects, pages)
+        return
+    if not args:
         parser.print_help()
+        return
+    if options.incremental and options.output_dir is None:
+        parser.error("--incremental requires -o")
+    if options.watch and options.output_dir is None:
+        parser.error("--watch requires -o")
+    if options.source_map and options.output_dir is None:
+        parser.error("--source-map requires -o")
+    if options.inline_source_map and options.output_dir is None:
+        parser.error("--inline-source-map requires -o")
+    if options.split and (not options.bundle or options.output_dir is None):
+        parser.error("--split requires --bundle and -o")
+    if options.format != "script" and (options.include_builtins or
+            options.stream or options.bundle):
+        parser.error("--format %s can't be used with --include-builtins, "
+                "--stream or --bundle" % options.format)
+    if options.scoped and (options.format != "script" or options.stream or
+            options.bundle):
+        parser.error("--scoped can't be used with --format, --stream or "
+                "--bundle")
+    if options.bundle and (options.stream or options.source_map or
+            options.inline_source_map or options.size_report or
+            options.size_budget is not None):
+        parser.error("--bundle can't be used with --stream, source maps, "
+                "--size-report or --size-budget")
+    if (options.incremental or options.watch) and (options.size_report or
+            options.size_budget is not None):
+        parser.error("--size-report and --size-budget can't be used with "
+                "--incremental or --watch")
+    if options.cache:
+        cache = Cache(options.cache_dir)
+    else:
+        cache = None
+
+    try:
+        sources = find_sources(args, options.output_dir,
+                module_formats[options.format])
+    except ValueError, e:
+        parser.error(str(e))
+
+    if options.format != "script" and options.output_dir is not None:
+        if not os.path.isdir(options.output_dir):
+            os.makedirs(options.output_dir)
+        f = open(os.path.join(options.output_dir,
+            RUNTIME_MODULE + module_formats[options.format]), "w")
+        try:
+            f.write(runtime_module(options.format, options.minify))
+        finally:
+            f.close()
+
+    jobs = options.jobs or multiprocessing.cpu_count()
+    if not options.watch:
+        jobs = min(jobs, len(sources))
+    if jobs > 1:
+        pool = multiprocessing.Pool(jobs)
+    else:
+        pool = None
+
+    try:
+        if options.watch:
+            try:
+                watch(args, options, cache, pool)
+            except KeyboardInterrupt:
+                if pool is not None:
+                    pool.terminate()
+                    pool = None
+                return
+        elif options.incremental:
+            manifest = Manifest(os.path.join(options.output_dir, MANIFEST),
+                    manifest_options(options))
+            compiled, failed = build(sources, options, cache, manifest, pool)
+            manifest.save()
+        elif options.size_report or options.size_budget is not None:
+            report = size_report()
+            compiled, failed = build(sources, options, cache, pool=pool,
+                    report=report)
+        else:
+            compiled, failed = build(sources, options, cache, pool=pool)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    if not failed and (options.size_report or
+            options.size_budget is not None):
+        if options.size_report:
+            f = open(options.size_report, "w")
+            try:
+                json.dump(report, f, indent=2)
+            finally:
+                f.close()
+            sys.stderr.write(format_size_report(report))
+        if options.size_budget is not None:
+            for module in report["modules"]:
+                if module["raw"] > options.size_budget:
+                    sys.stderr.write("%s: %d bytes, over the budget of %d "
+                        "bytes\n" % (module["name"], module["raw"],
+                            options.size_budget))
+                    failed += 1
+
+    if failed:
+        sys.exit(1)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,22 @@
+
+for i in range(3):
+    print i
+for i in range(5, 0, -2):
+    print i
+n = 4
+s = -1
+for i in xrange(n, 0, s):
+    n = 0
+    i = 100
+    print i
+print i
+for i in range(2):
+    pass
+else:
+    print "else"
+for i in range(5):
+    if i == 2:
+        break
+else:
+    print "not printed"
+print i
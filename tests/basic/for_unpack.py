@@ -0,0 +1,34 @@
+
+pairs = [(1, 2), (3, 4), (5, 6)]
+for a, b in pairs:
+    print a, b
+
+for i, (x, y) in [(0, (7, 8)), (1, (9, 10))]:
+    print i, x, y
+
+for [a, b] in ((11, 12), (13, 14)):
+    print a + b
+
+d = {"k": 1}
+for key in d:
+    print key
+
+for c in "abc":
+    print c
+
+for t in (1, 2, 3):
+    if t == 2:
+        break
+else:
+    print "not printed"
+
+for t in []:
+    pass
+else:
+    print "else"
+
+items = [1, 2]
+for t in items:
+    if t < 4:
+        items.append(t + 2)
+print items
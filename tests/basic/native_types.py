@@ -0,0 +1,38 @@
+
+def count_odd(n):
+    count = 0
+    for i in range(n):
+        if i % 2 == 1:
+            count += 1
+    return count
+
+def mean(values):
+    total = 0.0
+    for v in values:
+        total += v
+    return total / len(values)
+
+x = 3
+y = x * 2 + 1
+f = 2.5
+items = [1, 2, 3, 4]
+flag = x < y
+
+if x:
+    print "x is true"
+if x - 3:
+    print "not printed"
+if x == 3:
+    print "x == 3"
+if y != 7:
+    print "not printed"
+if x == 3.0:
+    print "3 == 3.0"
+if flag == True:
+    print "flag"
+if not flag:
+    print "not printed"
+print count_odd(10)
+print len(items)
+print mean(items)
+print float(x) + f
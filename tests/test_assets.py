@@ -0,0 +1,134 @@
+"""
+Tests collecting the @JavaScript objects of a package and precompiling
+them into a bundle or per-page chunks with content-hashed names.
+"""
+
+import os
+import sys
+import shutil
+import hashlib
+import tempfile
+import subprocess
+
+from py2js import JavaScript, collect, build_assets, load_assets, \
+        script_tags
+
+directory = tempfile.mkdtemp()
+
+def write(filename, source):
+    filename = os.path.join(directory, filename)
+    if not os.path.isdir(os.path.dirname(filename)):
+        os.makedirs(os.path.dirname(filename))
+    f = open(filename, "w")
+    f.write(source)
+    f.close()
+
+def read(output_dir, filename):
+    return open(os.path.join(output_dir, filename)).read()
+
+write("assetpkg/__init__.py", "")
+write("assetpkg/shared.py", """\
+from py2js import JavaScript
+
+@JavaScript
+class Shared(object):
+    def f(self):
+        return 1
+""")
+write("assetpkg/pages/__init__.py", "")
+write("assetpkg/pages/a.py", """\
+from py2js import JavaScript
+from assetpkg.shared import Shared
+
+@JavaScript
+def a():
+    return 2
+""")
+write("assetpkg/pages/b.py", """\
+from py2js import JavaScript
+
+@JavaScript
+def b():
+    return 3
+
+def not_javascript():
+    pass
+
+also_b = b
+""")
+
+sys.path.insert(0, directory)
+
+try:
+    objects = collect("assetpkg")
+    names = sorted([ obj._obj.__name__ for obj in objects ])
+    assert names == ["Shared", "a", "b"]
+    assert [ obj._obj.__name__ for obj in collect("assetpkg.pages.b") ] == \
+            ["b"]
+
+    # translating the objects again doesn't keep more of them around:
+    for i in range(3):
+        str(JavaScript(objects[-1]._obj))
+    assert collect("assetpkg") == objects
+
+    from assetpkg.shared import Shared
+    from assetpkg.pages.a import a
+    from assetpkg.pages.b import b
+
+    out = os.path.join(directory, "out")
+    assets = build_assets(out, objects + [Shared])
+    assert assets == load_assets(out)
+    filename, = assets["bundle"]
+    content = read(out, filename)
+    assert filename == "bundle-%s.js" % hashlib.sha1(content).hexdigest()[:12]
+    assert content.count(str(Shared)) == 1
+    assert str(a) in content and str(b) in content
+    assert script_tags(assets, prefix="/static/") == \
+        '<script type="text/javascript" src="/static/%s"></script>' % filename
+
+    out = os.path.join(directory, "pages")
+    assets = build_assets(out, pages={"a": [Shared, a], "b": [Shared, b],
+        "c": [b._obj]})
+    common, page_a = assets["a"]
+    assert common.startswith("common-") and page_a.startswith("a-")
+    # what several pages use is shared, everything else is per page:
+    assert read(out, common) == str(Shared) + "\n" + str(b) + "\n"
+    assert read(out, page_a) == str(a) + "\n"
+    assert assets["b"] == [common]
+    assert assets["c"] == [common]
+    assert sorted(os.listdir(out)) == sorted([common, page_a, "py2js-assets.json"])
+
+    # a shared class comes after its base, even if only one page has it:
+    write("assetpkg/shapes.py", """\
+class Base(object):
+    def area(self):
+        return 0
+
+class Square(Base):
+    def area(self):
+        return 1
+
+class Circle(Base):
+    def area(self):
+        return 2
+""")
+    from assetpkg.shapes import Base, Square, Circle
+    out = os.path.join(directory, "shapes")
+    assets = build_assets(out, pages={"a": [Square, Base], "b": [Square],
+        "c": [Circle, Base]})
+    common, = assets["a"]
+    assert assets["b"] == [common] and assets["c"][0] == common
+    assert read(out, common) == str(JavaScript(Base)) + "\n" + \
+            str(JavaScript(Square)) + "\n"
+    assert read(out, assets["c"][1]) == str(JavaScript(Circle)) + "\n"
+
+    # the command line:
+    py2js = os.path.abspath("py2js.py")
+    r = subprocess.call([sys.executable, py2js, "--no-cache", "--assets",
+        "-o", "cli", "assetpkg", "--page", "a=assetpkg.pages.a.a",
+        "--page", "b=assetpkg.pages.b.b,assetpkg.pages.a.a"], cwd=directory)
+    assert r == 0
+    assets = load_assets(os.path.join(directory, "cli"))
+    assert len(assets["a"]) == 1 and assets["a"] == assets["b"][:1]
+finally:
+    shutil.rmtree(directory)
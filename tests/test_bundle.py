@@ -0,0 +1,73 @@
+"""
+Tests resolving the imports of a program at compile time and bundling
+the modules it uses.
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import subprocess
+
+from py2js import Bundle, JSError, MANIFEST, convert_py2js
+
+modules = os.path.join(os.path.dirname(os.path.abspath(__file__)), "modules")
+
+# every module once, after the modules it imports:
+b = Bundle(os.path.join(modules, "import_diamond.py"))
+assert b.modules.keys() == ["modules", "modules.submodules",
+        "modules.submodules.diamondbase", "modules.diamond1",
+        "modules.diamond2", "__main__"], b.modules.keys()
+assert b.modules["modules.diamond1"] == \
+        os.path.join(modules, "modules", "diamond1.py")
+
+# Python 2 looks in the current package first:
+assert b.find("submodules.diamondbase", "modules.diamond1") == \
+        "modules.submodules.diamondbase"
+assert b.find("modules.diamond1", "modules.diamond2") == "modules.diamond1"
+assert b.find("missing", "__main__") is None
+
+b = Bundle(os.path.join(modules, "from_import.py"))
+assert "imported.modulec" in b.modules
+assert b.modules.keys()[-1] == "__main__"
+assert b.public_names("imported.moduleb") == ["foo", "moduleb_class",
+        "moduleb_fn"]
+
+js = b.js()
+assert "var modb_fn = $mod$imported$moduleb.moduleb_fn;" in js
+assert "var foo = $mod$imported$modulec.foo;" in js
+assert js.count("var $mod$imported$modulec = {};") == 1
+# nothing is looked up at runtime:
+assert "__import__" not in js
+
+try:
+    convert_py2js("import os\n")
+except JSError:
+    pass
+else:
+    raise AssertionError("import outside of a bundle")
+
+# the command line builds bundles like other output, with --incremental
+# and in several processes, and rejects what doesn't apply to them:
+directory = tempfile.mkdtemp()
+try:
+    for name, source in [("main.py", "import lib\nprint lib.x\n"),
+            ("other.py", "import lib\nprint lib.x + 1\n"),
+            ("lib.py", "x = 1\n")]:
+        f = open(os.path.join(directory, name), "w")
+        f.write(source)
+        f.close()
+    out = os.path.join(directory, "out")
+    programs = [ os.path.join(directory, name)
+        for name in ["main.py", "other.py"] ]
+    subprocess.check_call([sys.executable, "py2js.py", "--no-cache",
+        "--bundle", "--incremental", "-j", "2", "-o", out] + programs)
+    assert sorted(os.listdir(out)) == [MANIFEST, "main.js", "other.js"]
+    assert "$mod$lib" in open(os.path.join(out, "other.js")).read()
+
+    for option in ["--stream", "--source-map", "--size-budget=1"]:
+        r = subprocess.call([sys.executable, "py2js.py", "--bundle", option,
+            "-o", out] + programs, stderr=open(os.devnull, "w"))
+        assert r == 2, option
+finally:
+    shutil.rmtree(directory)
@@ -0,0 +1,64 @@
+"""
+Tests the on-disk compilation cache: hits and misses, keys and eviction of
+the least recently used entries, and how often the directory is scanned.
+"""
+
+import os
+import shutil
+import tempfile
+
+import py2js
+from py2js import Cache, convert_py2js
+
+directory = tempfile.mkdtemp()
+
+try:
+    cache = Cache(directory)
+
+    source = "x = [1, 2]\nprint x[0]\n"
+    key = cache.key(source)
+    assert cache.get(key) is None
+
+    js = convert_py2js(source, cache)
+    assert js == convert_py2js(source)
+    assert cache.get(key) == js
+    assert os.listdir(directory) == [key + ".js"]
+
+    # a hit returns the stored code without compiling:
+    cache.put(key, "cached")
+    assert convert_py2js(source, cache) == "cached"
+
+    # options and the source are part of the key:
+    assert cache.key(source, stream=True) != key
+    assert cache.key(source + "\n") != key
+
+    # entries over the size limit are evicted, least recently used first:
+    cache = Cache(directory, max_size=10)
+    os.utime(cache.filename(key), (0, 0))
+    cache.put(cache.key("a"), "aaaaa")
+    cache.put(cache.key("b"), "bbbbb")
+    assert cache.get(key) is None
+    assert cache.get(cache.key("a")) == "aaaaa"
+    assert cache.get(cache.key("b")) == "bbbbb"
+    assert not [ name for name in os.listdir(directory)
+            if name.endswith(".tmp") ]
+
+    # the directory is looked at only now and then, not on every write:
+    listdir = py2js.os.listdir
+    calls = []
+    def counting_listdir(path):
+        calls.append(path)
+        return listdir(path)
+    py2js.os.listdir = counting_listdir
+    try:
+        cache = Cache(directory, max_size=1000)
+        for i in range(250):
+            cache.put(cache.key(str(i)), "%04d" % i)
+    finally:
+        py2js.os.listdir = listdir
+    assert len(calls) <= 10, len(calls)
+    assert sum([ os.path.getsize(os.path.join(directory, name))
+            for name in os.listdir(directory) ]) <= 1000
+    assert cache.get(cache.key("249")) == "0249"
+finally:
+    shutil.rmtree(directory)
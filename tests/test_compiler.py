@@ -0,0 +1,70 @@
+"""
+Tests the in-process Compiler: the kinds of input it accepts, the reuse of
+JS instances and the memoization of results.
+"""
+
+import ast
+import threading
+
+from py2js import Compiler, JSError, convert_py2js
+
+compiler = Compiler(cache_size=3)
+
+module = "x = [1, 2]\nprint x[1:]\n"
+js = compiler.compile(module)
+assert js == convert_py2js(module)
+assert compiler.compile(ast.parse(module)) == js
+
+statement = "for i in x:\n    print i\n"
+js = compiler.compile(statement, "single")
+assert js == convert_py2js(statement)
+assert compiler.compile(ast.parse(statement, mode="single")) == js
+
+assert compiler.compile("x[3:]", "eval") == "x.__getitem__(slice(3, null))"
+assert compiler.compile(ast.parse("a + 1", mode="eval")) == "(a)+(1)"
+
+try:
+    compiler.compile(ast.parse("a").body[0])
+except TypeError:
+    pass
+else:
+    raise AssertionError("statements aren't accepted")
+
+# the instances don't keep any state between translations:
+try:
+    compiler.compile("del x")
+except JSError:
+    pass
+assert compiler.compile("class A(object):\n    pass\n", "single") == \
+        convert_py2js("class A(object):\n    pass\n")
+assert len(compiler.instances) == 1
+
+# memoization:
+compiler = Compiler(cache_size=2)
+compiler.compile("a")
+compiler.compile("a")
+compiler.compile("a", "eval")
+assert (compiler.hits, compiler.misses) == (1, 2)
+compiler.compile("b")
+compiler.compile("a")
+assert (compiler.hits, compiler.misses) == (1, 4)
+assert len(compiler.results) == 2
+
+# only an explicit Compiler memoizes, convert_py2js() keeps nothing:
+import py2js
+assert not [ value for value in vars(py2js).values()
+    if isinstance(value, Compiler) ]
+
+# several threads share one compiler:
+results = {}
+def compile(i):
+    for j in range(20):
+        results[i, j] = compiler.compile("y = %d\nz = y + %d" % (i, j))
+threads = [ threading.Thread(target=compile, args=(i,)) for i in range(8) ]
+for t in threads:
+    t.start()
+for t in threads:
+    t.join()
+for (i, j), js in results.items():
+    assert js == "var y = %d;\nvar z = (y)+(%d);" % (i, j)
+assert len(compiler.instances) <= 8
@@ -0,0 +1,17 @@
+"""
+Tests that py2js can compile expressions nested deeper than the Python
+recursion limit.
+"""
+
+import sys
+from py2js import convert_py2js
+
+depth = sys.getrecursionlimit() * 10
+
+source = "x = 1\ny = " + " + ".join(["x"] * depth) + "\n"
+js = convert_py2js(source)
+assert js.count("x") == depth + 1
+
+source = "z = " + " or ".join(["a.b[%d]" % i for i in range(depth)]) + "\n"
+js = convert_py2js(source)
+assert js.count("a.b.__getitem__(") == depth
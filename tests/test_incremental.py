@@ -0,0 +1,147 @@
+"""
+Tests that an incremental build recompiles exactly the modules that
+changed and the modules that import them, directly or indirectly.
+"""
+
+import os
+import sys
+import ast
+import time
+import shutil
+import tempfile
+import subprocess
+
+import py2js
+from py2js import find_imports, module_record, Manifest
+
+directory = tempfile.mkdtemp()
+src = os.path.join(directory, "src")
+out = os.path.join(directory, "out")
+
+def path(filename):
+    return os.path.join(src, filename)
+
+def write(filename, source):
+    if not os.path.isdir(os.path.dirname(path(filename))):
+        os.makedirs(os.path.dirname(path(filename)))
+    f = open(path(filename), "w")
+    f.write(source)
+    f.close()
+
+def imports(filename):
+    return find_imports(ast.parse(open(path(filename)).read()),
+            path(filename))
+
+try:
+    write("a.py", "import pkg.b\nx = 1\n")
+    write("pkg/__init__.py", "")
+    write("pkg/b.py", "from .c import y\n")
+    write("pkg/c.py", "y = 2\n")
+    write("d.py", "def f():\n    from pkg import c, missing\n")
+    write("e.py", "import os\nz = 3\n")
+    modules = ["a.py", "pkg/__init__.py", "pkg/b.py", "pkg/c.py", "d.py",
+            "e.py"]
+
+    assert imports("a.py") == [path("pkg/__init__.py"), path("pkg/b.py")]
+    assert imports("pkg/b.py") == [path("pkg/c.py")]
+    assert imports("d.py") == [path("pkg/__init__.py"), path("pkg/c.py")]
+    assert imports("e.py") == []
+
+    manifest_file = os.path.join(directory, "manifest.json")
+
+    def build(options="options"):
+        """Returns the names of the modules that needed a rebuild. """
+        manifest = Manifest(manifest_file, options)
+        dirty = manifest.dirty([ path(module) for module in modules ])
+        for filename in dirty:
+            manifest.update(filename, manifest_file, module_record(filename))
+        manifest.save()
+        return sorted([ os.path.relpath(filename, src)
+            for filename in dirty ])
+
+    assert build() == sorted(modules)
+    assert build() == []
+
+    write("pkg/c.py", "y = 22\n")
+    assert build() == ["a.py", "d.py", "pkg/b.py", "pkg/c.py"]
+
+    write("pkg/b.py", "from .c import y\n\n")
+    assert build() == ["a.py", "pkg/b.py"]
+
+    write("pkg/__init__.py", "\n")
+    assert build() == ["a.py", "d.py", "pkg/__init__.py"]
+
+    # touching a file without changing it doesn't rebuild anything:
+    os.utime(path("e.py"), (time.time() + 10,) * 2)
+    assert build() == []
+
+    # different options rebuild everything:
+    assert build("other") == sorted(modules)
+    assert build("other") == []
+
+    # and so does another runtime, which goes into the output:
+    runtime = os.path.join(directory, "py-builtins.js")
+    shutil.copy(py2js.BUILTINS, runtime)
+    f = open(runtime, "a")
+    f.write("\nvar changed = true;\n")
+    f.close()
+    builtins = py2js.BUILTINS
+    py2js.BUILTINS = runtime
+    py2js._compiler_version = None
+    try:
+        assert build("other") == sorted(modules)
+    finally:
+        py2js.BUILTINS = builtins
+        py2js._compiler_version = None
+
+    # the command line, with modules py2js can translate:
+    shutil.rmtree(src)
+    write("x.py", "x = 1\n")
+    write("sub/y.py", "y = 2\n")
+
+    def compile():
+        for filename in ["x.js", "sub/y.js"]:
+            filename = os.path.join(out, filename)
+            if os.path.exists(filename):
+                f = open(filename, "w")
+                f.write("old")
+                f.close()
+        r = subprocess.call([sys.executable, "py2js.py", "--no-cache",
+            "--incremental", "-o", out, src])
+        assert r == 0
+        return sorted([ filename for filename in ["x.js", "sub/y.js"]
+            if os.path.exists(os.path.join(out, filename)) and
+            open(os.path.join(out, filename)).read() != "old" ])
+
+    assert compile() == ["sub/y.js", "x.js"]
+    assert compile() == []
+    write("x.py", "x = 11\n")
+    assert compile() == ["x.js"]
+    os.remove(path("x.py"))
+    assert compile() == []
+    assert not os.path.exists(os.path.join(out, "x.js"))
+
+    # a bundle is rebuilt when a module it imports changes:
+    shutil.rmtree(src)
+    shutil.rmtree(out)
+    write("main.py", "import lib\nprint lib.x\n")
+    write("lib.py", "x = 1\n")
+
+    def compile_bundle():
+        """Returns whether main.js was written. """
+        main = os.path.join(out, "main.js")
+        if os.path.exists(main):
+            os.utime(main, (0, 0))
+        r = subprocess.call([sys.executable, "py2js.py", "--no-cache",
+            "--bundle", "--incremental", "-o", out, path("main.py")])
+        assert r == 0
+        return os.stat(main).st_mtime != 0
+
+    assert compile_bundle()
+    assert not compile_bundle()
+    write("lib.py", "x = 2\n")
+    assert compile_bundle()
+    assert "x = 2" in open(os.path.join(out, "main.js")).read()
+    assert not compile_bundle()
+finally:
+    shutil.rmtree(directory)
@@ -0,0 +1,70 @@
+"""
+Tests that the JavaScript decorator translates lazily and reuses its
+translations, in memory and through the on-disk cache.
+"""
+
+import shutil
+import tempfile
+
+import py2js
+from py2js import JavaScript, Cache
+
+calls = []
+convert_py2js = py2js.convert_py2js
+
+def counting_convert_py2js(s, cache=None):
+    calls.append(s)
+    return convert_py2js(s, cache)
+
+py2js.convert_py2js = counting_convert_py2js
+
+@JavaScript
+class A(object):
+    def f(self):
+        return 1
+
+@JavaScript
+def g(x):
+    return x + 1
+
+def h(y):
+    return y
+
+# nothing is translated at import time:
+assert calls == []
+
+js = str(A)
+assert js == convert_py2js("class A(object):\n    def f(self):\n"
+        "        return 1\n")
+assert str(A) is js
+assert str(JavaScript(A._obj)) is js
+assert len(calls) == 1
+
+assert str(g) == convert_py2js("@JavaScript\ndef g(x):\n    return x + 1\n")
+assert g(1) == 2
+assert len(calls) == 2
+
+findsource_before = py2js.inspect.findsource
+directory = tempfile.mkdtemp()
+try:
+    JavaScript.cache = Cache(directory)
+    JavaScript._translations.clear()
+    js = str(JavaScript(h))
+    assert len(calls) == 3
+
+    JavaScript._translations.clear()
+    a = str(JavaScript(A._obj))
+    assert len(calls) == 4
+
+    # a new process would find them on disk, without reading the source:
+    def findsource(obj):
+        raise AssertionError("source extracted on a hit")
+    py2js.inspect.findsource = findsource
+    JavaScript._translations.clear()
+    assert str(JavaScript(h)) == js
+    assert str(JavaScript(A._obj)) == a
+    assert len(calls) == 4
+finally:
+    py2js.inspect.findsource = findsource_before
+    JavaScript.cache = None
+    shutil.rmtree(directory)
@@ -0,0 +1,65 @@
+"""
+Tests the minified output: no whitespace or comments that aren't needed,
+short names for temporaries and locals, but the same properties and
+globals.
+"""
+
+from py2js import minify_js, convert_py2js, runtime
+
+assert minify_js("var a = b / c; // comment\n/* pass */\n") == "var a=b/c;"
+assert minify_js("x = a + +b - -c;") == "x=a+ +b- -c;"
+assert minify_js("return typeof x") == "return typeof x"
+assert minify_js("s = 'a  /* b */  c'") == "s='a  /* b */  c'"
+
+# newlines that may end a statement stay:
+assert minify_js("a = b\nc = d\n") == "a=b\nc=d"
+assert minify_js("a = b\n(c)\n") == "a=b(c)"
+assert minify_js("return\nx\n") == "return\nx"
+assert minify_js("if (a) {\n}\nelse {\n}\n") == "if(a){}else{}"
+assert minify_js("if (a) b = c\nelse d()\n") == "if(a)b=c\nelse d()"
+assert minify_js("a\n++b\n") == "a\n++b"
+
+# licenses stay:
+assert minify_js("/* Copyright X */\nvar a;") == "/* Copyright X */\nvar a;"
+
+source = """\
+def total(values, start=0):
+    result = start
+    for value in values:
+        result += value
+    return result
+
+class Box(object):
+    def __init__(self, content):
+        self.content = content
+        first, second = 1, 2
+
+    def get(self):
+        return self.content
+"""
+
+js = convert_py2js(source, minify=True)
+assert "__dummy" not in js and "/*" not in js
+assert "    " not in js
+# keyword arguments of $def functions use the names of the arguments:
+assert "function(values,start)" in js
+# locals and the arguments of methods are short, properties aren't:
+assert "result" not in js and "value" not in js.replace("values", "")
+assert "this.content=a$;" in js
+assert "var Box=$class('Box',[object],{" in js
+assert "get:function(){return this.content;}});" in js
+assert convert_py2js(source) != js
+
+# globals keep their names, locals don't shadow them:
+js = convert_py2js("""\
+counter = 0
+def bump(amount):
+    global counter
+    counter += amount
+    return counter
+""", minify=True)
+assert "counter+=amount" in js and "return counter;" in js
+
+js = convert_py2js("x = [1, 2]\nprint x[0]\n", minify=True)
+assert len(runtime(js, minify=True)) < len(runtime(js)) * 4 / 5
+assert len(runtime(minify=True)) < len(runtime()) * 4 / 5
@@ -0,0 +1,75 @@
+"""
+Tests the CommonJS and ES module output: modules import what they use
+from one runtime module and export their public names.
+"""
+
+import os
+import ast
+import shutil
+import tempfile
+import subprocess
+from distutils.spawn import find_executable
+
+from py2js import module_wrapper, runtime_module, convert_py2js
+
+source = """\
+_count = 0
+def greet(name):
+    global _count
+    _count += 1
+    return "hello " + name
+
+a, b = 1, 2
+print greet("x"), len([a, b])
+"""
+
+js = convert_py2js(source)
+tree = ast.parse(source)
+header, footer = module_wrapper(js, tree, "commonjs", "./rt.js")
+assert header.startswith("var $runtime = require('./rt.js');\n")
+assert "$def = $runtime.$def" in header and "py_builtins = $runtime" in header
+assert "var _count, a, b, greet;\n" in header
+assert footer == "exports.a = a;\nexports.b = b;\nexports.greet = greet;\n"
+
+header, footer = module_wrapper(js, tree, "esm", "./rt.mjs")
+assert header.startswith("import { $def, list, py_builtins, str, tuple } "
+        "from './rt.mjs';\n")
+assert footer == "export { a, b, greet };\n"
+
+# functions can't be declared again:
+header, footer = module_wrapper("function greet() {}\n", tree, "esm", "./rt")
+assert "var _count, a, b;\n" in header
+
+assert "\nexports.py_builtins = py_builtins;\n" in runtime_module("commonjs")
+assert runtime_module("esm").startswith("var $runtime = (function() {\n")
+
+directory = tempfile.mkdtemp()
+try:
+    os.makedirs(os.path.join(directory, "src", "pkg"))
+    for name, code in [("main.py", source), ("pkg/other.py", "x = [1]\n")]:
+        f = open(os.path.join(directory, "src", name), "w")
+        f.write(code)
+        f.close()
+
+    node = find_executable("node")
+    for format, extension in [("commonjs", ".js"), ("esm", ".mjs")]:
+        out = os.path.join(directory, format)
+        subprocess.check_call(["python", "py2js.py", "--format", format,
+            "-o", out, os.path.join(directory, "src")])
+        assert sorted(os.listdir(out)) == ["main" + extension, "pkg",
+            "py-builtins" + extension]
+        other = open(os.path.join(out, "pkg", "other" + extension)).read()
+        assert "'../py-builtins%s'" % extension in other, other
+        if node is None:
+            continue
+        if format == "commonjs":
+            script = "var m = require('./main.js'); console.log(m.a + m.b);"
+            command = [node, "-e", script]
+        else:
+            script = "import { a, b } from './main.mjs'; console.log(a + b);"
+            command = [node, "--input-type=module", "-e", script]
+        output = subprocess.Popen(command, cwd=out,
+            stdout=subprocess.PIPE).communicate()[0]
+        assert output == "hello x\n3\n", output
+finally:
+    shutil.rmtree(directory)
@@ -0,0 +1,73 @@
+"""
+Tests compiling several files and directories at once, in parallel, into
+an output directory and into a bundle on the standard output, and files
+that would overwrite each other's output.
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import subprocess
+
+from py2js import convert_py2js
+
+directory = tempfile.mkdtemp()
+
+def write(filename, source):
+    filename = os.path.join(directory, filename)
+    if not os.path.isdir(os.path.dirname(filename)):
+        os.makedirs(os.path.dirname(filename))
+    f = open(filename, "w")
+    f.write(source)
+    f.close()
+    return filename
+
+def read(filename):
+    return open(os.path.join(directory, filename)).read()
+
+def py2js(*args):
+    process = subprocess.Popen([sys.executable, "py2js.py", "--no-cache"] +
+            list(args), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    out, err = process.communicate()
+    return process.returncode, out
+
+try:
+    a = write("a.py", "x = 1\n")
+    b = write("src/b.py", "print [1, 2]\n")
+    c = write("src/pkg/c.py", "def f(y):\n    return y + 1\n")
+    bad = write("bad.py", "del x\n")
+
+    r, out = py2js("-j", "2", "-o", os.path.join(directory, "out"), a,
+            os.path.join(directory, "src"))
+    assert r == 0
+    assert out == ""
+    assert read("out/a.js") == convert_py2js("x = 1\n") + "\n"
+    assert read("out/b.js") == convert_py2js("print [1, 2]\n") + "\n"
+    assert read("out/pkg/c.js") == \
+            convert_py2js("def f(y):\n    return y + 1\n") + "\n"
+
+    # the bundle keeps the order of the inputs:
+    for options in [["-j", "2"], ["-j", "1"], ["--stream"]]:
+        r, out = py2js(*(options + [c, a]))
+        assert r == 0
+        assert out == read("out/pkg/c.js") + read("out/a.js")
+
+    # a failure doesn't stop the other files, but fails the build:
+    r, out = py2js("-j", "2", "-o", os.path.join(directory, "out2"), bad, a)
+    assert r == 1
+    assert read("out2/a.js") == read("out/a.js")
+    assert not os.path.exists(os.path.join(directory, "out2", "bad.js"))
+
+    # files that would be written to the same output file fail the build
+    # before anything is written, the same file twice is compiled once:
+    other_a = write("other/a.py", "x = 2\n")
+    for args in [[a, other_a], [directory, os.path.join(directory, "other")]]:
+        r, out = py2js(*(["-o", os.path.join(directory, "out3")] + args))
+        assert r == 2
+        assert not os.path.exists(os.path.join(directory, "out3"))
+    r, out = py2js("-o", os.path.join(directory, "out3"), a, a)
+    assert r == 0
+    assert read("out3/a.js") == read("out/a.js")
+finally:
+    shutil.rmtree(directory)
@@ -0,0 +1,132 @@
+"""
+Tests the optimizer: constant expressions are computed where Python and
+JavaScript agree, module constants are propagated and code that can't
+run is left out.
+"""
+
+import os
+import ast
+import shutil
+import tempfile
+import subprocess
+
+from py2js import Optimizer, optimize_module, convert_py2js
+
+def optimized(source):
+    return convert_py2js(source, optimize=True)
+
+js = optimized("print 3 * 4 + 1, 7 // 2, 6 / 2, 1 << 3, 2 ** 10, -(2 + 3)\n")
+assert js == "py_builtins.print(13, 3, 3, 8, 1024, -5);", js
+js = optimized("print 'ab' * 2, 'a' + 'b', 1 < 2 < 3, not 0, 0 or 5\n")
+assert js == "py_builtins.print(str('abab'), str('ab'), true, true, 5);", js
+
+# left as they are, since JavaScript computes something else:
+for expression in ["7 / 2", "-7 % 3", "1 << 40", "2 ** 100", "0.1 + 0.2",
+        "1 / 0", "'\\xe9' < 'a'"]:
+    source = "print %s\n" % expression
+    assert optimized(source) == convert_py2js(source), expression
+
+js = optimized('''\
+"""The module."""
+DEBUG = False
+SIZE = 4 * 1024
+def f(x):
+    "The function."
+    if DEBUG:
+        print "debug"
+    else:
+        return x * SIZE
+    print "unreachable"
+while 0:
+    print "never"
+n = 1
+n = 2
+print n, SIZE
+''')
+assert js == """\
+var DEBUG = false;
+var SIZE = 4096;
+var f = $def({}, function(x) {
+    return (x)*(4096);
+});
+var n = 1;
+n = 2;
+py_builtins.print(n, 4096);""", js
+
+# names bound more than once, or anywhere else, stay:
+tree = optimize_module(ast.parse('''\
+print A
+A = 1
+B = 2
+C = 3
+def g():
+    global B
+    B = 4
+def h(C):
+    return A, B, C
+'''))
+assert ast.dump(tree.body[0]).count("Name(id='A'") == 1
+assert [ ast.dump(node) for node in tree.body[5].body[0].value.elts ] == [
+    "Num(n=1)", "Name(id='B', ctx=Load())", "Name(id='C', ctx=Load())"]
+
+# bodies that become empty get a pass, 'global' outlives dead code:
+tree = optimize_module(ast.parse('''\
+class C:
+    "Only a docstring."
+def k():
+    return 1
+    global x
+    x = 2
+'''))
+assert isinstance(tree.body[0].body[0], ast.Pass)
+assert [ node.__class__ for node in tree.body[1].body ] == [ast.Return,
+    ast.Global]
+
+# a star import may bind any name:
+tree = optimize_module(ast.parse("A = 1\nfrom m import *\nprint A\n"))
+assert isinstance(tree.body[2].values[0], ast.Name)
+
+# the else of an endless loop can't run:
+tree = optimize_module(ast.parse('''\
+while 1:
+    break
+else:
+    global y
+    print "never"
+'''))
+assert [ node.__class__ for node in tree.body[0].orelse ] == [ast.Global]
+
+optimizer = Optimizer()
+optimizer.scan(ast.parse("True = 0\nprint not True\n"))
+assert optimizer.value(ast.Name(id="True", ctx=ast.Load())) is \
+        optimizer.unknown
+
+directory = tempfile.mkdtemp()
+try:
+    filename = os.path.join(directory, "a.py")
+    f = open(filename, "w")
+    f.write('''\
+LIMIT = 3
+def count(values):
+    """Counts the values below LIMIT."""
+    n = 0
+    for v in values:
+        if v < LIMIT:
+            n += 1
+    return n
+if LIMIT > 2:
+    print count([1, 2, 3, 4]), 24 * 60 * 60
+else:
+    import missing
+''')
+    f.close()
+
+    for options in [[], ["--stream"]]:
+        out = os.path.join(directory, "out")
+        subprocess.check_call(["python", "py2js.py", "-O",
+            "--include-builtins", "-o", out, filename] + options)
+        output = subprocess.Popen(["js", "-f", os.path.join(out, "a.js")],
+            stdout=subprocess.PIPE).communicate()[0]
+        assert output == "2 86400\n", output
+finally:
+    shutil.rmtree(directory)
@@ -0,0 +1,103 @@
+"""
+Tests splitting the runtime into its top-level statements and selecting
+only the ones a program needs.
+"""
+
+import os
+import tempfile
+
+from py2js import js_tokens, js_references, Runtime, runtime, convert_py2js
+
+def tokens(code):
+    return [ token for token in js_tokens(code)
+            if token[0] not in ('space', 'newline') ]
+
+assert tokens("a = b / c / d;") == [('name', 'a'), ('punct', '='),
+        ('name', 'b'), ('punct', '/'), ('name', 'c'), ('punct', '/'),
+        ('name', 'd'), ('punct', ';')]
+assert tokens("x = /a\\/[/]b/g.test(s)")[2] == ('regex', '/a\\/[/]b/g')
+assert tokens("return /x/;")[1] == ('regex', '/x/')
+assert tokens("s = 'it\\'s // not a comment' // but this is")[2:] == [
+        ('string', "'it\\'s // not a comment'"),
+        ('comment', "// but this is")]
+
+assert js_references(js_tokens(
+    "f(a.b, py_builtins.c, 'd'); /* e */ var g = h")) == \
+        set(['f', 'a', 'py_builtins', 'py_builtins.c', 'var', 'g', 'h'])
+
+code = """\
+/* header */
+var py_builtins = {};
+
+function a() {
+    return b();
+}
+
+function b() {
+    return 1
+}
+b.prototype.x = function() {
+    return 2;
+}
+py_builtins.c = function() {
+    return d;
+};
+
+/**
+Copyright 2010 Somebody
+**/
+
+var d = 3;
+if (!Array.slice)
+{
+    Array.slice = function() {};
+}
+// @provides e
+// @requires a
+make('e');
+// @optional d
+var f = typeof(d) != 'undefined' ? d : 0;
+"""
+
+fd, filename = tempfile.mkstemp(suffix=".js")
+os.write(fd, code)
+os.close(fd)
+
+try:
+    r = Runtime(filename)
+finally:
+    os.remove(filename)
+
+provides = [ sorted(provides) for code, license, provides, requires in
+        r.statements ]
+assert provides == [['py_builtins'], ['a'], ['b'], ['b'],
+        ['py_builtins.c'], ['d'], [], ['e'], ['f']], provides
+assert r.statements[3][0] == "b.prototype.x = function() {\n" \
+        "    return 2;\n}"
+
+def selected(names):
+    return [ sorted(r.statements[i][2]) for i in r.select(names) ]
+
+# the polyfill is always there:
+assert selected([]) == [[]]
+assert selected(['a']) == [['a'], ['b'], ['b'], []]
+assert selected(['py_builtins.c']) == [['py_builtins'], ['py_builtins.c'],
+        ['d'], []]
+assert selected(['e']) == [['a'], ['b'], ['b'], [], ['e']]
+assert selected(['f']) == [[], ['f']]
+
+assert r.code("x = d;") == "/**\nCopyright 2010 Somebody\n**/\n" \
+        "var d = 3;\n" + r.statements[6][0] + "\n"
+
+# the real runtime:
+js = convert_py2js("x = [1, 2]\nprint x[0]\n")
+minimal = runtime(js)
+assert "function _list(" in minimal
+assert "function str(" in minimal
+assert "sprintf" not in minimal
+assert "module(" not in minimal
+assert len(minimal) < len(runtime()) / 3
+
+# classes are defined by $class():
+js = convert_py2js("class A(object):\n    def f(self):\n        pass\n")
+assert "function $class(" in runtime(js)
@@ -0,0 +1,76 @@
+"""
+Tests running modules in a function scope: builtins in local variables
+and only the public names on the global object, which stay live when
+they are declared 'global'.
+"""
+
+import os
+import ast
+import shutil
+import tempfile
+import subprocess
+
+from py2js import scope_module, convert_py2js
+
+source = """\
+_seen = []
+def biggest(values):
+    if not values:
+        raise KeyError("empty")
+    _seen.append(values)
+    return max(values)
+
+print biggest([1, 3, 2]), sum([1, 2])
+"""
+
+js = convert_py2js(source)
+header, body, footer = scope_module(js, ast.parse(source))
+assert header == "(function($exports) {\nvar py_builtins$KeyError = " \
+        "py_builtins.KeyError, py_builtins$max = py_builtins.max, " \
+        "py_builtins$print = py_builtins.print, " \
+        "py_builtins$sum = py_builtins.sum;\n", header
+assert footer == "$exports.biggest = biggest;\n})(this);\n", footer
+assert "py_builtins." not in body
+# the columns stay, for the source maps:
+assert [ len(line) for line in body.split("\n") ] == \
+        [ len(line) for line in js.split("\n") ]
+
+# properties named py_builtins stay:
+assert scope_module("a.py_builtins.max;", ast.parse(""))[1] == \
+        "a.py_builtins.max;"
+
+directory = tempfile.mkdtemp()
+try:
+    filename = os.path.join(directory, "a.py")
+    f = open(filename, "w")
+    f.write(source)
+    f.close()
+    f = open(os.path.join(directory, "after.js"), "w")
+    f.write("print(typeof _seen, typeof biggest);\n")
+    f.close()
+
+    out = os.path.join(directory, "out")
+    subprocess.check_call(["python", "py2js.py", "--scoped",
+        "--include-builtins", "--minify", "-o", out, filename])
+    output = subprocess.Popen(["js", "-f", os.path.join(out, "a.js"),
+        "-f", os.path.join(directory, "after.js")],
+        stdout=subprocess.PIPE).communicate()[0]
+    assert output == "3 3\nundefined function\n", output
+
+    # names that functions rebind stay live in the other files:
+    f = open(os.path.join(directory, "counter.py"), "w")
+    f.write("count = 0\ndef bump():\n    global count\n    count += 1\n")
+    f.close()
+    f = open(os.path.join(directory, "user.py"), "w")
+    f.write("bump()\nbump()\nprint count\n")
+    f.close()
+    for options in [[], ["--scoped"], ["--scoped", "--minify"]]:
+        subprocess.check_call(["python", "py2js.py", "--include-builtins",
+            "-o", out, os.path.join(directory, "counter.py"),
+            os.path.join(directory, "user.py")] + options)
+        output = subprocess.Popen(["js", "-f", os.path.join(out, "counter.js"),
+            "-f", os.path.join(out, "user.js")],
+            stdout=subprocess.PIPE).communicate()[0]
+        assert output == "2\n", (options, output)
+finally:
+    shutil.rmtree(directory)
@@ -0,0 +1,99 @@
+"""
+Tests the compile server on localhost: single and batched requests,
+errors, the result cache and timeouts of the worker processes, also the
+ones that the clients ask for.
+"""
+
+import json
+import time
+import urllib2
+import threading
+
+from py2js import CompileServer, CompileTimeout, Worker, convert_py2js
+
+def request(path, data=None, status=200):
+    if data is not None:
+        data = json.dumps(data)
+    try:
+        response = urllib2.urlopen(url + path, data)
+    except urllib2.HTTPError, e:
+        response = e
+    assert response.getcode() == status, response.getcode()
+    return json.loads(response.read())
+
+server = CompileServer(("127.0.0.1", 0), workers=2)
+url = "http://127.0.0.1:%d" % server.server_address[1]
+thread = threading.Thread(target=server.serve_forever)
+thread.daemon = True
+thread.start()
+
+try:
+    sources = [ "x = %d\nprint x + 1\n" % i for i in range(10) ]
+    expected = [ {"js": convert_py2js(source)} for source in sources ]
+
+    assert request("/compile", {"source": sources[0]}) == expected[0]
+    assert request("/compile", {"sources": sources}) == \
+            {"results": expected}
+    assert request("/compile", {"sources": sources[:3]}) == \
+            {"results": expected[:3]}
+
+    stats = request("/stats")
+    assert stats["hits"] == 4 and stats["misses"] == 10
+    assert stats["entries"] == 10 and stats["workers"] == 2
+
+    result = request("/compile", {"source": "del x"})
+    assert result == {"error": "JSError: 'del' is not supported"}
+    result = request("/compile", {"source": "x = ("})
+    assert result["error"].startswith("SyntaxError")
+
+    request("/compile", {"sources": [1]}, status=400)
+    request("/compile", {}, status=400)
+    for timeout in ["1", 0, -1, True, [], 1e400]:
+        request("/compile", {"source": "x = 1", "timeout": timeout},
+                status=400)
+    assert request("/compile", {"source": "z = 1", "timeout": 5}) == \
+            {"js": "var z = 1;"}
+
+    # a job that is out of time before it gets to a worker leaves the worker
+    # alone:
+    processes = [ worker.process for worker in server.workers.queue ]
+    try:
+        server.compile_batch(["z = 2"], time.time() - 1)
+    except CompileTimeout:
+        pass
+    else:
+        raise AssertionError("no timeout")
+    assert sorted([ worker.process for worker in server.workers.queue ]) == \
+            sorted(processes)
+    assert all([ process.is_alive() for process in processes ])
+    request("/nothing", status=404)
+
+    # concurrent requests share the workers:
+    results = {}
+    def compile(i):
+        results[i] = request("/compile", {"source": "y = %d" % i})
+    threads = [ threading.Thread(target=compile, args=(i,))
+            for i in range(20) ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    for i in range(20):
+        assert results[i] == {"js": "var y = %d;" % i}
+finally:
+    server.shutdown()
+    server.server_close()
+
+# a worker that times out is replaced by a fresh one:
+worker = Worker()
+try:
+    source = "x = 1\n" * 5000
+    try:
+        worker.compile([source], timeout=0)
+    except CompileTimeout:
+        pass
+    else:
+        raise AssertionError("no timeout")
+    assert worker.compile(["x = 1"]) == [{"js": "var x = 1;"}]
+finally:
+    worker.close()
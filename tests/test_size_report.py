@@ -0,0 +1,107 @@
+"""
+Tests the size report: the attribution of the output to modules, classes,
+functions and runtime components, and the size budget.
+"""
+
+import os
+import json
+import shutil
+import tempfile
+import subprocess
+
+from py2js import SourceMap, module_sizes, gzip_size, convert_py2js
+
+directory = tempfile.mkdtemp()
+
+try:
+    filename = os.path.join(directory, "a.py")
+    f = open(filename, "w")
+    f.write("""\
+class A(object):
+    def f(self, x):
+        return x + 1
+
+def big():
+    def g(y):
+        return y * 2
+    x = 0
+    for i in range(10):
+        x += g(i)
+    return x
+
+print A().f(big())
+""")
+    f.close()
+
+    sourcemap = SourceMap(filename)
+    js = convert_py2js(open(filename).read(), sourcemap=sourcemap) + "\n"
+    module = module_sizes(filename, js, sourcemap.mappings)
+    assert module["name"] == filename
+    assert module["raw"] == len(js)
+    assert module["gzip"] == gzip_size(js)
+    sizes = dict([ (entry["name"], entry) for entry in module["definitions"] ])
+    assert sorted(sizes) == ["<module>", "A", "A.f", "big", "big.g"]
+    assert sizes["A"]["kind"] == "class"
+    assert sizes["big.g"]["kind"] == "function"
+    # every byte is counted once, for the innermost definition:
+    assert sum([ entry["raw"] for entry in module["definitions"] ]) == len(js)
+    assert sizes["big"]["raw"] > sizes["big.g"]["raw"]
+    raws = [ entry["raw"] for entry in module["definitions"] ]
+    assert raws == sorted(raws, reverse=True)
+
+    report_file = os.path.join(directory, "report.json")
+    p = subprocess.Popen(["python", "py2js.py", "--include-builtins",
+        "--size-report", report_file, filename], stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE)
+    out, err = p.communicate()
+    assert p.returncode == 0, err
+    report = json.load(open(report_file))
+    assert report["modules"][0]["name"] == filename
+    assert "$class" in [ entry["name"]
+        for entry in report["runtime"]["components"] ]
+    assert report["runtime"]["raw"] + report["modules"][0]["raw"] == \
+        report["total"]["raw"]
+    # the runtime and the module are separated by a newline:
+    assert report["total"]["raw"] + 1 == len(out)
+    assert "big.g" in err and "runtime" in err
+
+    # the budget:
+    for budget, returncode in [(len(js), 0), (len(js) - 1, 1)]:
+        p = subprocess.Popen(["python", "py2js.py", "--size-budget",
+            str(budget), filename], stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE)
+        out, err = p.communicate()
+        assert p.returncode == returncode, (budget, err)
+        assert ("over the budget" in err) == bool(returncode)
+
+    # the files that are written are measured, with their runtime and
+    # wrapper:
+    out_dir = os.path.join(directory, "out")
+    for options in [["--scoped"], ["--format", "commonjs"],
+            ["--include-builtins"], ["--include-builtins", "--full-runtime",
+                "--stream", "--minify"]]:
+        p = subprocess.Popen(["python", "py2js.py", "-o", out_dir,
+            "--size-report", report_file, filename] + options,
+            stderr=subprocess.PIPE)
+        err = p.communicate()[1]
+        assert p.returncode == 0, err
+        report = json.load(open(report_file))
+        module, = report["modules"]
+        written = open(os.path.join(out_dir, "a.js")).read()
+        assert module["raw"] == len(written) == report["total"]["raw"], \
+                options
+        sizes = dict([ (entry["name"], entry)
+            for entry in module["definitions"] ])
+        assert sum([ entry["raw"] for entry in sizes.values() ]) == \
+                len(written)
+        assert "big.g" in sizes
+        assert ("<runtime>" in sizes) == ("--include-builtins" in options)
+        assert report["runtime"] is None
+
+    p = subprocess.Popen(["python", "py2js.py", "-o", out_dir,
+        "--incremental", "--size-budget", "1000", filename],
+        stderr=subprocess.PIPE)
+    p.communicate()
+    assert p.returncode == 2
+finally:
+    shutil.rmtree(directory)
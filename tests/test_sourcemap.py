@@ -0,0 +1,114 @@
+"""
+Tests the source maps: the encoding of the mappings and that the
+generated lines map back to the Python statements they come from.
+"""
+
+import os
+import json
+import shutil
+import base64
+import tempfile
+import subprocess
+
+from py2js import vlq, base64_digits, SourceMap, convert_py2js
+
+def decode(mappings):
+    """Returns the absolute (line, column, source_line, source_column). """
+    result = []
+    source_line = source_column = 0
+    for line, segments in enumerate(mappings.split(";")):
+        column = 0
+        for segment in filter(None, segments.split(",")):
+            values = []
+            value = shift = 0
+            for digit in segment:
+                digit = base64_digits.index(digit)
+                value += (digit & 31) << shift
+                shift += 5
+                if not digit & 32:
+                    values.append(value & 1 and -(value >> 1) or value >> 1)
+                    value = shift = 0
+            column += values[0]
+            source_line += values[2]
+            source_column += values[3]
+            result.append((line, column, source_line, source_column))
+    return result
+
+assert [ vlq(n) for n in (0, 1, -1, 15, 16, -16, 1000) ] == \
+        ["A", "C", "D", "e", "gB", "hB", "w+B"]
+
+m = SourceMap("a.py")
+m.add(0, 4, 2, 0)
+m.add(0, 10, 3, 4)
+m.add(2, 0, 1, 0)
+assert decode(m.encode()) == m.mappings
+m.shift(3)
+assert decode(m.encode())[0] == (3, 4, 2, 0)
+
+source = """\
+def add(a, b):
+    return a + b
+
+x = 1
+if x:
+    print add(x, 2)
+"""
+
+def check(js, m):
+    lines = js.split("\n")
+    mapped = {}
+    for line, column, source_line, source_column in decode(m.encode()):
+        mapped[lines[line][column:]] = source_line + 1, source_column
+    return mapped
+
+for minify in (False, True):
+    m = SourceMap("a.py", source)
+    js = convert_py2js(source, minify=minify, sourcemap=m)
+    assert js == convert_py2js(source, minify=minify)
+    mapped = check(js, m)
+    assert [ position for code, position in sorted(mapped.items())
+        if code.startswith("return") ] == [(2, 4)], mapped
+    assert [ position for code, position in mapped.items()
+        if code.startswith("py_builtins.print") ] == [(6, 4)], mapped
+    assert [ position for code, position in mapped.items()
+        if code.startswith("var x") ] == [(4, 0)], mapped
+
+data = json.loads(m.dumps())
+assert data["version"] == 3 and data["sources"] == ["a.py"]
+assert data["sourcesContent"] == [source]
+
+# the command line writes the map next to the output:
+directory = tempfile.mkdtemp()
+try:
+    filename = os.path.join(directory, "a.py")
+    f = open(filename, "w")
+    f.write(source)
+    f.close()
+
+    out = os.path.join(directory, "out")
+    for options in [["--source-map"], ["--source-map", "--include-builtins"],
+            ["--inline-source-map", "--minify", "--include-builtins"]]:
+        shutil.rmtree(out, True)
+        subprocess.check_call(["python", "py2js.py", "-o", out] + options +
+            [filename])
+        js = open(os.path.join(out, "a.js")).read()
+        comment = js.rstrip("\n").split("\n")[-1]
+        assert comment.startswith("//# sourceMappingURL="), comment
+        if "--inline-source-map" in options:
+            assert not os.path.exists(os.path.join(out, "a.js.map"))
+            data = json.loads(base64.b64decode(comment.split(",", 1)[1]))
+        else:
+            assert comment == "//# sourceMappingURL=a.js.map"
+            data = json.load(open(os.path.join(out, "a.js.map")))
+        assert data["file"] == "a.js"
+        assert data["sources"] == ["../a.py"]
+        lines = js.split("\n")
+        for line, column, source_line, source_column in \
+                decode(data["mappings"]):
+            if lines[line][column:].startswith("return"):
+                assert (source_line, source_column) == (1, 4)
+                break
+        else:
+            assert False, data["mappings"]
+finally:
+    shutil.rmtree(directory)
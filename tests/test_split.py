@@ -0,0 +1,118 @@
+"""
+Tests splitting a bundle into chunks: modules run when they are first
+imported (and again if that failed), and a chunk is only loaded when one
+of its modules is.
+"""
+
+import os
+import json
+import shutil
+import tempfile
+import subprocess
+
+from py2js import Bundle
+
+directory = tempfile.mkdtemp()
+try:
+    def write(name, source):
+        path = os.path.join(directory, name)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        f = open(path, "w")
+        f.write(source)
+        f.close()
+
+    write("main.py", """\
+import shapes.square
+print "main"
+print shapes.square.area(3)
+
+def later():
+    import reports
+    return reports.total([1, 2])
+
+if False:
+    print later()
+""")
+    write("shapes/__init__.py", "print 'shapes'\n")
+    write("shapes/square.py", """\
+from shapes.util import twice
+print 'square'
+def area(side):
+    return twice(side * side) / 2
+""")
+    write("shapes/util.py", "def twice(x):\n    return 2 * x\n")
+    write("reports.py", "def total(values):\n    return sum(values)\n")
+
+    b = Bundle(os.path.join(directory, "main.py"), lazy=True)
+    main, chunks = b.split([("shapes", ["shapes"])])
+    assert [ (chunk, modules) for chunk, modules, js in chunks ] == [
+            ("shapes", ["shapes", "shapes.util", "shapes.square"]),
+            ("reports", ["reports"])], chunks
+    assert "$define('__main__'" in main and "$define('reports'" not in main
+    assert "$import('shapes.square', 'shapes')" in main
+
+    out = os.path.join(directory, "out")
+    subprocess.check_call(["python", "py2js.py", "--bundle", "--split",
+        "--chunk", "shapes=shapes", "-o", out,
+        os.path.join(directory, "main.py")])
+    files = sorted(os.listdir(out))
+    assert len(files) == 3 and "main.js" in files, files
+    assert files[1].startswith("reports-") and \
+            files[2].startswith("shapes-"), files
+
+    # a loader that reads the chunks from a table instead of the network:
+    sources = {}
+    for name in files:
+        sources[name] = open(os.path.join(out, name)).read()
+    write("loader.js", """\
+var sources = %s;
+var loaded = [];
+$import.loader = function(url) {
+    loaded.push(url);
+    (0, eval)(sources[url]);
+};
+""" % json.dumps(sources))
+    write("after.js", "print(loaded);\n")
+    output = subprocess.Popen(["js", "-f", "py-builtins.js",
+        "-f", os.path.join(directory, "loader.js"),
+        "-f", os.path.join(out, "main.js"),
+        "-f", os.path.join(directory, "after.js")],
+        stdout=subprocess.PIPE).communicate()[0]
+    assert output.split("\n") == ["shapes", "square", "main", "9",
+        files[2], ""], output
+
+    # a module that fails runs again on the next import, and a chunk that
+    # doesn't have the module raises an ImportError:
+    write("failing.js", """\
+var runs = 0;
+$define('flaky', function($exports) {
+    runs += 1;
+    $exports.partial = true;
+    if (runs < 3) {
+        throw new py_builtins.ValueError('run ' + runs);
+    }
+});
+for (var i = 0; i < 3; i++) {
+    try {
+        var flaky = $import('flaky');
+        print(runs, flaky.partial);
+    } catch (e) {
+        print(runs, e.message);
+    }
+}
+$import.chunks['ghost'] = 'empty.js';
+$import.loader = function(url) {};
+try {
+    $import('ghost');
+} catch (e) {
+    print(e instanceof py_builtins.ImportError, e.message);
+}
+""")
+    output = subprocess.Popen(["js", "-f", "py-builtins.js",
+        "-f", os.path.join(directory, "failing.js")],
+        stdout=subprocess.PIPE).communicate()[0]
+    assert output.split("\n") == ["1 run 1", "2 run 2", "3 true",
+        "true no module named ghost in empty.js", ""], output
+finally:
+    shutil.rmtree(directory)
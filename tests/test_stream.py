@@ -0,0 +1,73 @@
+"""
+Tests that the streaming compiler splits a module into its top-level
+statements correctly and translates them like convert_py2js().
+"""
+
+import os
+import tempfile
+from StringIO import StringIO
+
+import py2js
+from py2js import iter_statements, convert_py2js, convert_py2js_stream, \
+        write_runtime, runtime
+
+source = '''\
+# a comment
+from __future__ import division
+x = [1,
+     2]
+
+def f(a):
+    """
+    docstring
+    """
+    if a:
+        return 1
+    else:
+        return 2
+
+if x:
+    print x
+elif f(1):
+    pass
+else:
+    print "no"
+
+@JavaScript
+class A(object):
+    def g(self):
+        pass
+for i in x:
+    print i
+else:
+    print "done"
+y = 1; z = 2
+'''
+
+statements = list(iter_statements(StringIO(source).readline))
+assert [ lineno for s, lineno in statements ] == [1, 3, 6, 15, 22, 26, 30]
+assert "".join([ s for s, lineno in statements ]) == source
+
+# py2js doesn't translate imports:
+source = source.replace("from __future__ import division\n", "")
+
+fd, filename = tempfile.mkstemp(suffix=".py")
+os.write(fd, source)
+os.close(fd)
+
+try:
+    stream = StringIO()
+    convert_py2js_stream(filename, stream)
+    assert stream.getvalue() == convert_py2js(source)
+finally:
+    os.remove(filename)
+
+# the whole runtime is copied without reading it into one string:
+expected = runtime() + "\n"
+py2js.runtime = None
+try:
+    stream = StringIO()
+    assert write_runtime(stream) == expected.count("\n")
+    assert stream.getvalue() == expected
+finally:
+    py2js.runtime = runtime
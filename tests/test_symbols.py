@@ -0,0 +1,65 @@
+"""
+Tests the symbol tables of the scopes and the declaration of the locals
+of functions with one 'var' at their start.
+"""
+
+import ast
+
+from py2js import symbol_table, convert_py2js
+
+source = """\
+count = 0
+def outer(values):
+    total = 0
+    def inner(x):
+        global count
+        count += 1
+        y = x + total
+        return y
+    class C(object):
+        def m(self):
+            return total + len(values)
+    return inner(1)
+"""
+
+tree = ast.parse(source)
+module = symbol_table(tree)
+assert module.locals == set(["count", "outer"])
+outer = module.children[tree.body[1]]
+assert outer.kind == "function"
+assert outer.locals == set(["values", "total", "inner", "C"])
+assert outer.cells == set(["total", "values"])
+assert outer.free == set()
+
+inner = outer.children[tree.body[1].body[1]]
+assert inner.locals == set(["x", "y"])
+assert inner.globals == set(["count"])
+assert inner.free == set(["total"])
+assert [ inner.lookup(name) for name in ("y", "total", "count", "len") ] == \
+        ["local", "free", "global", "global"]
+
+# functions in classes skip them, but still pass through them:
+c = outer.children[tree.body[1].body[2]]
+assert c.kind == "class" and c.free == set(["total", "values"])
+m = c.children[tree.body[1].body[2].body[0]]
+assert m.free == set(["total", "values"])
+
+js = convert_py2js(source)
+assert "    var C, inner, total;\n    total = 0;\n" in js, js
+assert "        var y;\n        count += 1;\n        y = (x)+(total);\n" in js
+assert "var count = 0;" in js and "var count =" not in js.split("\n", 1)[1]
+
+# names bound after a function at the top level are declared once:
+js = convert_py2js("""\
+def f():
+    a, b = 1, 2
+    for i in range(2):
+        for j in [a, b]:
+            pass
+a, b = 3, 4
+for j in [a]:
+    pass
+""")
+assert js.count("var a = ") == 1 and js.count("var b = ") == 1, js
+assert "    var a, b, i, j;\n" in js
+assert js.count("var j;") == 1 and "var i" not in js.replace("var a, b, i", "")
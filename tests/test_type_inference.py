@@ -0,0 +1,26 @@
+"""
+Tests that the type inference of a scope takes time linear in its size,
+also for long chains of names that depend on each other.
+"""
+
+import ast
+
+from py2js import TypeInference
+
+class CountingInference(TypeInference):
+    calls = 0
+
+    def type_of(self, node, types):
+        self.calls += 1
+        return TypeInference.type_of(self, node, types)
+
+n = 2000
+for order in [range(1, n), range(n - 1, 0, -1)]:
+    source = "v0 = 0\n" + "".join([ "v%d = v%d + 1\n" % (i, i - 1)
+        for i in order ]) + "w = 0.5\nw += v%d\n" % (n - 1)
+    inference = CountingInference()
+    types = inference.infer(ast.parse(source).body)
+    assert types["v0"] == types["v%d" % (n - 1)] == "int"
+    assert types["w"] == "float"
+    # every name is looked at again only when a type it uses changed:
+    assert inference.calls <= 3 * n, inference.calls
@@ -0,0 +1,61 @@
+"""
+Tests that --watch compiles new and changed files and removes the output of
+deleted ones while it keeps running.
+"""
+
+import os
+import sys
+import time
+import shutil
+import signal
+import tempfile
+import subprocess
+
+directory = tempfile.mkdtemp()
+src = os.path.join(directory, "src")
+out = os.path.join(directory, "out")
+os.makedirs(src)
+
+def write(filename, source):
+    f = open(os.path.join(src, filename), "w")
+    f.write(source)
+    f.close()
+
+def wait_for(condition, timeout=10):
+    end = time.time() + timeout
+    while not condition():
+        assert time.time() < end
+        time.sleep(0.05)
+
+def output(filename):
+    filename = os.path.join(out, filename)
+    if os.path.exists(filename):
+        return open(filename).read()
+    return None
+
+write("a.py", "x = 1\n")
+process = subprocess.Popen([sys.executable, "py2js.py", "--no-cache",
+    "--watch", "--interval", "0.05", "-o", out, src],
+    stderr=open(os.devnull, "w"))
+
+try:
+    wait_for(lambda: output("a.js") == "var x = 1;\n")
+
+    write("a.py", "x = 22\n")
+    write("b.py", "y = 2\n")
+    wait_for(lambda: output("a.js") == "var x = 22;\n")
+    wait_for(lambda: output("b.js") == "var y = 2;\n")
+
+    os.remove(os.path.join(src, "b.py"))
+    wait_for(lambda: output("b.js") is None)
+
+    # a failure doesn't stop watching:
+    write("c.py", "del x\n")
+    time.sleep(0.2)
+    write("c.py", "z = 3\n")
+    wait_for(lambda: output("c.js") == "var z = 3;\n")
+    assert process.poll() is None
+finally:
+    os.kill(process.pid, signal.SIGINT)
+    process.wait()
+    shutil.rmtree(directory)